@@ -0,0 +1,197 @@
+"""
+Auto-tuning of the launch configuration (ranks x threads x CoreNEURON cell permutation) of a
+paradigm for a budget of cores, with short calibration runs and successive halving
+"""
+
+import argparse
+import json
+import math
+import os
+import numpy as np
+import benchmark_scheduler
+from run_coreneuron_busyring_benchmarks import read_run_record
+
+class Candidate:
+    """
+    Launch configuration with the model-run times of its calibration runs.
+    """
+    def __repr__(self):
+        return f"{self.num_ranks} ranks x {self.num_threads} threads, permutation {self.permutation}"
+
+    def __init__(self, num_ranks, num_threads, permutation):
+        self.num_ranks = num_ranks      # number of MPI ranks
+        self.num_threads = num_threads  # number of threads per rank
+        self.permutation = permutation  # CoreNEURON cell permutation ('cell_permute')
+        self.runtimes = {}              # model-run time in s for each simulated duration in ms
+
+    def name(self):
+        return f"r{self.num_ranks}_t{self.num_threads}_p{self.permutation}"
+
+    def score(self, duration):
+        '''
+        Returns the model-run time of the calibration run of the given duration (infinite if it has failed).
+        '''
+        runtime = self.runtimes.get(duration, math.inf)
+        return runtime if np.isfinite(runtime) else math.inf
+
+    def predict(self, duration):
+        '''
+        Predicts the model-run time for the given duration from the calibration runs: linear in the duration
+        (with the fixed cost, e.g., of the transfer to CoreNEURON, as intercept) if there are runs of at least
+        two durations, proportional to it otherwise.
+        '''
+        measured = [(d, t) for d, t in sorted(self.runtimes.items()) if np.isfinite(t)]
+        if not measured:
+            return math.inf
+        if len(measured) == 1:
+            d, t = measured[0]
+            return t * duration / d
+        (slope, intercept) = np.polyfit([d for d, _ in measured], [t for _, t in measured], 1)
+        if slope <= 0:
+            d, t = measured[-1]
+            return t * duration / d
+        return max(intercept, 0) + slope * duration
+
+def candidates(num_cores, permutations, min_threads=1, max_threads=None):
+    '''
+    Returns the candidates that use all cores (each split into ranks x threads, with each permutation).
+    '''
+    splits = [(num_cores // num_threads, num_threads) for num_threads in range(1, num_cores + 1)
+              if num_cores % num_threads == 0 and num_threads >= min_threads
+              and (max_threads is None or num_threads <= max_threads)]
+    return [Candidate(num_ranks, num_threads, permutation)
+            for num_ranks, num_threads in splits for permutation in permutations]
+
+def launch_command(candidate, params_file, duration, config, record_file=""):
+    '''
+    Returns the command to run the paradigm with the configuration of a candidate.
+    '''
+    return (f"{config['mpiexec']} -n {candidate.num_ranks} {config['mpiexec_args']} ./x86_64/special -mpi -python "
+            f"run_ring_network.py -coreneuron -num_threads {candidate.num_threads} -permutation {candidate.permutation} "
+            f"-params_file '{params_file}' -duration {duration:g}" +
+            (f" -dataset_cache '{config['dataset_cache']}'" if config['dataset_cache'] else "") +
+            (f" -record '{record_file}' -spike_output none" if record_file else ""))
+
+def run_rung(rung, pool, params_file, duration, config):
+    '''
+    Runs the calibration runs of the given duration for all candidates of a rung, one after the
+    other (each with all cores), and stores their model-run times. Runs that have finished before
+    (cf. the state file of the rung) are not repeated, such that the tuning can be resumed. The
+    duration simulated by each run is checked against the run record.
+    '''
+    workdir = config["workdir"]
+    jobs = []
+    for candidate in pool:
+        log_file = os.path.join(workdir, f"rung{rung}_{candidate.name()}.log")
+        record_file = log_file.replace(".log", ".json")
+        jobs.append(benchmark_scheduler.Job(f"rung{rung}_{candidate.name()}",
+                                            launch_command(candidate, params_file, duration, config, record_file),
+                                            log_file, candidate.num_ranks * candidate.num_threads,
+                                            candidate.name(), {"record_file": record_file}))
+    scheduler = benchmark_scheduler.Scheduler(os.path.join(workdir, f"rung{rung}_state.json"), config["cores"],
+                                              config["timeout"])
+    scheduler.run(jobs, lambda job: read_run_record(job.config["record_file"]))
+    done = set(scheduler.state["done"])
+    for candidate, job in zip(pool, jobs):
+        runtime = math.inf
+        if job.job_id in done and os.path.exists(job.config["record_file"]):
+            with open(job.config["record_file"]) as f:
+                simulated = json.load(f)["parameters"]["duration"]
+            if not math.isclose(simulated, duration):
+                raise ValueError(f"The calibration run '{job.job_id}' has simulated {simulated:g} ms instead of {duration:g} ms.")
+            runtime = read_run_record(job.config["record_file"])[0]["runtime_model_run"]
+        candidate.runtimes[duration] = runtime
+        print(f"  {candidate}: model-run {runtime:.3f} s for {duration:g} ms", flush=True)
+
+def successive_halving(pool, params_file, first_duration, config):
+    '''
+    Runs the candidates with calibration runs of increasing duration: after each rung, the best
+    1/eta of the candidates are kept, and the duration is multiplied by eta (up to the duration
+    of the paradigm, 'max_duration' of the configuration).
+
+    Returns
+    -------
+    best : Candidate
+      The best candidate of the last rung.
+    rungs : list of tuple
+      Duration and candidates of each rung.
+    '''
+    eta = config["eta"]
+    duration = first_duration
+    rungs = []
+    rung = 0
+    while True:
+        print(f"Rung {rung}: {len(pool)} candidates with calibration runs of {duration:g} ms", flush=True)
+        run_rung(rung, pool, params_file, duration, config)
+        rungs.append((duration, list(pool)))
+        pool = sorted(pool, key=lambda candidate: candidate.score(duration))
+        if len(pool) <= 1 or not np.isfinite(pool[0].score(duration)) or duration >= config["max_duration"]:
+            break
+        pool = pool[:max(1, math.ceil(len(pool) / eta))]
+        if len(pool) == 1:
+            # one more rung for the winner, to predict the fixed cost of the run
+            duration = min(duration * eta, config["max_duration"])
+            rung += 1
+            print(f"Rung {rung}: {pool[0]} with a calibration run of {duration:g} ms", flush=True)
+            run_rung(rung, pool, params_file, duration, config)
+            rungs.append((duration, list(pool)))
+            break
+        duration = min(duration * eta, config["max_duration"])
+        rung += 1
+    return pool[0], rungs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finds the best split of a core budget into ranks and threads, and the best "
+                                                 "CoreNEURON cell permutation, for a paradigm (by short calibration runs "
+                                                 "and successive halving)")
+    parser.add_argument("params_file", help="paradigm (JSON file as for run_ring_network.py)")
+    parser.add_argument("-cores", help="number of cores to use (ranks x threads)", type=int, default=os.cpu_count())
+    parser.add_argument("-permutations", nargs='+', help="CoreNEURON cell permutations to try", type=int, default=[0, 1])
+    parser.add_argument("-min_threads", help="minimum number of threads per rank", type=int, default=1)
+    parser.add_argument("-max_threads", help="maximum number of threads per rank (default: all cores)", type=int, default=None)
+    parser.add_argument("-min_delays", help="duration of the first calibration runs in minimum delays", type=int, default=4)
+    parser.add_argument("-eta", help="factor by which the candidates are reduced and the duration is increased per rung",
+                        type=int, default=2)
+    parser.add_argument("-dataset_cache", help="directory to cache CoreNEURON datasets in (the model of each split is then "
+                                               "only built once)", type=str, default="coreneuron_datasets")
+    parser.add_argument("-mpiexec", help="MPI launcher", type=str, default="mpiexec")
+    parser.add_argument("-mpiexec_args", help="additional arguments of the MPI launcher", type=str, default="")
+    parser.add_argument("-timeout", help="timeout per calibration run in s", type=float, default=600)
+    parser.add_argument("-workdir", help="directory for the logs, records and states of the calibration runs", type=str,
+                        default="autotune")
+    parser.add_argument("-output", help="JSON file to write the results to", type=str, default="autotune_result.json")
+    args = parser.parse_args(argv)
+    if args.eta < 2:
+        raise ValueError("The reduction factor eta has to be at least 2.")
+
+    with open(args.params_file) as f:
+        paradigm = json.load(f)
+    duration = paradigm["duration"]
+    first_duration = args.min_delays * paradigm["min-delay"]
+    config = {"cores": args.cores, "eta": args.eta, "max_duration": duration, "dataset_cache": args.dataset_cache, "mpiexec": args.mpiexec,
+              "mpiexec_args": args.mpiexec_args, "timeout": args.timeout, "workdir": args.workdir}
+    os.makedirs(args.workdir, exist_ok=True)
+
+    pool = candidates(args.cores, args.permutations, args.min_threads, args.max_threads)
+    if not pool:
+        raise ValueError(f"No split of {args.cores} cores with the given thread limits.")
+    best, rungs = successive_halving(pool, args.params_file, first_duration, config)
+    predicted = best.predict(duration)
+    if not np.isfinite(predicted):
+        raise SystemExit("All calibration runs have failed (see the logs in the working directory).")
+
+    command = launch_command(best, args.params_file, duration, dict(config, dataset_cache=""))
+    print(f"Recommended configuration: {best}\n"
+          f"Predicted model-run time for {duration:g} ms: {predicted:.3f} s\n"
+          f"Command: {command}")
+    with open(args.output, "w") as f:
+        json.dump({"params_file": args.params_file, "cores": args.cores,
+                   "recommended": {"num_ranks": best.num_ranks, "num_threads": best.num_threads,
+                                   "permutation": best.permutation},
+                   "predicted_model_run": predicted, "command": command,
+                   "rungs": [{"duration": d, "runtimes": {c.name(): c.score(d) if np.isfinite(c.score(d)) else None
+                                                          for c in pool_}}
+                             for d, pool_ in rungs]}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
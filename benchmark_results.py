@@ -0,0 +1,316 @@
+"""
+Results store of the busyring benchmarks: parsing of log files, typed storage in an SQLite
+database, statistics over trials, and detection of regressions against stored baselines
+"""
+
+import argparse
+import datetime
+import json
+import math
+import re
+import sqlite3
+import numpy as np
+
+# Keywords to look for in the log files, with the variables and the index of the column
+# after the keyword to extract (cf. 'run_coreneuron_busyring_benchmarks.extract_benchmark_data()')
+log_keywords = {"model-init" : [("runtime_model_init", 0)],
+                "dataset-startup" : [("runtime_dataset_startup", 0)],
+                "dataset-write" : [("runtime_dataset_write", 0)],
+                "dataset-cache" : [("dataset_cache", 0)],
+                "model-run" : [("runtime_model_run", 0)],
+                "meter-total" : [("runtime_total", 0)],
+                " Memory (MBs) :          After nrn_setup" : [("memory_nrn_setup", 2)],
+                "Memory (MBs) :     After nrn_finitialize" : [("memory_nrn_finitialize", 2)],
+                "Model size" : [("model_size", 1)],
+                "Setup Done" : [("runtime_coreneuron_setup", 1)],
+                "num_mpi=" : [("num_ranks_log", 0)],
+                "Cell stats:" : [("num_cells", 0), ("num_segments", 2), ("num_compartments", 4)]}
+log_pattern = re.compile("|".join(re.escape(keyword) for keyword in log_keywords))
+
+# Columns of the database table of runs, with their types
+run_columns = [("job_id", "TEXT"),
+               ("trial_in_launch", "INTEGER"),
+               ("paradigm", "TEXT"),
+               ("num_threads", "INTEGER"),
+               ("num_ranks", "INTEGER"),
+               ("num_ranks_log", "INTEGER"),
+               ("gpu", "INTEGER"),
+               ("variant", "TEXT"),
+               ("launch", "INTEGER"),
+               ("trials_per_launch", "INTEGER"),
+               ("dataset_cache", "TEXT"),
+               ("runtime_model_init", "REAL"),
+               ("runtime_dataset_startup", "REAL"),
+               ("runtime_coreneuron_setup", "REAL"),
+               ("runtime_dataset_write", "REAL"),
+               ("runtime_model_run", "REAL"),
+               ("runtime_total", "REAL"),
+               ("runtime_init_max", "REAL"),
+               ("runtime_init_imbalance", "REAL"),
+               ("runtime_run_max", "REAL"),
+               ("runtime_run_imbalance", "REAL"),
+               ("memory_nrn_setup", "REAL"),
+               ("memory_nrn_finitialize", "REAL"),
+               ("memory_network_built_max", "REAL"),
+               ("memory_network_built_total", "REAL"),
+               ("memory_after_psolve_max", "REAL"),
+               ("memory_after_psolve_total", "REAL"),
+               ("memory_peak_max", "REAL"),
+               ("memory_peak_total", "REAL"),
+               ("aborted_at", "REAL"),
+               ("spike_mismatches", "INTEGER"),
+               ("model_size", "REAL"),
+               ("num_cells", "INTEGER"),
+               ("num_segments", "INTEGER"),
+               ("num_compartments", "INTEGER"),
+               ("recorded_at", "TEXT")]
+run_column_types = dict(run_columns)
+
+# Columns that identify a configuration (the trials of a configuration are aggregated)
+config_columns = ["paradigm", "num_ranks", "num_threads", "gpu", "variant"]
+
+# Fields of the benchmark driver that are renamed in the database (the numbers of ranks and threads of a
+# configuration are the ones that have been set; the number of ranks reported by CoreNEURON is 'num_ranks_log')
+renamed_fields = {"num_threads_set" : "num_threads", "num_ranks_set" : "num_ranks"}
+
+def parse_log(input_file):
+    '''
+    Extracts the essential information from a log file in one pass (one search
+    with a compiled pattern of all keywords per line).
+
+    Parameters
+    ----------
+    input_file : str
+      Name of the log file.
+
+    Returns
+    -------
+    results : dict
+      The extracted values as strings (NaN for values that have not been found).
+    '''
+    results = {var_name : np.nan for variables in log_keywords.values() for var_name, _ in variables}
+    with open(input_file, 'r') as file:
+        for line in file:
+            for match in log_pattern.finditer(line):
+                fields = line[match.end():].split()
+                for var_name, index in log_keywords[match.group(0)]:
+                    if index < len(fields):
+                        results[var_name] = fields[index].replace(",", "")
+    return results
+
+def to_type(value, sql_type):
+    '''
+    Converts a value to the Python type of an SQL column type (None for missing values).
+    '''
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    try:
+        if sql_type == "INTEGER":
+            return int(float(value))
+        elif sql_type == "REAL":
+            return float(value)
+    except ValueError:
+        return None
+    return str(value)
+
+def connect(db_file):
+    '''
+    Opens the results database (and creates the tables and indices if necessary).
+    '''
+    db = sqlite3.connect(db_file)
+    db.execute(f"CREATE TABLE IF NOT EXISTS runs ({', '.join(f'{name} {sql_type}' for name, sql_type in run_columns)}, "
+               f"UNIQUE (job_id, trial_in_launch))")
+    # add the columns that have been introduced after the database was created
+    existing = {row[1] for row in db.execute("PRAGMA table_info(runs)")}
+    for name, sql_type in run_columns:
+        if name not in existing:
+            db.execute(f"ALTER TABLE runs ADD COLUMN {name} {sql_type}")
+    db.execute(f"CREATE INDEX IF NOT EXISTS runs_config ON runs ({', '.join(config_columns)})")
+    db.execute(f"CREATE TABLE IF NOT EXISTS baselines (name TEXT, metric TEXT, "
+               f"{', '.join(f'{name} {run_column_types[name]}' for name in config_columns)}, "
+               f"n INTEGER, median REAL, q25 REAL, q75 REAL, ci_low REAL, ci_high REAL, recorded_at TEXT, "
+               f"UNIQUE (name, metric, {', '.join(config_columns)}))")
+    return db
+
+def store_runs(db_file, rows):
+    '''
+    Stores rows of results (as written by the benchmark driver) in the database, in one
+    transaction. Fields that are not columns (e.g., sweep variants) are stored as JSON in
+    the column 'variant'. Rows of the same job and trial replace earlier ones.
+    '''
+    db = connect(db_file)
+    recorded_at = datetime.datetime.now().isoformat(timespec='seconds')
+    with db:
+        for row in rows:
+            row = {renamed_fields.get(key, key) : value for key, value in row.items()}
+            variant = {key : value for key, value in row.items() if key not in run_column_types}
+            row = {key : to_type(value, run_column_types[key]) for key, value in row.items() if key in run_column_types}
+            row["variant"] = json.dumps(variant, sort_keys=True, default=str)
+            row.setdefault("recorded_at", recorded_at)
+            db.execute(f"INSERT OR REPLACE INTO runs ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                       list(row.values()))
+    db.close()
+
+def statistics(values, confidence=0.95, num_bootstrap=2000, seed=0):
+    '''
+    Computes the median, the interquartile range, and a bootstrap confidence interval
+    of the median.
+
+    Returns
+    -------
+    stats : dict
+      With entries 'n', 'median', 'q25', 'q75', 'ci_low' and 'ci_high'.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {"n" : 0, "median" : np.nan, "q25" : np.nan, "q75" : np.nan, "ci_low" : np.nan, "ci_high" : np.nan}
+    q25, median, q75 = np.percentile(values, [25, 50, 75])
+    rng = np.random.default_rng(seed)
+    medians = np.median(rng.choice(values, size=(num_bootstrap, len(values)), replace=True), axis=1)
+    alpha = (1 - confidence) / 2
+    ci_low, ci_high = np.percentile(medians, [100*alpha, 100*(1-alpha)])
+    return {"n" : len(values), "median" : median, "q25" : q25, "q75" : q75, "ci_low" : ci_low, "ci_high" : ci_high}
+
+def aggregate(db_file, metric="runtime_model_run", paradigm=None):
+    '''
+    Computes the statistics of a metric over the trials of each configuration (without the
+    runs that have been aborted for a too low throughput, whose runtimes are incomplete).
+
+    Parameters
+    ----------
+    db_file : str
+      Name of the database file.
+    metric : str
+      Column to aggregate.
+    paradigm : str
+      Restricts the aggregation to one paradigm (all paradigms if None).
+
+    Returns
+    -------
+    aggregates : list of dict
+      One entry per configuration, with the configuration columns and the statistics.
+    '''
+    if run_column_types.get(metric) not in ("REAL", "INTEGER"):
+        raise ValueError(f"Unknown numeric metric '{metric}'.")
+    db = connect(db_file)
+    query = f"SELECT {', '.join(config_columns)}, {metric} FROM runs WHERE aborted_at IS NULL"
+    params = []
+    if paradigm is not None:
+        query += " AND paradigm = ?"
+        params.append(paradigm)
+    groups = {}
+    for row in db.execute(query, params):
+        groups.setdefault(row[:-1], []).append(np.nan if row[-1] is None else row[-1])
+    db.close()
+    aggregates = []
+    for config in sorted(groups, key=lambda c: tuple(str(v) for v in c)):
+        entry = dict(zip(config_columns, config))
+        entry.update(statistics(groups[config]))
+        aggregates.append(entry)
+    return aggregates
+
+def save_baseline(db_file, name, metric="runtime_model_run"):
+    '''
+    Stores the current statistics of a metric of all configurations as baseline.
+    '''
+    aggregates = aggregate(db_file, metric)
+    recorded_at = datetime.datetime.now().isoformat(timespec='seconds')
+    db = connect(db_file)
+    with db:
+        for entry in aggregates:
+            columns = ["name", "metric"] + config_columns + ["n", "median", "q25", "q75", "ci_low", "ci_high", "recorded_at"]
+            values = [name, metric] + [entry[c] for c in config_columns] + \
+                     [entry[c] for c in ["n", "median", "q25", "q75", "ci_low", "ci_high"]] + [recorded_at]
+            db.execute(f"INSERT OR REPLACE INTO baselines ({', '.join(columns)}) VALUES ({', '.join('?' for _ in values)})",
+                       [None if isinstance(v, float) and math.isnan(v) else v for v in values])
+    db.close()
+    return len(aggregates)
+
+def compare(db_file, name, metric="runtime_model_run", threshold=0.05):
+    '''
+    Compares the current statistics of a metric with a stored baseline. A configuration is
+    flagged as regression (improvement) if its median is more than 'threshold' (relative)
+    above (below) the baseline median and the confidence intervals do not overlap.
+
+    Returns
+    -------
+    comparisons : list of dict
+      One entry per configuration that is present in both, with the relative change of the
+      median and the verdict ('regression', 'improvement' or 'unchanged').
+    '''
+    db = connect(db_file)
+    baseline = {}
+    for row in db.execute(f"SELECT {', '.join(config_columns)}, median, ci_low, ci_high FROM baselines "
+                          f"WHERE name = ? AND metric = ?", (name, metric)):
+        baseline[row[:len(config_columns)]] = row[len(config_columns):]
+    db.close()
+    if not baseline:
+        raise ValueError(f"No baseline '{name}' for metric '{metric}'.")
+    comparisons = []
+    for entry in aggregate(db_file, metric):
+        config = tuple(entry[c] for c in config_columns)
+        if config not in baseline or entry["n"] == 0:
+            continue
+        base_median, base_ci_low, base_ci_high = baseline[config]
+        change = entry["median"] / base_median - 1 if base_median else np.nan
+        verdict = "unchanged"
+        if change > threshold and entry["ci_low"] > base_ci_high:
+            verdict = "regression"
+        elif change < -threshold and entry["ci_high"] < base_ci_low:
+            verdict = "improvement"
+        comparison = {c : entry[c] for c in config_columns}
+        comparison.update({"baseline_median" : base_median, "median" : entry["median"], "change" : change,
+                           "verdict" : verdict})
+        comparisons.append(comparison)
+    return comparisons
+
+def print_table(entries, columns):
+    '''
+    Prints a list of dictionaries as table.
+    '''
+    def fmt(value):
+        return f"{value:.4g}" if isinstance(value, float) else str(value)
+    widths = [max([len(c)] + [len(fmt(e[c])) for e in entries]) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for e in entries:
+        print("  ".join(fmt(e[c]).ljust(w) for c, w in zip(columns, widths)))
+
+if __name__ == "__main__":
+    # Parse commandline arguments
+    parser = argparse.ArgumentParser(description="Benchmark results store (statistics and regression detection)")
+    parser.add_argument("-db", help="SQLite database file", type=str, default="busyring_benchmark_results.db")
+    parser.add_argument("-metric", help="metric to aggregate", type=str, default="runtime_model_run")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("import", help="import rows from a CSV file written by the benchmark driver")
+    p.add_argument("csv_file", type=str)
+    p = subparsers.add_parser("summary", help="print statistics over the trials of each configuration")
+    p.add_argument("-paradigm", type=str, default=None)
+    p = subparsers.add_parser("save-baseline", help="store the current statistics as baseline")
+    p.add_argument("name", type=str)
+    p = subparsers.add_parser("compare", help="compare the current statistics with a baseline")
+    p.add_argument("name", type=str)
+    p.add_argument("-threshold", help="relative change of the median to flag", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        import pandas as pd
+        rows = pd.read_csv(args.csv_file, sep="\t").to_dict(orient="records")
+        for i, row in enumerate(rows):
+            row.setdefault("job_id", f"{args.csv_file}:{i}")
+            row.setdefault("trial_in_launch", 0)
+        store_runs(args.db, rows)
+        print(f"Imported {len(rows)} rows from '{args.csv_file}'.")
+    elif args.command == "summary":
+        print_table(aggregate(args.db, args.metric, args.paradigm),
+                    config_columns + ["n", "median", "q25", "q75", "ci_low", "ci_high"])
+    elif args.command == "save-baseline":
+        num_configs = save_baseline(args.db, args.name, args.metric)
+        print(f"Stored baseline '{args.name}' of {args.metric} for {num_configs} configurations.")
+    elif args.command == "compare":
+        comparisons = compare(args.db, args.name, args.metric, args.threshold)
+        print_table(comparisons, config_columns + ["baseline_median", "median", "change", "verdict"])
+        num_regressions = sum(c["verdict"] == "regression" for c in comparisons)
+        print(f"{num_regressions} regression(s) of {args.metric} against baseline '{args.name}'.")
+        raise SystemExit(1 if num_regressions > 0 else 0)
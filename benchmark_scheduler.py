@@ -0,0 +1,156 @@
+"""
+Resumable scheduler to run benchmark jobs concurrently within a budget of cores
+"""
+
+import json
+import os
+import signal
+import subprocess
+import time
+
+class Job:
+    """
+    One launch of a benchmark run.
+    """
+    def __repr__(self):
+        return f"job '{self.job_id}' ({self.num_cores} cores)"
+
+    def __init__(self, job_id, command, log_file, num_cores, group, config, memory_mb=0):
+        self.job_id = job_id        # unique identifier (used to resume)
+        self.command = command      # shell command to run
+        self.log_file = log_file    # file to redirect the output to
+        self.num_cores = num_cores  # number of cores used (ranks x threads)
+        self.group = group          # jobs of the same group are never run concurrently (e.g., shared dataset cache)
+        self.config = config        # description of the configuration (e.g., to store the results)
+        self.memory_mb = memory_mb  # predicted memory of all ranks in MB (0 if unknown)
+
+def load_state(state_file):
+    '''
+    Loads the scheduler state (finished and failed jobs) from a JSON file.
+    '''
+    if not os.path.exists(state_file):
+        return {"done": [], "failed": {}}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    '''
+    Saves the scheduler state atomically (by writing to a temporary file that replaces the old one).
+    '''
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, state_file)
+
+class Scheduler:
+    """
+    Runs jobs concurrently as long as their cores (and predicted memory) fit into the
+    available cores (and memory), enforces a timeout per job, and persists which jobs
+    are done, such that an interrupted sweep can be resumed.
+    """
+    def __init__(self, state_file, available_cores, timeout=None, poll_interval=1.0, retry_failed=False,
+                 available_memory_mb=None):
+        self.state_file = state_file            # file to persist the state in
+        self.available_cores = available_cores  # number of cores that may be used at once
+        self.available_memory_mb = available_memory_mb  # memory that may be used at once in MB (None for no limit)
+        self.timeout = timeout                  # timeout per job in seconds (None for no timeout)
+        self.poll_interval = poll_interval      # interval to check on the running jobs in seconds
+        self.retry_failed = retry_failed        # whether to rerun jobs that have failed before
+        self.state = load_state(state_file)
+
+    def pending(self, jobs):
+        '''
+        Returns the jobs that still have to be run (in the given order).
+        '''
+        done = set(self.state["done"])
+        failed = set(self.state["failed"])
+        return [job for job in jobs if job.job_id not in done and (self.retry_failed or job.job_id not in failed)]
+
+    def start(self, job):
+        print(f"Starting {job}: {job.command}", flush=True)
+        log = open(job.log_file, 'w')
+        # new session, such that the whole process group (mpiexec and ranks) can be killed on timeout
+        proc = subprocess.Popen(job.command, shell=True, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        return proc, log, time.monotonic()
+
+    def kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError:
+            pass
+
+    def run(self, jobs, on_finished):
+        '''
+        Runs all pending jobs.
+
+        Parameters
+        ----------
+        jobs : list of Job
+          The jobs (started in the given order as soon as they fit).
+        on_finished : callable
+          Called as 'on_finished(job)' for each job that has finished successfully,
+          to store its results (before the job is marked as done); an exception
+          marks the job as failed.
+        '''
+        pending = self.pending(jobs)
+        print(f"{len(pending)} of {len(jobs)} jobs pending "
+              f"({len(self.state['done'])} done; {len(self.state['failed'])} failed before).", flush=True)
+        # reject the jobs that would not fit into the memory (without running them)
+        if self.available_memory_mb is not None:
+            for job in [job for job in pending if job.memory_mb > self.available_memory_mb]:
+                pending.remove(job)
+                self.state["failed"][job.job_id] = (f"predicted memory of {job.memory_mb:.0f} MB exceeds "
+                                                    f"the available {self.available_memory_mb:.0f} MB")
+                print(f"Rejected {job}: {self.state['failed'][job.job_id]}.", flush=True)
+            save_state(self.state_file, self.state)
+        running = {} # job -> (process, log file, start time)
+        while pending or running:
+            # start the jobs that fit into the free cores (a job that is larger than all cores runs alone)
+            used_cores = sum(job.num_cores for job in running)
+            used_memory = sum(job.memory_mb for job in running)
+            running_groups = {job.group for job in running}
+            for job in list(pending):
+                if job.group in running_groups:
+                    continue
+                fits_memory = self.available_memory_mb is None or used_memory + job.memory_mb <= self.available_memory_mb
+                if (used_cores + job.num_cores <= self.available_cores and fits_memory) or not running:
+                    running[job] = self.start(job)
+                    used_cores += job.num_cores
+                    used_memory += job.memory_mb
+                    running_groups.add(job.group)
+                    pending.remove(job)
+
+            time.sleep(self.poll_interval)
+
+            # check on the running jobs
+            for job, (proc, log, start_time) in list(running.items()):
+                error = None
+                if proc.poll() is None:
+                    if self.timeout is None or time.monotonic() - start_time < self.timeout:
+                        continue
+                    self.kill(proc)
+                    error = f"timeout after {self.timeout} s"
+                elif proc.returncode != 0:
+                    error = f"exit code {proc.returncode}"
+                log.close()
+                del running[job]
+
+                if error is None:
+                    try:
+                        on_finished(job)
+                    except Exception as e:
+                        error = f"storing results failed: {e!r}"
+                if error is None:
+                    self.state["done"].append(job.job_id)
+                    self.state["failed"].pop(job.job_id, None)
+                    print(f"Finished {job} after {time.monotonic() - start_time:.1f} s.", flush=True)
+                else:
+                    self.state["failed"][job.job_id] = error
+                    print(f"Failed {job}: {error}.", flush=True)
+                save_state(self.state_file, self.state)
@@ -0,0 +1,63 @@
+"""
+Helpers to store precomputed model data (e.g., connectivity tables) on disk
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+def parameter_key(**values):
+    '''
+    Computes a short key that identifies a set of parameter values.
+
+    Parameters
+    ----------
+    values : dict
+      Parameter names and values (must be JSON-serializable, NumPy arrays
+      are hashed by content).
+
+    Returns
+    -------
+    key : str
+      Hexadecimal hash of the parameter values.
+    '''
+    hashed = {}
+    for name, value in values.items():
+        if isinstance(value, (np.ndarray, range)):
+            value = hashlib.sha1(np.ascontiguousarray(value, dtype=np.int64).tobytes()).hexdigest()
+        hashed[name] = value
+    return hashlib.sha1(json.dumps(hashed, sort_keys=True).encode()).hexdigest()[:16]
+
+def cache_path(cache_dir, prefix, key):
+    '''
+    Returns the path of a cache entry (without creating it).
+    '''
+    return os.path.join(cache_dir, f"{prefix}-{key}")
+
+def save_arrays(path, **arrays):
+    '''
+    Stores arrays as '.npy' files in the directory 'path', such that they can
+    be memory-mapped later. The directory is written under a temporary name
+    and renamed at the end, so that concurrent readers never see an incomplete
+    entry.
+    '''
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process has stored the same entry in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def load_arrays(path, names, mmap=True):
+    '''
+    Loads arrays stored by 'save_arrays()'. Returns None if the entry does not exist.
+    '''
+    if not os.path.isdir(path):
+        return None
+    mmap_mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in names}
@@ -2,24 +2,22 @@
 Adapted from the NSuite benchmarking framework (https://github.com/arbor-sim/nsuite.git)
 """
 
-import numpy as np
 from neuron import h
+import morphology
 
 class cell_parameters:
     def __repr__(self):
         return 'branchy cell parameters: depth {}; branch_probs {}; compartments {}; lengths {}'\
                 .format(self.max_depth, self.branch_probs, self.compartments, self.lengths)
 
-    def __init__(self, max_depth, branch_prob, compartment, length, synapses):
+    def __init__(self, max_depth, branch_prob, compartment, length, synapses, stdp=False, complex=False):
         self.max_depth = max_depth          # maximum number of levels
         self.branch_probs = branch_prob     # range of branching probabilities at each level
         self.compartments = compartment     # range of compartment counts at each level
         self.lengths = length               # range of lengths of sections at each level
         self.synapses = synapses            # the nyumber of synapses per cell
-
-def interp(r, i, n):
-    p = i * 1.0/(n-1)
-    return (1-p)*r[0] + p*r[1]
+        self.stdp = stdp                    # whether the synapses are plastic (ExpSynSTDP instead of ExpSyn)
+        self.complex = complex              # whether the cells have active dendrites (complex_cell instead of branchy_cell)
 
 def printcell(c):
     print('cell with ', len(c.sections), ' levels:')
@@ -38,91 +36,137 @@ class branchy_cell:
         s = 'cell_%d\n' % self.gid
         return s
 
-    def __init__(self, gid, params):
+    def __init__(self, gid, params, spec=None):
+        """
+        Instantiates the cell from its morphology specification, which is computed
+        here unless it is provided as a tuple of the MorphologyTree and the section
+        indices and positions of the random synapses (cf. 'morphology.CellMorphologies').
+        """
         self.gid = gid
+        if spec is None:
+            tree = morphology.branching_tree(gid, params)
+            syn_section, syn_pos = morphology.synapse_placement(gid, tree.nsec, params.synapses)
+        else:
+            tree, syn_section, syn_pos = spec
 
         # generate the soma
         soma = h.Section(name='soma', cell=self)
-        soma.L = soma.diam = 12.6157 # Makes a soma of 500 microns squared
+        soma.L = morphology.soma_length
+        soma.diam = morphology.soma_diam
         soma.Ra = 100
         soma.cm = 1
-        soma.insert('hh')
-        for seg in soma:
-            seg.hh.gnabar = 0.12  # Sodium conductance in S/cm2
-            seg.hh.gkbar = 0.036  # Potassium conductance in S/cm2
-            seg.hh.gl = 0.0003    # Leak conductance in S/cm2
-            seg.hh.el = -54.3     # Reversal potential in mV
-
-        self.sections = []
-        self.sections.append([soma])
+        self.set_soma_mechanisms(soma)
 
-        self.nseg = 1
-        self.ncomp = 1
+        self.sections = [[soma]]
 
-        # build the dendritic tree
-        branching_gen = np.random.Generator(np.random.MT19937(seed=gid))
+        # build the dendritic tree (mechanism parameters are set for whole sections)
         flat_section_list = [soma]
-        for i in range(params.max_depth):
-            level_secs = []
-            count = 0
-            # branch prob at this level
-            bp = interp(params.branch_probs, i, params.max_depth)
-            # length at this level
-            l = interp(params.lengths, i, params.max_depth)
-            # number of compartments at this level
-            nc = round(interp(params.compartments, i, params.max_depth))
-
-            for sec in self.sections[i]:
-                # attempt to make some branches
-                    if branching_gen.uniform(0, 1) < bp:
-                        for branch in [0, 1]:
-                            dend = h.Section(name=f'dend{i}_{count}')
-                            dend.L = l      # microns
-                            dend.diam = 1   # microns
-                            dend.Ra = 100
-                            dend.cm = 1
-                            dend.nseg = nc
-                            dend.insert('pas')
-                            for seg in dend:
-                                seg.pas.g = 0.001  # Passive conductance in S/cm2
-                                seg.pas.e = -65    # Leak reversal potential mV
-
-                            dend.connect(sec(1))
-                            level_secs.append(dend)
-                            flat_section_list.append(dend)
-                            count += 1
-                            self.ncomp += nc
-
-            if count == 0:
-                break
-            self.nseg += count
-            self.sections.append(level_secs)
-
+        parents = tree.parent.tolist()
+        levels = tree.level.tolist()
+        lengths = tree.length.tolist()
+        nsegs = tree.nseg.tolist()
+        for k in range(1, tree.nsec):
+            i = levels[k] - 1
+            if i + 1 == len(self.sections):
+                self.sections.append([])
+            dend = h.Section(name=f'dend{i}_{len(self.sections[i+1])}')
+            dend.L = lengths[k]     # microns
+            dend.diam = 1           # microns
+            dend.Ra = 100
+            dend.cm = 1
+            dend.nseg = nsegs[k]
+            self.set_dendrite_mechanisms(dend, levels[k])
+            dend.connect(flat_section_list[parents[k]](1))
+            self.sections[i+1].append(dend)
+            flat_section_list.append(dend)
+
+        self.nseg = tree.nsec
+        self.ncomp = tree.ncomp
         self.soma = soma
 
         # stick a synapse onto the soma
-        self.synapses = [h.ExpSyn(self.soma(0.5))]
+        synapse_type = h.ExpSynSTDP if params.stdp else h.ExpSyn
+        self.synapses = [synapse_type(self.soma(0.5))]
         self.synapses[0].tau = 2
 
         # add additional synapses that will be connected to the "ghost" network
-        seg_gen = np.random.Generator(np.random.MT19937(seed=gid))
-        pos_gen = np.random.Generator(np.random.MT19937(seed=gid))
-        for i in range(params.synapses):
-            seg = seg_gen.integers(0, self.nseg)
-            pos = pos_gen.uniform(0, 1)
-            self.synapses.append(h.ExpSyn(flat_section_list[seg](pos)))
+        for sec, pos in zip(syn_section.tolist(), syn_pos.tolist()):
+            self.synapses.append(synapse_type(flat_section_list[sec](pos)))
+
+    def set_soma_mechanisms(self, soma):
+        """
+        Inserts the membrane mechanisms of the soma (Hodgkin-Huxley)
+        """
+        soma.insert('hh')
+        soma.gnabar_hh = 0.12  # Sodium conductance in S/cm2
+        soma.gkbar_hh = 0.036  # Potassium conductance in S/cm2
+        soma.gl_hh = 0.0003    # Leak conductance in S/cm2
+        soma.el_hh = -54.3     # Reversal potential in mV
+
+    def set_dendrite_mechanisms(self, dend, level):
+        """
+        Inserts the membrane mechanisms of a dendritic section at the given level (passive)
+        """
+        dend.insert('pas')
+        dend.g_pas = 0.001      # Passive conductance in S/cm2
+        dend.e_pas = -65        # Leak reversal potential mV
 
+    def location(self, name):
+        """
+        Returns the segment of a recording location: 'soma' (center of the soma) or 'dend' (center of
+        the first dendritic section, or of the soma if the cell has no dendrites)
+        """
+        if name == 'soma' or len(self.sections) < 2:
+            return self.soma(0.5)
+        elif name == 'dend':
+            return self.sections[1][0](0.5)
+        raise ValueError(f"Unknown recording location '{name}' (use 'soma' or 'dend').")
 
-    def set_recorder(self):
+    def set_recorder(self, dt=None):
         """Set soma, dendrite, and time recording vectors on the cell.
 
-        :param cell: Cell to record from.
+        :param dt: Sampling interval in ms (every time step if None).
         :return: the soma, dendrite, and time vectors as a tuple.
         """
         soma_v = h.Vector()   # Membrane potential vector at soma
         dend_v = h.Vector()   # Membrane potential vector at dendrite
         t = h.Vector()        # Time stamp vector
-        soma_v.record(self.soma(0.5)._ref_v)
-        dend_v.record(self.dend(0.5)._ref_v)
-        t.record(h._ref_t)
+        for vec, ref in [(soma_v, self.location('soma')._ref_v), (dend_v, self.location('dend')._ref_v), (t, h._ref_t)]:
+            if dt is None:
+                vec.record(ref)
+            else:
+                vec.record(ref, dt)
         return soma_v, dend_v, t
+
+#
+#   Complex cell.
+#   Same morphology as the branching cell, but with active dendrites
+#   (sodium, delayed rectifier and A-type potassium channels, cf. 'mod')
+#
+class complex_cell(branchy_cell):
+
+    def set_soma_mechanisms(self, soma):
+        """
+        Inserts the membrane mechanisms of the soma (Hodgkin-Huxley and A-type potassium)
+        """
+        branchy_cell.set_soma_mechanisms(self, soma)
+        soma.insert('kadend')
+        soma.gbar_kadend = 0.005 # A-type potassium conductance in S/cm2
+        soma.ek = -90            # Potassium reversal potential in mV
+
+    def set_dendrite_mechanisms(self, dend, level):
+        """
+        Inserts the membrane mechanisms of a dendritic section at the given level (active channels,
+        with sodium conductance decreasing and A-type potassium conductance increasing with the level)
+        """
+        dend.insert('pas')
+        dend.g_pas = 0.0001                         # Passive conductance in S/cm2
+        dend.e_pas = -65                            # Leak reversal potential mV
+        dend.insert('nadend')
+        dend.insert('kdrdend')
+        dend.insert('kadend')
+        dend.gbar_nadend = 0.02 / (1 + 0.1*level)   # Sodium conductance in S/cm2
+        dend.gbar_kdrdend = 0.01                    # Delayed rectifier potassium conductance in S/cm2
+        dend.gbar_kadend = 0.005 * (1 + 0.5*level)  # A-type potassium conductance in S/cm2
+        dend.ena = 50                               # Sodium reversal potential in mV
+        dend.ek = -90                               # Potassium reversal potential in mV
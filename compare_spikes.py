@@ -0,0 +1,267 @@
+"""
+Script to check that two spike rasters are equivalent (e.g., of runs with NEURON and CoreNEURON,
+or with different rank/thread layouts): spikes are matched per gid within a time tolerance, in a
+streaming fashion, and missing, extra and shifted spikes as well as the ring propagation latencies
+are reported
+"""
+
+import argparse
+import glob
+import json
+import sys
+import numpy as np
+import connectivity
+import spike_output
+
+def sorted_blocks(paths, mmap=True):
+    '''
+    Returns the blocks of spikes of the given files (cf. 'spike_output.spike_blocks()'), where
+    glob patterns are expanded (e.g., 'spikes.rank*.npy'); blocks that are not sorted by time
+    and gid (e.g., CoreNEURON's 'out.dat') are sorted in memory.
+    '''
+    blocks = []
+    for pattern in paths:
+        files = sorted(glob.glob(pattern)) or [pattern]
+        for path in files:
+            for block in spike_output.spike_blocks(path, mmap):
+                t, gid = block['t'], block['gid']
+                if len(block) > 1 and not np.all((t[1:] > t[:-1]) | ((t[1:] == t[:-1]) & (gid[1:] >= gid[:-1]))):
+                    block = np.asarray(block)[np.lexsort((gid, t))]
+                blocks.append(block)
+    return blocks
+
+def spike_keys(spikes, t_offset, t_span):
+    '''
+    Returns keys that order the spikes by gid and then by time (within a window of time of length
+    't_span' starting at 't_offset').
+    '''
+    return spikes['gid'].astype(np.float64) * t_span + (spikes['t'] - t_offset)
+
+def match_spikes(ref, cand, tolerance):
+    '''
+    Matches each spike of the reference to the nearest spike of the same gid in the candidate,
+    if they are at most 'tolerance' apart (one-to-one, the closer pair wins).
+
+    Returns
+    -------
+    ref_match : numpy.ndarray
+      Index of the matched candidate spike for each reference spike (-1 if unmatched).
+    '''
+    ref_match = np.full(len(ref), -1, dtype=np.int64)
+    if len(ref) == 0 or len(cand) == 0:
+        return ref_match
+    t_offset = min(ref['t'].min(), cand['t'].min()) - tolerance
+    t_span = max(ref['t'].max(), cand['t'].max()) - t_offset + 2*tolerance + 1.0
+    cand_keys = spike_keys(cand, t_offset, t_span)
+    order = np.argsort(cand_keys, kind='stable')
+    cand_keys = cand_keys[order]
+    ref_keys = spike_keys(ref, t_offset, t_span)
+    pos = np.searchsorted(cand_keys, ref_keys)
+    best = np.full(len(ref), -1, dtype=np.int64)
+    best_dist = np.full(len(ref), np.inf)
+    for neighbor in (pos - 1, pos):
+        valid = (neighbor >= 0) & (neighbor < len(cand_keys))
+        index = np.where(valid, neighbor, 0)
+        dist = np.abs(cand_keys[index] - ref_keys)
+        candidate = order[index]
+        ok = valid & (cand['gid'][candidate] == ref['gid']) & (dist <= tolerance) & (dist < best_dist)
+        best[ok] = candidate[ok]
+        best_dist[ok] = dist[ok]
+    # one-to-one: of several reference spikes matched to the same candidate spike, keep the closest
+    matched = np.flatnonzero(best >= 0)
+    matched = matched[np.lexsort((best_dist[matched], best[matched]))]
+    first = np.ones(len(matched), dtype=bool)
+    first[1:] = best[matched][1:] != best[matched][:-1]
+    ref_match[matched[first]] = best[matched[first]]
+    return ref_match
+
+class RingLatencies:
+    """
+    Ring propagation latencies of a raster: the time from the last spike of the ring predecessor of
+    a gid to each spike of the gid, computed chunk by chunk (in order of time).
+    """
+    def __init__(self, num_cells, ring_size):
+        self.num_cells = num_cells  # number of cells (the largest gid + 1 if 0)
+        self.ring_size = ring_size  # number of cells per ring
+        self.last_time = np.full(max(num_cells, 0), -np.inf)    # time of the last spike of each gid so far
+        self.latencies = []         # latencies of the processed chunks
+
+    def update(self, spikes):
+        '''
+        Adds the latencies of the next chunk of spikes (sorted by time, after all previous chunks).
+        '''
+        if len(spikes) == 0:
+            return
+        spikes = np.asarray(spikes)
+        num_cells = self.num_cells or int(spikes['gid'].max()) + 1
+        if int(spikes['gid'].max()) >= len(self.last_time):
+            self.last_time = np.concatenate([self.last_time, np.full(int(spikes['gid'].max()) + 1 - len(self.last_time), -np.inf)])
+        pred = connectivity.ring_sources(spikes['gid'], num_cells, self.ring_size)
+        # last spike of the predecessor before each spike: within the chunk, or from the previous chunks
+        t_offset = spikes['t'].min() - 1.0
+        t_span = spikes['t'].max() - t_offset + 1.0
+        keys = spike_keys(spikes, t_offset, t_span)
+        order = np.argsort(keys, kind='stable')
+        pred_keys = pred.astype(np.float64) * t_span + (spikes['t'] - t_offset)
+        pos = np.searchsorted(keys[order], pred_keys, side='left') - 1 # last spike strictly before
+        index = order[np.clip(pos, 0, len(order) - 1)]
+        in_chunk = (pos >= 0) & (spikes['gid'][index] == pred) & (spikes['t'][index] < spikes['t'])
+        pred_time = np.where(in_chunk, spikes['t'][index], self.last_time[pred])
+        latency = spikes['t'] - pred_time
+        self.latencies.append(latency[np.isfinite(latency)])
+        # last spike of each gid (the spikes are sorted by time, so the last assignment wins)
+        self.last_time[spikes['gid']] = spikes['t']
+
+    def statistics(self):
+        '''
+        Returns the number, mean, median, 5th and 95th percentile, minimum and maximum of the latencies in ms.
+        '''
+        latencies = np.concatenate(self.latencies) if self.latencies else np.empty(0)
+        if len(latencies) == 0:
+            return {"n": 0}
+        return {"n": int(len(latencies)), "mean": float(latencies.mean()), "median": float(np.median(latencies)),
+                "p5": float(np.percentile(latencies, 5)), "p95": float(np.percentile(latencies, 95)),
+                "min": float(latencies.min()), "max": float(latencies.max())}
+
+def compare(reference, candidate, tolerance=0.025, num_cells=0, ring_size=4, chunk_size=1048576, max_report=10):
+    '''
+    Compares two spike rasters in a streaming fashion: the spikes are processed in windows of time,
+    where spikes close to the end of a window are carried over to the next one.
+
+    Parameters
+    ----------
+    reference, candidate : list of numpy.ndarray
+      Sorted blocks of spikes of both rasters (cf. 'sorted_blocks()').
+    tolerance : float
+      Maximum time difference of matching spikes in ms.
+    num_cells : int
+      Number of cells (the largest gid + 1 if 0).
+    ring_size : int
+      Number of cells per ring (for the ring latencies).
+    chunk_size : int
+      Number of spikes per block to process at once.
+    max_report : int
+      Maximum number of missing, extra and shifted spikes to list.
+
+    Returns
+    -------
+    result : dict
+      Numbers of spikes, matched, missing, extra and shifted spikes, statistics of the shifts,
+      examples of the mismatches and the ring latency statistics of both rasters.
+    '''
+    streams = [spike_output.merge_blocks(reference, chunk_size), spike_output.merge_blocks(candidate, chunk_size)]
+    buffers = [np.empty(0, dtype=spike_output.spike_dtype), np.empty(0, dtype=spike_output.spike_dtype)]
+    done = [False, False]
+    latencies = [RingLatencies(num_cells, ring_size), RingLatencies(num_cells, ring_size)]
+    counts = {"reference": 0, "candidate": 0, "matched": 0, "missing": 0, "extra": 0, "shifted": 0}
+    shifts = []
+    examples = {"missing": [], "extra": [], "shifted": []}
+
+    def pull(i):
+        chunk = next(streams[i], None)
+        if chunk is None:
+            done[i] = True
+            return
+        latencies[i].update(chunk)
+        counts["reference" if i == 0 else "candidate"] += len(chunk)
+        buffers[i] = np.concatenate([buffers[i], chunk])
+
+    def report(kind, spikes, dt=None):
+        for k in range(min(len(spikes), max_report - len(examples[kind]))):
+            example = {"gid": int(spikes['gid'][k]), "t": float(spikes['t'][k])}
+            if dt is not None:
+                example["dt"] = float(dt[k])
+            examples[kind].append(example)
+
+    while True:
+        for i in (0, 1):
+            if not done[i] and len(buffers[i]) == 0:
+                pull(i)
+        # everything up to the bound has been read from both rasters
+        bound = min(buffers[i]['t'][-1] if not done[i] and len(buffers[i]) > 0 else np.inf for i in (0, 1))
+        ref, cand = buffers
+        final_ref = ref['t'] < bound - tolerance
+        ref_match = match_spikes(ref[final_ref], cand, tolerance)
+        matched = ref_match >= 0
+
+        # matched (and shifted) spikes
+        dt = cand['t'][ref_match[matched]] - ref['t'][final_ref][matched]
+        counts["matched"] += int(np.count_nonzero(matched))
+        is_shifted = dt != 0
+        counts["shifted"] += int(np.count_nonzero(is_shifted))
+        shifts.append(np.abs(dt[is_shifted]))
+        report("shifted", ref[final_ref][matched][is_shifted], dt[is_shifted])
+        # missing spikes: final reference spikes without match
+        counts["missing"] += int(np.count_nonzero(~matched))
+        report("missing", ref[final_ref][~matched])
+        # extra spikes: unmatched candidate spikes that no later reference spike can match
+        unmatched = np.ones(len(cand), dtype=bool)
+        unmatched[ref_match[matched]] = False
+        final_cand = unmatched & (cand['t'] < bound - 2*tolerance)
+        counts["extra"] += int(np.count_nonzero(final_cand))
+        report("extra", cand[final_cand])
+
+        buffers = [ref[~final_ref], cand[unmatched & ~final_cand]]
+        if done[0] and done[1]:
+            break
+        # read on in the raster that limits the bound
+        limiting = [i for i in (0, 1) if not done[i] and len(buffers[i]) > 0 and buffers[i]['t'][-1] == bound]
+        for i in (limiting or [i for i in (0, 1) if not done[i]]):
+            pull(i)
+
+    shifts = np.concatenate(shifts) if shifts else np.empty(0)
+    result = dict(counts)
+    result["tolerance"] = tolerance
+    result["max_shift"] = float(shifts.max()) if len(shifts) else 0.0
+    result["mean_shift"] = float(shifts.mean()) if len(shifts) else 0.0
+    result["examples"] = examples
+    result["latency_reference"] = latencies[0].statistics()
+    result["latency_candidate"] = latencies[1].statistics()
+    return result
+
+def print_result(result):
+    print(f"Reference: {result['reference']} spikes; candidate: {result['candidate']} spikes (tolerance {result['tolerance']} ms)\n"
+          f"  matched {result['matched']} (shifted {result['shifted']}; max shift {result['max_shift']:.6f} ms; "
+          f"mean shift {result['mean_shift']:.6f} ms)\n"
+          f"  missing {result['missing']}; extra {result['extra']}")
+    for kind in ("missing", "extra", "shifted"):
+        for example in result["examples"][kind]:
+            print(f"  {kind}: gid {example['gid']} at {example['t']:.3f} ms" +
+                  (f" (shifted by {example['dt']:+.6f} ms)" if "dt" in example else ""))
+    for name in ("reference", "candidate"):
+        s = result[f"latency_{name}"]
+        if s["n"]:
+            print(f"Ring latency ({name}): mean {s['mean']:.3f} ms; median {s['median']:.3f} ms; "
+                  f"5-95% [{s['p5']:.3f}, {s['p95']:.3f}] ms ({s['n']} spikes)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares two spike rasters (e.g., of NEURON and CoreNEURON runs, or of different "
+                                                 "rank/thread layouts) and exits with 1 if they differ by more than allowed")
+    parser.add_argument("-reference", nargs='+', required=True, help="spike files of the reference ('.npy', raw '.bin' or text; "
+                                                                    "glob patterns for per-rank files)")
+    parser.add_argument("-candidate", nargs='+', required=True, help="spike files of the candidate")
+    parser.add_argument("-tolerance", help="maximum time difference of matching spikes in ms", type=float, default=0.025)
+    parser.add_argument("-max_mismatches", help="number of missing plus extra spikes that is still accepted", type=int, default=0)
+    parser.add_argument("-params_file", help="paradigm of the runs (for the ring size and the number of cells)", type=str, default="")
+    parser.add_argument("-ring_size", help="number of cells per ring (without paradigm)", type=int, default=4)
+    parser.add_argument("-chunk_size", help="number of spikes per input file to hold in memory at once", type=int, default=1048576)
+    parser.add_argument("-output", help="JSON file to write the result to", type=str, default="")
+    args = parser.parse_args(argv)
+
+    num_cells, ring_size = 0, args.ring_size
+    if args.params_file:
+        with open(args.params_file) as f:
+            data = json.load(f)
+        num_cells, ring_size = data["num-cells"], data["ring-size"]
+    result = compare(sorted_blocks(args.reference), sorted_blocks(args.candidate), args.tolerance,
+                     num_cells, ring_size, args.chunk_size)
+    result["equivalent"] = result["missing"] + result["extra"] <= args.max_mismatches
+    print_result(result)
+    print("Spike rasters are equivalent." if result["equivalent"] else "Spike rasters differ.")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+    return 0 if result["equivalent"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Generation of the busyring connectivity as NumPy arrays (independent of NEURON)
+"""
+
+import numpy as np
+import cache
+
+class ConnectionTable:
+    """
+    Incoming connections of a set of target gids, with one row per connection.
+    The rows of each target gid are contiguous: synapse 0 receives the ring
+    connection, synapses 1..n the random ("ghost") connections.
+    """
+    columns = ('target', 'synapse', 'source', 'delay')
+
+    def __repr__(self):
+        return f'connection table: {len(self)} connections to {len(self.gids)} cells'
+
+    def __init__(self, gids, target, synapse, source, delay):
+        self.gids = gids            # target gids (in order of the rows)
+        self.target = target        # target gid of each connection
+        self.synapse = synapse      # synapse id at the target cell
+        self.source = source        # source gid
+        self.delay = delay          # delay in ms
+
+    def __len__(self):
+        return len(self.target)
+
+def ring_sources(gids, num_cells, ring_size):
+    '''
+    Returns the source of the ring connection of each gid (the previous gid in
+    the same ring, or the last gid of the ring for the first cell of a ring).
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    ring_start = (gids // ring_size) * ring_size
+    ring_end = np.minimum(ring_start + ring_size, num_cells)
+    return np.where(gids == ring_start, ring_end - 1, gids - 1)
+
+def random_connections(gid, num_cells, num_synapses, min_delay):
+    '''
+    Draws the sources and delays of the random connections of one gid. The
+    draws are batched, but use the same per-gid generators and draw order as
+    drawing one synapse at a time, such that the results are identical.
+    '''
+    src_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    delay_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    src = src_gen.integers(0, num_cells-2, size=num_synapses)
+    src[src == gid] += 1
+    delay = min_delay + delay_gen.uniform(0, 2*min_delay, size=num_synapses)
+    return src, delay
+
+# Connectivity modes: sources of the random connections drawn uniformly from all cells, from the cells of the
+# same rank, from a neighborhood of rings, or from a distance-dependent kernel over the gids
+modes = ('uniform', 'rank', 'neighborhood', 'distance')
+
+def local_sources(gid, src, num_cells, ring_size, locality, rank_gids):
+    '''
+    Replaces a fraction of the uniformly drawn sources of one gid by local ones (in place).
+    The local draws use a separate per-gid generator, such that the other sources stay the
+    same as with uniform connectivity.
+
+    Parameters
+    ----------
+    gid : int
+      Target gid.
+    src : numpy.ndarray
+      Uniformly drawn sources of the random connections of the gid.
+    num_cells : int
+      Total number of cells in the network.
+    ring_size : int
+      Number of cells per ring.
+    locality : parameters.connectivity_parameters
+      Connectivity mode and its parameters.
+    rank_gids : numpy.ndarray
+      Sorted gids on the rank of the target gid (for mode 'rank').
+    '''
+    local_gen = np.random.Generator(np.random.MT19937(seed=[gid, 1]))
+    local = np.flatnonzero(local_gen.uniform(0, 1, size=len(src)) < locality.fraction)
+    if locality.mode == 'rank':
+        if len(rank_gids) < 2:
+            return
+        # all other gids on the rank
+        index = local_gen.integers(0, len(rank_gids)-1, size=len(local))
+        index[index >= np.searchsorted(rank_gids, gid)] += 1
+        src[local] = rank_gids[index]
+    elif locality.mode == 'neighborhood':
+        # all other gids in the rings within the neighborhood (periodic over the rings)
+        num_rings = -(-num_cells // ring_size)
+        ring = gid // ring_size
+        rings = np.unique((ring + np.arange(-locality.neighborhood, locality.neighborhood+1)) % num_rings)
+        candidates = (rings[:, None] * ring_size + np.arange(ring_size)).ravel()
+        candidates = candidates[(candidates < num_cells) & (candidates != gid)]
+        if len(candidates) == 0:
+            return
+        src[local] = candidates[local_gen.integers(0, len(candidates), size=len(local))]
+    elif locality.mode == 'distance':
+        # two-sided exponential kernel over the distance in gid space (periodic), excluding the gid itself
+        distance = 1 + np.floor(local_gen.exponential(locality.scale, size=len(local))).astype(np.int64)
+        sign = np.where(local_gen.uniform(0, 1, size=len(local)) < 0.5, -1, 1)
+        source = (gid + sign*distance) % num_cells
+        source[source == gid] = (gid + 1) % num_cells
+        src[local] = source
+
+def generate_connections(gids, num_cells, ring_size, num_synapses, min_delay, locality=None, rank_gids=None):
+    '''
+    Computes the connection table for the given target gids.
+
+    Parameters
+    ----------
+    gids : sequence of int
+      Target gids (e.g., the gids on the current rank).
+    num_cells : int
+      Total number of cells in the network.
+    ring_size : int
+      Number of cells per ring.
+    num_synapses : int
+      Number of random synapses per cell.
+    min_delay : float
+      Minimum delay in ms (delay of the ring connections).
+    locality : parameters.connectivity_parameters
+      Connectivity mode of the random connections (uniform if None).
+    rank_gids : sequence of int
+      Gids on the rank of the target gids (for mode 'rank'; the target gids if None).
+
+    Returns
+    -------
+    table : ConnectionTable
+      The connections to all given gids.
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    if locality is not None and locality.mode == 'uniform':
+        locality = None
+    if locality is not None:
+        rank_gids = np.sort(np.asarray(gids if rank_gids is None else rank_gids, dtype=np.int64))
+    rows = num_synapses + 1
+    target = np.repeat(gids, rows).astype(np.int32)
+    synapse = np.tile(np.arange(rows, dtype=np.int32), len(gids))
+    source = np.empty((len(gids), rows), dtype=np.int32)
+    delay = np.empty((len(gids), rows), dtype=np.float64)
+
+    source[:, 0] = ring_sources(gids, num_cells, ring_size)
+    delay[:, 0] = min_delay
+    for i, gid in enumerate(gids.tolist()):
+        src, delay[i, 1:] = random_connections(gid, num_cells, num_synapses, min_delay)
+        if locality is not None:
+            local_sources(gid, src, num_cells, ring_size, locality, rank_gids)
+        source[i, 1:] = src
+
+    return ConnectionTable(gids, target, synapse, source.ravel(), delay.ravel())
+
+def load_connections(gids, params, cache_dir=""):
+    '''
+    Returns the connection table for the given target gids. If a cache
+    directory is provided, the table is memory-mapped from there if it has
+    been stored before, and is stored there otherwise.
+
+    Parameters
+    ----------
+    gids : sequence of int
+      Target gids.
+    params : parameters.model_parameters
+      Model parameters.
+    cache_dir : str
+      Directory of the connectivity cache (no caching if empty).
+
+    Returns
+    -------
+    table : ConnectionTable
+      The connections to all given gids.
+    from_cache : bool
+      Whether the table has been loaded from the cache.
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    if cache_dir:
+        key_values = dict(num_cells=params.num_cells, ring_size=params.ring_size,
+                          synapses=params.cell.synapses, min_delay=params.min_delay, gids=gids)
+        if params.connectivity.mode != 'uniform':
+            key_values['connectivity'] = params.connectivity.as_dict()
+        key = cache.parameter_key(**key_values)
+        path = cache.cache_path(cache_dir, "connectivity", key)
+        arrays = cache.load_arrays(path, ConnectionTable.columns)
+        if arrays is not None:
+            return ConnectionTable(gids, **arrays), True
+
+    table = generate_connections(gids, params.num_cells, params.ring_size,
+                                 params.cell.synapses, params.min_delay, params.connectivity)
+    if cache_dir:
+        cache.save_arrays(path, **{name: getattr(table, name) for name in ConnectionTable.columns})
+    return table, False
+
+def inter_rank_connections(table, rank_of_gid, rank):
+    '''
+    Returns the number of connections in the table whose source is on another rank
+    than the given one.
+    '''
+    return int(np.count_nonzero(rank_of_gid[table.source] != rank))
@@ -0,0 +1,110 @@
+"""
+Cache of CoreNEURON datasets (written by 'pc.nrncore_write'), such that repeated runs
+of the same model can skip the model construction in NEURON
+"""
+
+import json
+import os
+import cache
+
+# Name of the file that marks a complete dataset (written after all ranks have finished writing)
+marker_file = "dataset.json"
+
+def dataset_path(cache_dir, params, num_ranks, num_threads, partition_strategy, thread_strategy='default', thread_calibration=0):
+    '''
+    Returns the directory of the dataset for the given configuration.
+
+    Parameters
+    ----------
+    cache_dir : str
+      Directory of the dataset cache.
+    params : parameters.model_parameters
+      Model parameters.
+    num_ranks : int
+      Number of MPI ranks.
+    num_threads : int
+      Number of threads per rank.
+    partition_strategy : str
+      Strategy that has been used to distribute the gids across ranks.
+    thread_strategy : str
+      Strategy that has been used to distribute the cells of each rank across its threads.
+    thread_calibration : float
+      Duration in ms of the calibration run of the thread partition (0: no calibration).
+
+    Returns
+    -------
+    path : str
+      Directory of the dataset.
+    '''
+    model = params.as_dict()
+    model.pop('duration') # the duration is set when running the dataset
+    key_values = dict(model=model, num_ranks=num_ranks, num_threads=num_threads, partition=partition_strategy)
+    if thread_strategy != 'default':
+        key_values['thread_partition'] = thread_strategy
+        if thread_calibration > 0: # (the partition then depends on the compute times measured in the calibration run)
+            key_values['thread_calibration'] = thread_calibration
+    key = cache.parameter_key(**key_values)
+    return cache.cache_path(cache_dir, "coreneuron", key)
+
+def is_complete(path):
+    '''
+    Returns whether a complete dataset exists in the given directory.
+    '''
+    return os.path.isfile(os.path.join(path, marker_file))
+
+def write_dataset(pc, path, description):
+    '''
+    Writes the current NEURON model as CoreNEURON dataset (has to be called
+    on all ranks after the model has been initialized).
+
+    Parameters
+    ----------
+    pc : h.ParallelContext
+      The parallel context.
+    path : str
+      Directory of the dataset.
+    description : dict
+      Information about the dataset (stored in the marker file).
+    '''
+    if pc.id() == 0:
+        os.makedirs(path, exist_ok=True)
+    pc.barrier()
+    pc.nrncore_write(path)
+    pc.barrier()
+    if pc.id() == 0:
+        with open(os.path.join(path, marker_file), "w") as f:
+            json.dump(description, f, indent=4)
+    pc.barrier()
+
+def coreneuron_arguments(path, tstop, num_ranks, num_threads=1, cell_permute=0, gpu=False, outpath=".", exchange=None):
+    '''
+    Returns the CoreNEURON command-line arguments to run a dataset (with the spike
+    exchange and event queue settings of 'exchange', a 'parameters.exchange_parameters').
+    '''
+    args = f"--tstop {tstop} --datpath {path} --outpath {outpath} --cell-permute {cell_permute}"
+    if num_threads > 1:
+        args += " --threading" # otherwise, CoreNEURON runs the threads of the dataset one after the other
+    if num_ranks > 1:
+        args += " --mpi"
+    if gpu:
+        args += " --gpu"
+    if exchange is not None:
+        if exchange.spike_compress:
+            args += f" --spkcompress {exchange.spike_compress}"
+        if exchange.multisend:
+            args += " --multisend"
+        if exchange.queue_mode in ('binq', 'binq-selfq'):
+            args += " --binqueue"
+        if exchange.maxstep:
+            args += f" --mindelay {exchange.maxstep}"
+    return args
+
+def run_dataset(pc, path, tstop, cell_permute=0, gpu=False, outpath=".", exchange=None):
+    '''
+    Runs CoreNEURON on a dataset (requires that the CoreNEURON mechanisms have
+    been enabled via 'neuron.coreneuron'). CoreNEURON reads the model from the
+    files of the dataset (no in-memory transfer) and writes the spikes to
+    'out.dat' in the output directory.
+    '''
+    args = coreneuron_arguments(path, tstop, int(pc.nhost()), int(pc.nthread()), cell_permute, gpu, outpath, exchange)
+    pc.nrncore_run(args, 0) # second argument: no direct (in-memory) mode
@@ -0,0 +1,168 @@
+"""
+Script to merge the profile dumps of all ranks and phases (written by run_ring_network.py with
+'-profile') into a ranked table of hot spots and a collapsed-stack file for flame graphs
+"""
+
+import argparse
+import glob
+import os
+import pstats
+import numpy as np
+import profiling
+
+def function_label(func):
+    '''
+    Returns a readable label of a function of the profile (file, line and name).
+    '''
+    filename, lineno, name = func
+    if filename == '~': # built-in functions (e.g., calls into NEURON)
+        return name
+    return f"{os.path.basename(filename)}:{lineno}({name})"
+
+def load_dumps(paths):
+    '''
+    Loads the profile dumps.
+
+    Parameters
+    ----------
+    paths : list of str
+      Dump files, or directories that contain them.
+
+    Returns
+    -------
+    dumps : list of tuple
+      Rank, phase and statistics ('pstats.Stats.stats') of each dump.
+    '''
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, "*.prof"))) if os.path.isdir(path) else [path])
+    dumps = []
+    for file in files:
+        match = profiling.dump_pattern.search(os.path.basename(file))
+        rank, phase = (int(match.group(1)), match.group(2)) if match else (0, os.path.basename(file))
+        dumps.append((rank, phase, pstats.Stats(file).stats))
+    return dumps
+
+def hot_spots(dumps, by_phase=False):
+    '''
+    Merges the dumps into one entry per function (and phase), ranked by the self time.
+
+    Parameters
+    ----------
+    dumps : list of tuple
+      Rank, phase and statistics of each dump (cf. 'load_dumps()').
+    by_phase : bool
+      Whether to keep the phases apart.
+
+    Returns
+    -------
+    entries : list of dict
+      Phase ('all' unless by phase), function, number of calls, self time summed over the ranks,
+      mean and maximum self time per rank, cumulative time summed over the ranks, and the share
+      of the total self time.
+    '''
+    merged = {}
+    num_ranks = len({rank for rank, _, _ in dumps})
+    for rank, phase, stats in dumps:
+        for func, (_, ncalls, tottime, cumtime, _) in stats.items():
+            key = (phase if by_phase else 'all', func)
+            entry = merged.setdefault(key, {"calls": 0, "self": 0.0, "cumulative": 0.0, "per_rank": {}})
+            entry["calls"] += ncalls
+            entry["self"] += tottime
+            entry["cumulative"] += cumtime
+            entry["per_rank"][rank] = entry["per_rank"].get(rank, 0.0) + tottime
+    total = sum(entry["self"] for entry in merged.values())
+    entries = []
+    for (phase, func), entry in merged.items():
+        per_rank = np.array(list(entry["per_rank"].values()))
+        entries.append({"phase": phase, "function": function_label(func), "calls": entry["calls"],
+                        "self": entry["self"], "self_mean": entry["self"] / max(num_ranks, 1),
+                        "self_max": per_rank.max(), "cumulative": entry["cumulative"],
+                        "share": entry["self"] / total if total > 0 else 0.0})
+    entries.sort(key=lambda e: -e["self"])
+    return entries
+
+def collapsed_stacks(dumps, max_depth=64):
+    '''
+    Reconstructs the call stacks from the caller-callee edges of the profiles, with the self time
+    of each function distributed over its callers in proportion to the time of the calls, and
+    merges them over the ranks (as in flamegraph.pl's collapsed format, with the phase as root).
+
+    Parameters
+    ----------
+    dumps : list of tuple
+      Rank, phase and statistics of each dump (cf. 'load_dumps()').
+    max_depth : int
+      Maximum depth of the stacks (deeper calls are attributed to the last frame).
+
+    Returns
+    -------
+    stacks : dict
+      Time in microseconds (summed over the ranks) of each stack ('phase;caller;...;callee').
+    '''
+    stacks = {}
+    for _, phase, stats in dumps:
+        callees = {}
+        for func, (_, _, _, _, callers) in stats.items():
+            for caller, (_, _, _, edge_cumtime) in callers.items():
+                callees.setdefault(caller, []).append((func, edge_cumtime))
+        roots = [func for func, (_, _, _, _, callers) in stats.items() if not callers]
+
+        def visit(func, path, scale):
+            # 'scale' is the fraction of the calls of the function that belong to this path
+            _, _, tottime, cumtime, _ = stats[func]
+            path = path + [function_label(func)]
+            self_time = tottime * scale
+            for callee, edge_cumtime in callees.get(func, []):
+                callee_cumtime = stats[callee][3]
+                if callee_cumtime <= 0 or edge_cumtime <= 0:
+                    continue
+                if len(path) >= max_depth or function_label(callee) in path or edge_cumtime * scale < 1e-6:
+                    # depth limit, recursion and negligible calls
+                    self_time += edge_cumtime * scale
+                    continue
+                visit(callee, path, min(edge_cumtime * scale / callee_cumtime, 1.0))
+            key = ";".join([phase] + path)
+            stacks[key] = stacks.get(key, 0.0) + self_time * 1e6
+
+        for root in roots:
+            visit(root, [], 1.0)
+    return stacks
+
+def print_table(entries, top=30):
+    '''
+    Prints the hot spots as table.
+    '''
+    print(f"{'phase':<18} {'self(s)':>10} {'share':>7} {'mean/rank':>10} {'max/rank':>10} "
+          f"{'cumul.(s)':>10} {'calls':>12}  function")
+    for e in entries[:top]:
+        print(f"{e['phase']:<18} {e['self']:10.4f} {100*e['share']:6.1f}% {e['self_mean']:10.4f} {e['self_max']:10.4f} "
+              f"{e['cumulative']:10.4f} {e['calls']:12d}  {e['function']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merges the profile dumps of all ranks and phases into a hot-spot table "
+                                                 "and a collapsed-stack file (for flamegraph.pl or speedscope)")
+    parser.add_argument("inputs", nargs='+', help="profile dumps, or directories that contain them")
+    parser.add_argument("-top", help="number of functions in the table", type=int, default=30)
+    parser.add_argument("-by_phase", action='store_true', help="list the functions per phase", default=False)
+    parser.add_argument("-phase", help="only merge the dumps of this phase (e.g., 'build-network')", type=str, default="")
+    parser.add_argument("-collapsed", help="collapsed-stack output file (none if empty)", type=str, default="profile.collapsed")
+    args = parser.parse_args(argv)
+
+    dumps = load_dumps(args.inputs)
+    if args.phase:
+        dumps = [dump for dump in dumps if dump[1] == args.phase]
+    if not dumps:
+        raise SystemExit("No profile dumps found.")
+    print(f"Merged {len(dumps)} profile dumps of {len({rank for rank, _, _ in dumps})} ranks "
+          f"(phases: {', '.join(sorted({phase for _, phase, _ in dumps}))}).")
+    print_table(hot_spots(dumps, args.by_phase), args.top)
+    if args.collapsed:
+        with open(args.collapsed, "w") as f:
+            for stack, time in sorted(collapsed_stacks(dumps).items()):
+                if round(time) > 0:
+                    f.write(f"{stack} {round(time)}\n")
+        print(f"Collapsed stacks written to '{args.collapsed}'.")
+
+if __name__ == "__main__":
+    main()
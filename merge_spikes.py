@@ -0,0 +1,41 @@
+"""
+Script to merge the spike files of all ranks into one globally sorted spike raster
+(streaming, i.e., without loading all spikes into memory)
+"""
+
+import argparse
+import numpy as np
+import spike_output
+
+# Parse commandline arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("inputs", nargs='+', help="spike files of the ranks ('.npy', raw '.bin' or text), "
+                                              "or one file written via MPI-IO (with '.index' file)")
+parser.add_argument("-output", help="output file (format determined by the suffix: '.npy', raw '.bin', "
+                                    "or text otherwise)", type=str, default="spikes.dat")
+parser.add_argument("-chunk_size", help="number of spikes per input file to hold in memory at once", type=int, default=1048576)
+args = parser.parse_args()
+
+# Collect the sorted blocks of all inputs
+blocks = []
+for path in args.inputs:
+    blocks.extend(spike_output.spike_blocks(path))
+num_spikes = sum(len(block) for block in blocks)
+
+# Merge and write chunk by chunk
+if args.output.endswith(".npy"):
+    out = np.lib.format.open_memmap(args.output, mode='w+', dtype=spike_output.spike_dtype, shape=(num_spikes,))
+    pos = 0
+    for chunk in spike_output.merge_blocks(blocks, args.chunk_size):
+        out[pos:pos+len(chunk)] = chunk
+        pos += len(chunk)
+    out.flush()
+else:
+    with open(args.output, 'wb') as f:
+        for chunk in spike_output.merge_blocks(blocks, args.chunk_size):
+            if args.output.endswith(".bin"):
+                chunk.tofile(f)
+            else:
+                np.savetxt(f, np.column_stack([chunk['t'], chunk['gid']]),
+                           fmt="%.3f %d") # integer formatting for neuron number
+print(f"Merged {num_spikes} spikes from {len(blocks)} blocks into '{args.output}'.")
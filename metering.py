@@ -1,4 +1,36 @@
+import json
+import resource
+import sys
 import time
+from contextlib import contextmanager
+import numpy as np
+
+def current_rss_mb():
+    """
+    Returns the current resident set size of this process in MB (from /proc, NaN if not available)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024**2
+    except (OSError, IndexError, ValueError):
+        return float("nan")
+
+def trim_memory():
+    """
+    Returns freed heap memory to the operating system, such that it is reflected by the RSS (glibc only)
+    """
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB so far
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KB otherwise
 
 class RuntimeMetering:
     def __init__(self):
@@ -9,7 +41,16 @@ class RuntimeMetering:
         Set the start of runtime metering
         """
         self.metering_checkpoints = {} # initialize dictionary of time metering checkpoints
-        self.metering_start_time = time.time()
+        self.metering_spans = {} # initialize dictionary of (nested) time metering spans
+        self.metering_info = {} # initialize dictionary of additional information (e.g., cache hits)
+        self.reduced_checkpoints = {} # initialize dictionaries of statistics across ranks
+        self.reduced_spans = {}
+        self.memory_samples = {} # initialize dictionary of memory samples (current and peak RSS in MB)
+        self.reduced_memory = {}
+        self.thread_times = {} # initialize dictionary of compute times per thread (e.g., as metered by NEURON)
+        self.reduced_threads = {}
+        self.span_stack = [] # names of the currently open spans
+        self.metering_start_time = time.perf_counter()
         self.metering_last_time = self.metering_start_time
         self.name_total = "meter-total"
 
@@ -23,17 +64,186 @@ class RuntimeMetering:
             raise ValueError(f"Metering checkpoint may not be named '{self.name_total}'.")
         elif name in self.metering_checkpoints:
             raise ValueError(f"Metering checkpoint '{name}' already exists.")
-        current_time = time.time()
+        current_time = time.perf_counter()
         self.metering_checkpoints[name] = current_time - self.metering_last_time
         self.metering_last_time = current_time
 
-    
+    @contextmanager
+    def span(self, name):
+        """
+        Context manager to meter the runtime of a code block, independent of the checkpoints;
+        spans can be nested and are named by the path of the enclosing spans (e.g., 'model-init/build')
+        """
+        path = "/".join(self.span_stack + [name])
+        if not name or "/" in name:
+            raise ValueError("Metering span has to have a non-empty name without '/'.")
+        elif path in self.metering_spans:
+            raise ValueError(f"Metering span '{path}' already exists.")
+        self.span_stack.append(name)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.metering_spans[path] = time.perf_counter() - start_time
+            self.span_stack.pop()
+
+    def add_span(self, name, duration):
+        """
+        Add a span with a runtime that has been metered elsewhere (e.g., by NEURON)
+        """
+        path = "/".join(self.span_stack + [name])
+        if path in self.metering_spans:
+            raise ValueError(f"Metering span '{path}' already exists.")
+        self.metering_spans[path] = duration
+
+    def sample_memory(self, name):
+        """
+        Add a sample of the current and peak resident set size (RSS) of this rank
+        """
+        if name in self.memory_samples:
+            raise ValueError(f"Memory sample '{name}' already exists.")
+        self.memory_samples[name] = {"current": current_rss_mb(), "peak": peak_rss_mb()}
+
+    def add_thread_times(self, name, times):
+        """
+        Add the compute times of the threads of this rank for a code block (e.g., from 'pc.thread_ctime()')
+        """
+        if name in self.thread_times:
+            raise ValueError(f"Thread times '{name}' already exist.")
+        self.thread_times[name] = [float(runtime) for runtime in times]
+
+    def thread_imbalance(self, name):
+        """
+        Returns the imbalance of the compute times of the threads (ratio of maximum to mean)
+        """
+        times = np.array(self.thread_times[name])
+        return float(times.max() / times.mean()) if len(times) > 0 and times.mean() > 0 else 1.0
+
+    def set_info(self, name, value):
+        """
+        Set additional information to be reported with the metering results
+        """
+        self.metering_info[name] = value
+
+    def total(self):
+        """
+        Returns the runtime from the start until the last checkpoint
+        """
+        return self.metering_last_time - self.metering_start_time
+
+    def reduce(self, pc):
+        """
+        Computes the minimum, mean and maximum of each checkpoint, span, memory sample and thread imbalance across
+        all ranks, the imbalance (ratio of maximum to mean), and the total memory of all ranks;
+        has to be called on all ranks
+        """
+        from neuron import h
+        checkpoints = dict(self.metering_checkpoints)
+        checkpoints[self.name_total] = self.total()
+        memory = {}
+        entries = [(self.reduced_checkpoints, name, checkpoints[name]) for name in sorted(checkpoints)] + \
+                  [(self.reduced_spans, name, self.metering_spans[name]) for name in sorted(self.metering_spans)] + \
+                  [(memory, (name, kind), self.memory_samples[name][kind])
+                   for name in sorted(self.memory_samples) for kind in ("current", "peak")] + \
+                  [(self.reduced_threads, name, self.thread_imbalance(name)) for name in sorted(self.thread_times)]
+        local = h.Vector([value for _, _, value in entries])
+        v_min, v_max, v_sum = local.c(), local.c(), local.c()
+        pc.allreduce(v_min, 3)
+        pc.allreduce(v_max, 2)
+        pc.allreduce(v_sum, 1)
+        num_ranks = int(pc.nhost())
+        for i, (reduced, name, _) in enumerate(entries):
+            mean = v_sum[i] / num_ranks
+            reduced[name] = {"min": v_min[i], "mean": mean, "max": v_max[i],
+                             "imbalance": v_max[i] / mean if mean > 0 else 1.0}
+        for (name, kind), r in memory.items():
+            r["total"] = r["mean"] * num_ranks # what has to fit into the memory of all nodes
+            self.reduced_memory.setdefault(name, {})[kind] = r
+
     def print_summary(self):
         """
-        Prints a summary of the metering results
+        Prints a summary of the metering results (with statistics across ranks if 'reduce()' has been called)
         """
+        def line(name, runtime, reduced):
+            s = f"{name}{' ' * (25 - len(name))}{runtime}"
+            if name in reduced:
+                r = reduced[name]
+                s += f"  (min {r['min']:.6f}; mean {r['mean']:.6f}; max {r['max']:.6f}; imbalance {r['imbalance']:.3f})"
+            return s
+
         print (f"meter{' ' * (25 - len('meter'))}runtime(s)\n"
                f"{'-' * 40}")
-        for name, time in self.metering_checkpoints.items():
-            print(f"{name}{' ' * (25 - len(name))}{time}")
-        print(f"{self.name_total}{' ' * (25 - len(self.name_total))}{self.metering_last_time - self.metering_start_time}")
\ No newline at end of file
+        for name, runtime in self.metering_checkpoints.items():
+            print(line(name, runtime, self.reduced_checkpoints))
+        print(line(self.name_total, self.total(), self.reduced_checkpoints))
+        for name, value in self.metering_info.items():
+            print(f"{name}{' ' * (25 - len(name))}{value}")
+        if self.metering_spans:
+            print(f"{'-' * 40}\n"
+                  f"span{' ' * (25 - len('span'))}runtime(s)")
+            for name, runtime in self.metering_spans.items():
+                print(line(name, runtime, self.reduced_spans))
+        if self.memory_samples:
+            print(f"{'-' * 40}\n"
+                  f"memory{' ' * (25 - len('memory'))}rss(MB)  peak(MB)")
+            for name, sample in self.memory_samples.items():
+                s = f"{name}{' ' * (25 - len(name))}{sample['current']:.1f}  {sample['peak']:.1f}"
+                if name in self.reduced_memory:
+                    r = self.reduced_memory[name]
+                    s += (f"  (rss max {r['current']['max']:.1f}; total {r['current']['total']:.1f}; "
+                          f"peak max {r['peak']['max']:.1f}; total {r['peak']['total']:.1f})")
+                print(s)
+        if self.thread_times:
+            print(f"{'-' * 40}\n"
+                  f"threads{' ' * (25 - len('threads'))}compute time(s) per thread")
+            for name, times in self.thread_times.items():
+                s = (f"{name}{' ' * (25 - len(name))}min {min(times):.6f}; mean {np.mean(times):.6f}; "
+                     f"max {max(times):.6f}; imbalance {self.thread_imbalance(name):.3f}")
+                if name in self.reduced_threads:
+                    s += f"  (imbalance across ranks: mean {self.reduced_threads[name]['mean']:.3f}; max {self.reduced_threads[name]['max']:.3f})"
+                print(s)
+
+    def print_statistics(self, prefix):
+        """
+        Prints statistics over all checkpoints whose names start with the given prefix
+        (e.g., the runs of multiple trials)
+        """
+        times = np.array([runtime for name, runtime in self.metering_checkpoints.items() if name.startswith(prefix)])
+        if len(times) == 0:
+            return
+        print(f"{'-' * 40}\n"
+              f"{prefix}count{' ' * (25 - len(prefix) - len('count'))}{len(times)}")
+        for stat, value in [("min", times.min()), ("max", times.max()), ("std", times.std()),
+                            ("median", np.median(times)), ("mean", times.mean())]:
+            print(f"{prefix}{stat}{' ' * (25 - len(prefix) - len(stat))}{value}")
+
+    def record(self, **run_info):
+        """
+        Returns a machine-readable record of the metering results, with additional information
+        about the run (e.g., parameters and thread/rank counts)
+        """
+        def entry(name, runtime, reduced):
+            e = {"runtime": runtime}
+            e.update(reduced.get(name, {}))
+            return e
+
+        record = dict(run_info)
+        record["checkpoints"] = {name: entry(name, runtime, self.reduced_checkpoints)
+                                 for name, runtime in self.metering_checkpoints.items()}
+        record["total"] = entry(self.name_total, self.total(), self.reduced_checkpoints)
+        record["spans"] = {name: entry(name, runtime, self.reduced_spans)
+                           for name, runtime in self.metering_spans.items()}
+        record["memory"] = {name: dict(sample, **{"reduced": self.reduced_memory.get(name, {})})
+                            for name, sample in self.memory_samples.items()}
+        record["threads"] = {name: {"times": times, "imbalance": self.thread_imbalance(name),
+                                    "reduced": self.reduced_threads.get(name, {})}
+                             for name, times in self.thread_times.items()}
+        record["info"] = dict(self.metering_info)
+        return record
+
+    def write_record(self, filename, **run_info):
+        """
+        Writes the record of the metering results (cf. 'record()') to a JSON file
+        """
+        with open(filename, "w") as f:
+            json.dump(self.record(**run_info), f, indent=4)
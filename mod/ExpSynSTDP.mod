@@ -0,0 +1,103 @@
+COMMENT
+Exponentially decaying synaptic conductance (as ExpSyn) with pair-based spike-timing-dependent
+plasticity of the nearest-neighbor type. The plasticity scales the weights of the incoming events
+by a factor in [wmin, wmax].
+
+Presynaptic spikes arrive as events with non-negative weight. Postsynaptic spikes arrive as events
+with negative weight from a NetCon of the cell's own spike source, with a delay of 'post_delay'
+(typically the minimum delay of the network, such that the plasticity does not shorten the interval
+of the spike exchange). The delay is compensated: the postsynaptic spike is taken to have occurred
+at t - post_delay, and depression that has been computed for presynaptic spikes that arrived in the
+meantime is corrected.
+ENDCOMMENT
+
+NEURON {
+    POINT_PROCESS ExpSynSTDP
+    RANGE tau, e, i, scale
+    GLOBAL tau_plus, tau_minus, a_plus, a_minus, wmin, wmax, post_delay
+    NONSPECIFIC_CURRENT i
+}
+
+UNITS {
+    (nA) = (nanoamp)
+    (mV) = (millivolt)
+    (uS) = (microsiemens)
+}
+
+PARAMETER {
+    tau = 0.1 (ms) <1e-9,1e9>
+    e = 0 (mV)
+    tau_plus = 16.8 (ms) <1e-9,1e9>   : time constant of potentiation
+    tau_minus = 33.7 (ms) <1e-9,1e9>  : time constant of depression
+    a_plus = 0.01                     : amplitude of potentiation (change of the scaling factor)
+    a_minus = 0.0105                  : amplitude of depression (change of the scaling factor)
+    wmin = 0                          : minimum scaling factor
+    wmax = 2                          : maximum scaling factor
+    post_delay = 0 (ms)               : delay of the postsynaptic spike events
+}
+
+ASSIGNED {
+    v (mV)
+    i (nA)
+    scale           : scaling factor of the weights
+    tpre (ms)       : arrival time of the last presynaptic spike
+    tpre_prev (ms)  : arrival time of the presynaptic spike before
+    tpost (ms)      : time of the last postsynaptic spike
+}
+
+STATE {
+    g (uS)
+}
+
+INITIAL {
+    g = 0
+    scale = 1
+    tpre = -1e9
+    tpre_prev = -1e9
+    tpost = -1e9
+}
+
+BREAKPOINT {
+    SOLVE state METHOD cnexp
+    i = g*(v - e)
+}
+
+DERIVATIVE state {
+    g' = -g/tau
+}
+
+NET_RECEIVE(weight (uS)) {
+    LOCAL tp
+    if (weight >= 0) {
+        : presynaptic spike: depression by the last postsynaptic spike
+        g = g + weight*scale
+        if (tpost > -1e8) {
+            scale = scale - a_minus*exp(-(t - tpost)/tau_minus)
+        }
+        tpre_prev = tpre
+        tpre = t
+    } else {
+        : postsynaptic spike (occurred at t - post_delay)
+        tp = t - post_delay
+        if (tpre > tp) {
+            : the last presynaptic spike arrived after the postsynaptic spike: correct its depression
+            if (tpost > -1e8) {
+                scale = scale + a_minus*exp(-(tpre - tpost)/tau_minus)
+            }
+            scale = scale - a_minus*exp(-(tpre - tp)/tau_minus)
+            if (tpre_prev > -1e8 && tpre_prev <= tp) {
+                scale = scale + a_plus*exp(-(tp - tpre_prev)/tau_plus)
+            }
+        } else if (tpre > -1e8) {
+            : potentiation by the last presynaptic spike
+            scale = scale + a_plus*exp(-(tp - tpre)/tau_plus)
+        }
+        tpost = tp
+    }
+    if (scale < wmin) {
+        scale = wmin
+    }
+    if (scale > wmax) {
+        scale = wmax
+    }
+}
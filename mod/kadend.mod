@@ -0,0 +1,65 @@
+COMMENT
+A-type (transient) potassium channel (ik = gbar*a*b*(v - ek)) for the active dendrites of the
+complex cell, with a density that increases with the distance from the soma. Kinetics are
+temperature-independent.
+ENDCOMMENT
+
+NEURON {
+    SUFFIX kadend
+    USEION k READ ek WRITE ik
+    RANGE gbar, ik
+}
+
+UNITS {
+    (mA) = (milliamp)
+    (mV) = (millivolt)
+    (S) = (siemens)
+}
+
+PARAMETER {
+    gbar = 0.01 (S/cm2) <0,1e9>
+}
+
+ASSIGNED {
+    v (mV)
+    ek (mV)
+    ik (mA/cm2)
+    ainf
+    binf
+    atau (ms)
+    btau (ms)
+}
+
+STATE {
+    a
+    b
+}
+
+BREAKPOINT {
+    SOLVE states METHOD cnexp
+    ik = gbar*a*b*(v - ek)
+}
+
+INITIAL {
+    rates(v)
+    a = ainf
+    b = binf
+}
+
+DERIVATIVE states {
+    rates(v)
+    a' = (ainf - a)/atau
+    b' = (binf - b)/btau
+}
+
+UNITSOFF
+PROCEDURE rates(v (mV)) {
+    ainf = 1/(1 + exp(-(v + 50)/10))
+    atau = 0.2 + 0.8*exp(-((v + 45)/20)*((v + 45)/20))
+    binf = 1/(1 + exp((v + 56)/8))
+    btau = 2 + 0.26*(v + 50)
+    if (btau < 2) {
+        btau = 2
+    }
+}
+UNITSON
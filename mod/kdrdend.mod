@@ -0,0 +1,54 @@
+COMMENT
+Delayed rectifier potassium channel (ik = gbar*n*(v - ek)) for the active dendrites of the
+complex cell. Kinetics are temperature-independent.
+ENDCOMMENT
+
+NEURON {
+    SUFFIX kdrdend
+    USEION k READ ek WRITE ik
+    RANGE gbar, ik
+}
+
+UNITS {
+    (mA) = (milliamp)
+    (mV) = (millivolt)
+    (S) = (siemens)
+}
+
+PARAMETER {
+    gbar = 0.01 (S/cm2) <0,1e9>
+}
+
+ASSIGNED {
+    v (mV)
+    ek (mV)
+    ik (mA/cm2)
+    ninf
+    ntau (ms)
+}
+
+STATE {
+    n
+}
+
+BREAKPOINT {
+    SOLVE states METHOD cnexp
+    ik = gbar*n*(v - ek)
+}
+
+INITIAL {
+    rates(v)
+    n = ninf
+}
+
+DERIVATIVE states {
+    rates(v)
+    n' = (ninf - n)/ntau
+}
+
+UNITSOFF
+PROCEDURE rates(v (mV)) {
+    ninf = 1/(1 + exp(-(v + 42)/8))
+    ntau = 1 + 4*exp(-((v + 40)/20)*((v + 40)/20))
+}
+UNITSON
@@ -0,0 +1,69 @@
+COMMENT
+Dendritic sodium channel with fast activation, fast inactivation and slow (cumulative)
+inactivation (ina = gbar*m^3*h*s*(v - ena)), for the active dendrites of the complex cell.
+Kinetics are temperature-independent.
+ENDCOMMENT
+
+NEURON {
+    SUFFIX nadend
+    USEION na READ ena WRITE ina
+    RANGE gbar, ina
+}
+
+UNITS {
+    (mA) = (milliamp)
+    (mV) = (millivolt)
+    (S) = (siemens)
+}
+
+PARAMETER {
+    gbar = 0.02 (S/cm2) <0,1e9>
+}
+
+ASSIGNED {
+    v (mV)
+    ena (mV)
+    ina (mA/cm2)
+    minf
+    hinf
+    sinf
+    mtau (ms)
+    htau (ms)
+    stau (ms)
+}
+
+STATE {
+    m
+    h
+    s
+}
+
+BREAKPOINT {
+    SOLVE states METHOD cnexp
+    ina = gbar*m*m*m*h*s*(v - ena)
+}
+
+INITIAL {
+    rates(v)
+    m = minf
+    h = hinf
+    s = sinf
+}
+
+DERIVATIVE states {
+    rates(v)
+    m' = (minf - m)/mtau
+    h' = (hinf - h)/htau
+    s' = (sinf - s)/stau
+}
+
+UNITSOFF
+PROCEDURE rates(v (mV)) {
+    minf = 1/(1 + exp(-(v + 38)/7))
+    mtau = 0.05 + 0.4*exp(-((v + 38)/15)*((v + 38)/15))
+    hinf = 1/(1 + exp((v + 62)/6))
+    htau = 0.5 + 5*exp(-((v + 60)/15)*((v + 60)/15))
+    sinf = 0.5 + 0.5/(1 + exp((v + 58)/2))
+    stau = 20 + 180/(1 + exp((v + 50)/5))
+}
+UNITSON
@@ -0,0 +1,292 @@
+"""
+Estimation of the model size (cells, sections, compartments, synapses) and of the memory
+per rank, without NEURON (by replaying the random morphologies of the cells)
+"""
+
+import argparse
+import json
+import shlex
+import numpy as np
+import connectivity
+import morphology
+import parameters
+import partition
+
+# Default coefficients of the memory model (resident memory per rank of NEURON with the model
+# built and initialized; calibrate with '-calibrate' from run records of the target system)
+default_memory_model = {"base_mb" : 150.0,           # NEURON, Python, MPI and libraries
+                        "per_cell_kb" : 4.0,         # cell object, spike detector and gid registration
+                        "per_section_kb" : 1.0,      # section (including the Python wrapper)
+                        "per_compartment_kb" : 0.5,  # node with the data of its mechanisms
+                        "complex_factor" : 2.0,      # memory per compartment of complex cells relative to simple ones
+                        "per_synapse_kb" : 0.4,      # synapse (point process)
+                        "per_connection_kb" : 0.2,   # incoming connection (NetCon)
+                        "scale" : 1.0}               # calibrated factor of the model-dependent memory
+
+# Dtype of the per-gid output
+gid_dtype = np.dtype([('gid', '<i8'), ('rank', '<i4'), ('nsec', '<i4'), ('ncomp', '<i4'), ('nsyn', '<i4'), ('ncon', '<i4')])
+
+class HostContext:
+    """
+    Stands in for 'h.ParallelContext' where only the rank and number of ranks are needed.
+    """
+    def __init__(self, num_ranks, rank=0):
+        self.num_ranks = num_ranks  # number of ranks
+        self.rank = rank            # rank of this process
+
+    def id(self):
+        return self.rank
+
+    def nhost(self):
+        return self.num_ranks
+
+class ModelEstimate:
+    """
+    Exact size of the model per gid and its distribution across ranks.
+    """
+    def __repr__(self):
+        return (f"model estimate: {self.num_cells} cells; {self.nsec.sum()} sections; "
+                f"{self.ncomp.sum()} compartments; {self.nsyn.sum()} synapses; {self.ncon.sum()} connections "
+                f"on {self.num_ranks} ranks")
+
+    def __init__(self, nsec, ncomp, nsyn, ncon, partition, complex=False):
+        self.nsec = nsec            # number of sections of each gid
+        self.ncomp = ncomp          # number of compartments of each gid
+        self.nsyn = nsyn            # number of synapses of each gid (ring and random)
+        self.ncon = ncon            # number of incoming connections of each gid (including stimulus and STDP)
+        self.partition = partition  # assignment of the gids to ranks
+        self.complex = complex      # whether the cells have active dendrites (more data per compartment)
+        self.num_cells = len(nsec)
+        self.num_ranks = partition.num_ranks
+
+    def totals(self):
+        '''
+        Returns the total number of cells, sections, compartments and synapses.
+        '''
+        return {"cells" : self.num_cells, "sections" : int(self.nsec.sum()),
+                "compartments" : int(self.ncomp.sum()), "synapses" : int(self.nsyn.sum()),
+                "connections" : int(self.ncon.sum())}
+
+    def per_rank(self):
+        '''
+        Returns the number of cells, sections, compartments, synapses and connections of each rank.
+        '''
+        ranks = self.partition.rank_of_gid
+        counts = {"cells" : np.bincount(ranks, minlength=self.num_ranks)}
+        for name, values in [("sections", self.nsec), ("compartments", self.ncomp), ("synapses", self.nsyn),
+                             ("connections", self.ncon)]:
+            counts[name] = np.bincount(ranks, weights=values, minlength=self.num_ranks).astype(np.int64)
+        return counts
+
+    def memory_per_rank(self, memory_model=default_memory_model):
+        '''
+        Returns the predicted resident memory of each rank in MB (cf. 'default_memory_model').
+        '''
+        return memory_model["base_mb"] + memory_model["scale"] * model_memory_mb(self.per_rank(), memory_model, self.complex)
+
+    def per_gid(self):
+        '''
+        Returns the counts of each gid as array of 'gid_dtype'.
+        '''
+        result = np.empty(self.num_cells, dtype=gid_dtype)
+        result['gid'] = np.arange(self.num_cells)
+        result['rank'] = self.partition.rank_of_gid
+        result['nsec'] = self.nsec
+        result['ncomp'] = self.ncomp
+        result['nsyn'] = self.nsyn
+        result['ncon'] = self.ncon
+        return result
+
+def model_memory_mb(counts, memory_model, complex=False):
+    '''
+    Returns the model-dependent memory in MB for the given counts (per rank), before scaling.
+    '''
+    per_compartment_kb = memory_model["per_compartment_kb"] * (memory_model["complex_factor"] if complex else 1)
+    return (counts["cells"] * memory_model["per_cell_kb"] + counts["sections"] * memory_model["per_section_kb"] +
+            counts["compartments"] * per_compartment_kb +
+            counts["synapses"] * memory_model["per_synapse_kb"] +
+            counts["connections"] * memory_model["per_connection_kb"]) / 1024
+
+def estimate(params, num_ranks, strategy="round-robin", cache_dir=""):
+    '''
+    Computes the size of the model as built by 'RingNetwork' (without NEURON).
+
+    Parameters
+    ----------
+    params : parameters.model_parameters
+      Model parameters.
+    num_ranks : int
+      Number of MPI ranks.
+    strategy : str
+      Strategy to distribute the gids across ranks (cf. 'partition.strategies').
+    cache_dir : str
+      Directory to cache the section and compartment counts in (no caching if empty).
+
+    Returns
+    -------
+    estimate : ModelEstimate
+      The counts per gid and the partition.
+    '''
+    gids = np.arange(params.num_cells)
+    # (the positions of the synapses do not matter for the size, such that only the counts are computed)
+    nsec, ncomp = morphology.compartment_counts(gids, params.cell, cache_dir)
+    # synapses: one on the soma for the ring and the random ones; connections: one per synapse, a stimulus
+    # for the first cell of each ring, and one per synapse for the postsynaptic spikes with STDP
+    nsyn = np.full(params.num_cells, params.cell.synapses + 1, dtype=np.int64)
+    ncon = nsyn * (2 if params.cell.stdp else 1) + (gids % params.ring_size == 0)
+    costs = ncomp + partition.synapse_cost*(params.cell.synapses + 1)
+    gid_partition = partition.partition_costs(strategy, costs, num_ranks, params.ring_size)
+    return ModelEstimate(np.asarray(nsec), np.asarray(ncomp), nsyn, ncon, gid_partition, params.cell.complex)
+
+def inter_rank_connections(params, gid_partition):
+    '''
+    Returns the number of incoming connections of each rank whose source is on another
+    rank (by generating the connection tables of all ranks).
+    '''
+    counts = np.zeros(gid_partition.num_ranks, dtype=np.int64)
+    for rank in range(gid_partition.num_ranks):
+        gids = gid_partition.gids(rank)
+        table = connectivity.generate_connections(gids, params.num_cells, params.ring_size, params.cell.synapses,
+                                                  params.min_delay, params.connectivity)
+        counts[rank] = connectivity.inter_rank_connections(table, gid_partition.rank_of_gid, rank)
+    return counts
+
+def parse_arguments(argv=None):
+    '''
+    Parses the commandline arguments of the model (as of 'run_ring_network.py') and of the estimator.
+
+    Returns
+    -------
+    args : argparse.Namespace
+      The parsed arguments.
+    params : parameters.model_parameters
+      The model parameters for the given number of ranks.
+    '''
+    parser = argparse.ArgumentParser(description="Model size and memory estimate of the ring network (without NEURON)")
+    parameters.add_arguments(parser)
+    parser.add_argument("-num_ranks", help="number of MPI ranks", type=int, default=1)
+    parser.add_argument("-partition", help="strategy to distribute the gids across ranks", type=str,
+                        choices=partition.strategies, default="round-robin")
+    parser.add_argument("-morphology_cache", help="directory to cache the section and compartment counts of the cells in "
+                                                 "(no caching if empty)", type=str, default="")
+    parser.add_argument("-memory_model", help="JSON file with the coefficients of the memory model", type=str, default="")
+    parser.add_argument("-calibrate", nargs="+", help="run records (cf. '-record' of 'run_ring_network.py') to calibrate "
+                                                     "the memory model with (written to the file given by '-memory_model')",
+                        type=str, default=[])
+    parser.add_argument("-memory_limit", help="memory per rank in MB (exits with code 1 if the prediction exceeds it)", type=float, default=0)
+    parser.add_argument("-connections", action='store_true', help="count the connections across ranks "
+                                                                  "(generates the connectivity of all ranks)", default=False)
+    parser.add_argument("-per_gid", help="file to write the counts of each gid to ('.npy' or text)", type=str, default="")
+    args, _ = parser.parse_known_args(argv)
+    # (the parameters only print information as rank 0, i.e., when run as script)
+    params = parameters.from_arguments(args, HostContext(args.num_ranks, 0 if argv is None else 1))
+    return args, params
+
+def load_memory_model(filename=""):
+    '''
+    Loads the coefficients of the memory model (the defaults for missing entries).
+    '''
+    memory_model = dict(default_memory_model)
+    if filename:
+        with open(filename) as f:
+            memory_model.update(json.load(f))
+    return memory_model
+
+def calibrate_memory_model(record_files, memory_model=default_memory_model):
+    '''
+    Fits the base memory and the scale of the model-dependent memory by least squares to
+    the maximum resident memory per rank after initialization in run records.
+
+    Returns
+    -------
+    memory_model : dict
+      The calibrated coefficients.
+    '''
+    predicted = []
+    measured = []
+    for record_file in record_files:
+        with open(record_file) as f:
+            record = json.load(f)
+        sample = record.get("memory", {}).get("after-stdinit", {}).get("reduced", {})
+        if not sample:
+            continue
+        data = dict({'complex': False, 'stdp': False}, **record["parameters"])
+        cell = parameters.cell_parameters(data, None, None, None)
+        params = parameters.model_parameters(None, data['duration'], 0, data['ring-size'], None, None, None, HostContext(1, 1))
+        params.num_cells = data['num-cells']
+        params.cell = cell
+        model_estimate = estimate(params, record["num_ranks"], record.get("partition", "round-robin"))
+        predicted.append(model_memory_mb(model_estimate.per_rank(), memory_model, model_estimate.complex).max())
+        measured.append(sample["current"]["max"])
+    if len(predicted) < 2:
+        raise ValueError("Calibration requires at least two run records with memory samples.")
+    (base, scale), *_ = np.linalg.lstsq(np.column_stack([np.ones(len(predicted)), predicted]), np.array(measured), rcond=None)
+    calibrated = dict(memory_model)
+    calibrated.update({"base_mb" : float(max(base, 0)), "scale" : float(max(scale, 0))})
+    return calibrated
+
+def predicted_memory_mb(command_args, num_ranks, memory_model=default_memory_model):
+    '''
+    Predicts the memory of a run of 'run_ring_network.py' (e.g., for the benchmark scheduler).
+
+    Parameters
+    ----------
+    command_args : str
+      Commandline arguments of 'run_ring_network.py'.
+    num_ranks : int
+      Number of MPI ranks.
+    memory_model : dict
+      Coefficients of the memory model.
+
+    Returns
+    -------
+    per_rank : float
+      Maximum predicted memory per rank in MB.
+    total : float
+      Predicted memory of all ranks in MB.
+    '''
+    args, params = parse_arguments(shlex.split(command_args) + ["-num_ranks", str(num_ranks)])
+    memory = estimate(params, num_ranks, args.partition, args.morphology_cache).memory_per_rank(memory_model)
+    return float(memory.max()), float(memory.sum())
+
+if __name__ == "__main__":
+    args, params = parse_arguments()
+    memory_model = load_memory_model(args.memory_model)
+    if args.calibrate:
+        memory_model = calibrate_memory_model(args.calibrate, memory_model)
+        print(f"Calibrated memory model: base {memory_model['base_mb']:.1f} MB; scale {memory_model['scale']:.3f}")
+        if args.memory_model:
+            with open(args.memory_model, "w") as f:
+                json.dump(memory_model, f, indent=4)
+
+    model_estimate = estimate(params, args.num_ranks, args.partition, args.morphology_cache)
+    totals = model_estimate.totals()
+    print(f"Cell stats: {totals['cells']} cells; {totals['sections']} segments; {totals['compartments']} compartments; "
+          f"{totals['compartments']/max(totals['cells'], 1)} comp/cell.")
+    print(f"Synapses: {totals['synapses']} ({totals['synapses']/max(totals['cells'], 1):.1f} per cell); "
+          f"connections: {totals['connections']}")
+    print(f"Using {model_estimate.partition}")
+
+    per_rank = model_estimate.per_rank()
+    memory = model_estimate.memory_per_rank(memory_model)
+    print(f"{'per rank':<14}{'min':>14}{'mean':>14}{'max':>14}")
+    for name, values in list(per_rank.items()) + [("memory (MB)", memory)]:
+        print(f"{name:<14}{values.min():>14.1f}{values.mean():>14.1f}{values.max():>14.1f}")
+    print(f"Predicted memory of all ranks: {memory.sum():.1f} MB")
+
+    if args.connections:
+        remote = inter_rank_connections(params, model_estimate.partition)
+        print(f"Inter-rank connections ({params.connectivity.mode} connectivity): {remote.sum()} of {totals['synapses']} "
+              f"(per rank min {remote.min()}; mean {remote.mean():.1f}; max {remote.max()})")
+
+    if args.per_gid:
+        counts = model_estimate.per_gid()
+        if args.per_gid.endswith(".npy"):
+            np.save(args.per_gid, counts)
+        else:
+            np.savetxt(args.per_gid, np.column_stack([counts[name] for name in gid_dtype.names]),
+                       fmt="%d", header=" ".join(gid_dtype.names))
+
+    if args.memory_limit and memory.max() > args.memory_limit:
+        print(f"Predicted memory per rank ({memory.max():.1f} MB) exceeds the limit ({args.memory_limit:.1f} MB).")
+        raise SystemExit(1)
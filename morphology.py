@@ -0,0 +1,299 @@
+"""
+Morphology specifications of the branchy cells as NumPy arrays (independent of NEURON)
+"""
+
+import numpy as np
+import cache
+import mt19937
+
+# Soma dimensions (makes a soma of 500 microns squared)
+soma_length = 12.6157
+soma_diam = 12.6157
+
+def interp(r, i, n):
+    p = i * 1.0/(n-1)
+    return (1-p)*r[0] + p*r[1]
+
+class MorphologyTree:
+    """
+    Section tree of a branchy cell. Section 0 is the soma, the dendrites follow
+    level by level in the order in which they are created.
+    """
+    columns = ('parent', 'level', 'length', 'nseg')
+
+    def __repr__(self):
+        return f'morphology tree: {self.nsec} sections; {self.ncomp} compartments; {self.num_levels} levels'
+
+    def __init__(self, parent, level, length, nseg):
+        self.parent = parent        # index of the parent section (-1 for the soma)
+        self.level = level          # level of the section (0 for the soma)
+        self.length = length        # length of the section in microns
+        self.nseg = nseg            # number of compartments of the section
+
+    @property
+    def nsec(self):
+        return len(self.parent)
+
+    @property
+    def ncomp(self):
+        return int(np.sum(self.nseg))
+
+    @property
+    def num_levels(self):
+        return int(self.level[-1]) + 1
+
+def branching_tree(gid, params):
+    '''
+    Draws the branching decisions of one gid and returns the resulting tree.
+    The decisions of one level are drawn in one batch, in the same order as
+    when drawing them one section at a time, such that the results are identical.
+
+    Parameters
+    ----------
+    gid : int
+      Global identifier of the cell (seeds the branching generator).
+    params : cell.cell_parameters or parameters.cell_parameters
+      Cell parameters.
+
+    Returns
+    -------
+    tree : MorphologyTree
+      The section tree of the cell.
+    '''
+    branching_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    parent = [np.array([-1])]
+    level = [np.array([0])]
+    length = [np.array([soma_length])]
+    nseg = [np.array([1])]
+    level_secs = np.array([0])
+    num_secs = 1
+    for i in range(params.max_depth):
+        # branch prob, length and number of compartments at this level
+        bp = interp(params.branch_probs, i, params.max_depth)
+        l = interp(params.lengths, i, params.max_depth)
+        nc = round(interp(params.compartments, i, params.max_depth))
+
+        # every branching section gets two children
+        branching = level_secs[branching_gen.uniform(0, 1, size=len(level_secs)) < bp]
+        if len(branching) == 0:
+            break
+        children = np.repeat(branching, 2)
+        parent.append(children)
+        level.append(np.full(len(children), i+1))
+        length.append(np.full(len(children), l))
+        nseg.append(np.full(len(children), nc))
+        level_secs = np.arange(num_secs, num_secs + len(children))
+        num_secs += len(children)
+
+    return MorphologyTree(np.concatenate(parent).astype(np.int32),
+                          np.concatenate(level).astype(np.int16),
+                          np.concatenate(length).astype(np.float64),
+                          np.concatenate(nseg).astype(np.int32))
+
+def branching_counts(gids, params, chunk_size=4096):
+    '''
+    Computes the number of sections at each level for many gids at once, by
+    replaying the branching generators of all gids in parallel (yields the
+    same numbers as 'branching_tree()').
+
+    Parameters
+    ----------
+    gids : sequence of int
+      Global identifiers of the cells.
+    params : parameters.cell_parameters
+      Cell parameters.
+    chunk_size : int
+      Number of gids to process at once (bounds the memory usage).
+
+    Returns
+    -------
+    counts : numpy.ndarray
+      Array of shape (len(gids), max_depth+1) with the number of sections of
+      each gid at each level (level 0 is the soma).
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    counts = np.zeros((len(gids), params.max_depth+1), dtype=np.int64)
+    counts[:, 0] = 1
+    for start in range(0, len(gids), chunk_size):
+        streams = mt19937.RandomStreams(gids[start:start+chunk_size])
+        level_count = counts[start:start+chunk_size, 0].copy()
+        offset = np.zeros(len(streams), dtype=np.int64)
+        rows = np.arange(len(streams))
+        for i in range(params.max_depth):
+            if not level_count.any():
+                break
+            bp = interp(params.branch_probs, i, params.max_depth)
+            # one draw per section of the current level
+            draws = streams.uniform(int((offset + level_count).max()))
+            branching = np.zeros((len(streams), draws.shape[1] + 1), dtype=np.int64)
+            np.cumsum(draws < bp, axis=1, out=branching[:, 1:])
+            level_count = 2*(branching[rows, offset + level_count] - branching[rows, offset])
+            offset += counts[start:start+chunk_size, i]
+            counts[start:start+chunk_size, i+1] = level_count
+    return counts
+
+def compartment_counts(gids, params, cache_dir=""):
+    '''
+    Returns the number of sections and compartments of each gid (cf. 'branching_counts()'); if a
+    cache directory is provided, they are loaded from there if they have been stored before, and
+    are stored there otherwise.
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    if cache_dir:
+        key = cache.parameter_key(max_depth=params.max_depth, branch_probs=list(params.branch_probs),
+                                  compartments=list(params.compartments), gids=gids)
+        path = cache.cache_path(cache_dir, "compartments", key)
+        arrays = cache.load_arrays(path, ('nsec', 'ncomp'), mmap=False)
+        if arrays is not None:
+            return arrays['nsec'], arrays['ncomp']
+
+    counts = branching_counts(gids, params)
+    nseg_per_level = np.array([1] + [round(interp(params.compartments, i, params.max_depth))
+                                     for i in range(params.max_depth)], dtype=np.int64)
+    nsec, ncomp = counts.sum(axis=1), counts @ nseg_per_level
+    if cache_dir:
+        cache.save_arrays(path, nsec=nsec, ncomp=ncomp)
+    return nsec, ncomp
+
+def cells_for_compartments(num_compartments, ring_size, params, chunk_size=4096):
+    '''
+    Returns the smallest number of cells (in whole rings) whose morphologies have at least
+    the given number of compartments in total (gids counted from 0).
+    '''
+    total = 0
+    start = 0
+    while True:
+        _, ncomp = compartment_counts(range(start, start + chunk_size), params)
+        cumulative = total + np.cumsum(ncomp)
+        if cumulative[-1] >= num_compartments:
+            num_cells = start + int(np.searchsorted(cumulative, num_compartments)) + 1
+            return -(-num_cells // ring_size) * ring_size
+        total = cumulative[-1]
+        start += chunk_size
+
+def synapse_placement(gid, nsec, num_synapses):
+    '''
+    Draws the section index and position of the random synapses of one gid.
+    '''
+    seg_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    pos_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    sec = seg_gen.integers(0, nsec, size=num_synapses).astype(np.int32)
+    pos = pos_gen.uniform(0, 1, size=num_synapses)
+    return sec, pos
+
+class CellMorphologies:
+    """
+    Morphology specifications of a set of gids. Gids with identical branching
+    share the same MorphologyTree object.
+    """
+    def __repr__(self):
+        return f'cell morphologies: {len(self.gids)} cells; {len(self.trees)} distinct trees'
+
+    def __init__(self, gids, trees, tree_index, syn_section, syn_pos):
+        self.gids = gids                # gids in order of the rows
+        self.trees = trees              # distinct trees
+        self.tree_index = tree_index    # index of the tree of each gid
+        self.syn_section = syn_section  # section index of each synapse (one row per gid)
+        self.syn_pos = syn_pos          # position of each synapse on its section (one row per gid)
+
+    def __len__(self):
+        return len(self.gids)
+
+    def tree(self, i):
+        return self.trees[self.tree_index[i]]
+
+    def ncomp(self):
+        '''
+        Returns the number of compartments of each gid.
+        '''
+        ncomp_per_tree = np.array([tree.ncomp for tree in self.trees], dtype=np.int64)
+        return ncomp_per_tree[self.tree_index]
+
+    def nsec(self):
+        '''
+        Returns the number of sections of each gid.
+        '''
+        nsec_per_tree = np.array([tree.nsec for tree in self.trees], dtype=np.int64)
+        return nsec_per_tree[self.tree_index]
+
+def generate_morphologies(gids, params):
+    '''
+    Computes the morphology specifications for the given gids.
+
+    Parameters
+    ----------
+    gids : sequence of int
+      Global identifiers of the cells.
+    params : parameters.cell_parameters
+      Cell parameters.
+
+    Returns
+    -------
+    morphologies : CellMorphologies
+      The morphology specifications of all given gids.
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    trees = []
+    tree_ids = {}
+    tree_index = np.empty(len(gids), dtype=np.int32)
+    syn_section = np.empty((len(gids), params.synapses), dtype=np.int32)
+    syn_pos = np.empty((len(gids), params.synapses), dtype=np.float64)
+    for i, gid in enumerate(gids.tolist()):
+        tree = branching_tree(gid, params)
+        key = tree.parent.tobytes()
+        if key not in tree_ids:
+            tree_ids[key] = len(trees)
+            trees.append(tree)
+        tree_index[i] = tree_ids[key]
+        syn_section[i], syn_pos[i] = synapse_placement(gid, tree.nsec, params.synapses)
+
+    return CellMorphologies(gids, trees, tree_index, syn_section, syn_pos)
+
+def load_morphologies(gids, params, cache_dir=""):
+    '''
+    Returns the morphology specifications for the given gids. If a cache
+    directory is provided, they are loaded from there if they have been
+    stored before, and are stored there otherwise.
+
+    Parameters
+    ----------
+    gids : sequence of int
+      Global identifiers of the cells.
+    params : parameters.cell_parameters
+      Cell parameters.
+    cache_dir : str
+      Directory of the morphology cache (no caching if empty).
+
+    Returns
+    -------
+    morphologies : CellMorphologies
+      The morphology specifications of all given gids.
+    from_cache : bool
+      Whether the specifications have been loaded from the cache.
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    names = MorphologyTree.columns + ('tree_offset', 'tree_index', 'syn_section', 'syn_pos')
+    if cache_dir:
+        key = cache.parameter_key(max_depth=params.max_depth, branch_probs=list(params.branch_probs),
+                                  compartments=list(params.compartments), lengths=list(params.lengths),
+                                  synapses=params.synapses, gids=gids)
+        path = cache.cache_path(cache_dir, "morphology", key)
+        arrays = cache.load_arrays(path, names)
+        if arrays is not None:
+            offset = arrays['tree_offset']
+            trees = [MorphologyTree(*[arrays[name][offset[k]:offset[k+1]] for name in MorphologyTree.columns])
+                     for k in range(len(offset)-1)]
+            return CellMorphologies(gids, trees, arrays['tree_index'],
+                                    arrays['syn_section'], arrays['syn_pos']), True
+
+    morphologies = generate_morphologies(gids, params)
+    if cache_dir:
+        trees = morphologies.trees
+        arrays = {name: np.concatenate([getattr(tree, name) for tree in trees]) if trees else np.empty(0)
+                  for name in MorphologyTree.columns}
+        arrays['tree_offset'] = np.cumsum([0] + [tree.nsec for tree in trees])
+        arrays['tree_index'] = morphologies.tree_index
+        arrays['syn_section'] = morphologies.syn_section
+        arrays['syn_pos'] = morphologies.syn_pos
+        cache.save_arrays(path, **arrays)
+    return morphologies, False
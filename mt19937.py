@@ -0,0 +1,118 @@
+"""
+Vectorized replay of the random streams of 'np.random.Generator(np.random.MT19937(seed=gid))'
+for many gids at once (used to compute model statistics without drawing gid by gid)
+"""
+
+import numpy as np
+
+# Constants of np.random.SeedSequence
+_pool_size = 4
+_init_a = 0x43b0d7e5
+_mult_a = 0x931e8875
+_init_b = 0x8b51f9dd
+_mult_b = 0x58f38ded
+_mix_mult_l = 0xca01f9dd
+_mix_mult_r = 0x4973f715
+_xshift = 16
+_mask32 = 0xFFFFFFFF
+
+# Constants of MT19937
+_n = 624
+_m = 397
+_matrix_a = np.uint32(0x9908b0df)
+_upper_mask = np.uint32(0x80000000)
+_lower_mask = np.uint32(0x7fffffff)
+
+def _hashmix(value, hash_const):
+    value = value ^ np.uint32(hash_const[0])
+    hash_const[0] = (hash_const[0] * _mult_a) & _mask32
+    value = value * np.uint32(hash_const[0])
+    return value ^ (value >> np.uint32(_xshift))
+
+def _mix(x, y):
+    result = np.uint32(_mix_mult_l) * x - np.uint32(_mix_mult_r) * y
+    return result ^ (result >> np.uint32(_xshift))
+
+def seed_keys(seeds):
+    '''
+    Computes the initial MT19937 key of each seed, as seeded through
+    np.random.SeedSequence (seeds have to be in [0, 2**32)).
+
+    Returns
+    -------
+    keys : numpy.ndarray
+      Array of shape (len(seeds), 624) and dtype uint32.
+    '''
+    seeds = np.asarray(seeds, dtype=np.int64)
+    if len(seeds) > 0 and (seeds.min() < 0 or seeds.max() > _mask32):
+        raise ValueError("Seeds have to be in the range [0, 2**32).")
+    with np.errstate(over='ignore'):
+        # mix the entropy into the pool
+        hash_const = [_init_a]
+        pool = [_hashmix(seeds.astype(np.uint32), hash_const)]
+        for i in range(1, _pool_size):
+            pool.append(_hashmix(np.zeros(len(seeds), dtype=np.uint32), hash_const))
+        for i_src in range(_pool_size):
+            for i_dst in range(_pool_size):
+                if i_src != i_dst:
+                    pool[i_dst] = _mix(pool[i_dst], _hashmix(pool[i_src], hash_const))
+
+        # generate the state words
+        keys = np.empty((len(seeds), _n), dtype=np.uint32)
+        hash_const = _init_b
+        for i in range(_n):
+            value = pool[i % _pool_size] ^ np.uint32(hash_const)
+            hash_const = (hash_const * _mult_b) & _mask32
+            value = value * np.uint32(hash_const)
+            keys[:, i] = value ^ (value >> np.uint32(_xshift))
+    keys[:, 0] = 0x80000000 # as done by np.random.MT19937
+    return keys
+
+def _twist(keys):
+    '''
+    Advances the MT19937 keys (in place) by one generation of 624 words.
+    '''
+    def update(i0, i1):
+        y = (keys[:, i0:i1] & _upper_mask) | (keys[:, i0+1:i1+1] & _lower_mask)
+        keys[:, i0:i1] = keys[:, i0+_m:i1+_m] if i0+_m < _n else keys[:, i0+_m-_n:i1+_m-_n]
+        keys[:, i0:i1] ^= (y >> np.uint32(1)) ^ np.where(y & np.uint32(1), _matrix_a, np.uint32(0))
+    # blocks that only depend on words that are already final
+    update(0, _n-_m)
+    update(_n-_m, 2*(_n-_m))
+    update(2*(_n-_m), _n-1)
+    y = (keys[:, _n-1] & _upper_mask) | (keys[:, 0] & _lower_mask)
+    keys[:, _n-1] = keys[:, _m-1] ^ (y >> np.uint32(1)) ^ np.where(y & np.uint32(1), _matrix_a, np.uint32(0))
+
+def _temper(y):
+    y = y ^ (y >> np.uint32(11))
+    y = y ^ ((y << np.uint32(7)) & np.uint32(0x9d2c5680))
+    y = y ^ ((y << np.uint32(15)) & np.uint32(0xefc60000))
+    return y ^ (y >> np.uint32(18))
+
+class RandomStreams:
+    """
+    The streams of uniform doubles in [0, 1) of one MT19937 generator per seed,
+    as drawn by 'Generator.uniform(0, 1)' or 'Generator.random()'.
+    """
+    def __init__(self, seeds):
+        self.keys = seed_keys(seeds)
+        # the first output word is the last word of the initial key
+        self.words = _temper(self.keys[:, _n-1:_n])
+        self.doubles = np.empty((len(self.keys), 0))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def uniform(self, count):
+        '''
+        Returns (at least) the first 'count' doubles of each stream, as an
+        array of shape (len(seeds), >=count).
+        '''
+        while self.doubles.shape[1] < count:
+            _twist(self.keys)
+            self.words = np.concatenate([self.words, _temper(self.keys)], axis=1)
+            num_doubles = self.words.shape[1] // 2
+            a = (self.words[:, 0:2*num_doubles:2] >> np.uint32(5)).astype(np.float64)
+            b = (self.words[:, 1:2*num_doubles:2] >> np.uint32(6)).astype(np.float64)
+            self.doubles = (a * 67108864.0 + b) / 9007199254740992.0
+        return self.doubles
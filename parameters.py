@@ -3,6 +3,8 @@ Adapted from the NSuite benchmarking framework (https://github.com/arbor-sim/nsu
 """
 
 import json
+import connectivity
+import morphology
 
 def from_json(o, key):
     if key in o:
@@ -10,6 +12,9 @@ def from_json(o, key):
     else:
         raise Exception(str('parameter "'+ key+ '" not in input file'))
 
+# Default parameters of the spike-timing-dependent plasticity (cf. 'mod/ExpSynSTDP.mod')
+stdp_defaults = {'tau-plus': 16.8, 'tau-minus': 33.7, 'a-plus': 0.01, 'a-minus': 0.0105, 'w-min': 0.0, 'w-max': 2.0}
+
 class cell_parameters:
     def __repr__(self):
         s = "cell parameters\n" \
@@ -18,20 +23,25 @@ class cell_parameters:
             "  compartments :  [{3:5d} : {4:5d}]\n" \
             "  lengths      :  [{5:5.1f} : {6:5.1f}]\n" \
             "  connections  :  {7:5.1f}\n" \
+            "  stdp         :  {8:>10s}\n" \
+            "  complex      :  {9:>10s}\n" \
             .format(self.max_depth,
                     self.branch_probs[0], self.branch_probs[1],
                     self.compartments[0], self.compartments[1],
                     self.lengths[0], self.lengths[1],
-                    self.synapses)
+                    self.synapses, str(self.stdp), str(self.complex))
         return s
 
-    def __init__(self, data, p_branch, num_comparts, num_rand_syns):
+    def __init__(self, data, p_branch, num_comparts, num_rand_syns, stdp=False, complex=False):
         # First setting default values (including those provided via commandline)
         self.max_depth    = 5
         self.branch_probs = p_branch
         self.compartments = num_comparts
         self.lengths      = [200, 20]
         self.synapses     = num_rand_syns
+        self.stdp         = stdp
+        self.stdp_params  = dict(stdp_defaults)
+        self.complex      = complex
 
         # Overwriting with loaded configuration
         if data:
@@ -40,8 +50,58 @@ class cell_parameters:
             self.compartments = from_json(data, 'compartments')
             self.lengths      = from_json(data, 'lengths')
             self.synapses     = from_json(data, 'synapses')
-            if bool(from_json(data, 'complex')):
-                print("Warning: Cell type 'complex' is currently not supported. Using simple branchy cell instead.")
+            self.stdp         = bool(from_json(data, 'stdp')) or stdp
+            self.stdp_params.update(data.get('stdp-parameters', {})) # optional
+            self.complex      = bool(from_json(data, 'complex')) or complex
+
+    def as_dict(self):
+        """
+        Returns the parameter values as a dictionary (e.g., to identify cached data)
+        """
+        d = {'depth': self.max_depth, 'branch-probs': list(self.branch_probs),
+             'compartments': list(self.compartments), 'lengths': list(self.lengths),
+             'synapses': self.synapses, 'stdp': self.stdp, 'complex': self.complex}
+        if self.stdp:
+            d['stdp-parameters'] = dict(self.stdp_params)
+        return d
+
+class connectivity_parameters:
+    def __repr__(self):
+        s = "connectivity\n" \
+            "  mode         :  {0:>10s}\n" \
+            "  fraction     :  {1:10.2f}\n" \
+            "  neighborhood :  {2:10d} rings\n" \
+            "  scale        :  {3:10.1f} gids\n" \
+            .format(self.mode, self.fraction, self.neighborhood, self.scale)
+        return s
+
+    def __init__(self, data, mode=None, fraction=None, neighborhood=None, scale=None):
+        # First setting default values (uniformly random sources)
+        self.mode         = 'uniform'  # cf. 'connectivity.modes'
+        self.fraction     = 1.0        # fraction of the random connections with local sources (other modes than 'uniform')
+        self.neighborhood = 1          # number of rings on each side whose cells are local (mode 'neighborhood')
+        self.scale        = 100.0      # mean distance in gids of the local sources (mode 'distance')
+
+        # Overwriting with loaded configuration (optional entries)
+        if data:
+            self.mode         = data.get('mode', self.mode)
+            self.fraction     = data.get('fraction', self.fraction)
+            self.neighborhood = data.get('neighborhood-rings', self.neighborhood)
+            self.scale        = data.get('distance-scale', self.scale)
+
+        # Overwriting with commandline arguments (if given)
+        for name, value in [('mode', mode), ('fraction', fraction), ('neighborhood', neighborhood), ('scale', scale)]:
+            if value is not None:
+                setattr(self, name, value)
+        if self.mode not in connectivity.modes:
+            raise ValueError(f"Unknown connectivity mode '{self.mode}' (use one of {', '.join(connectivity.modes)}).")
+
+    def as_dict(self):
+        """
+        Returns the parameter values as a dictionary (e.g., to identify cached data)
+        """
+        return {'mode': self.mode, 'fraction': self.fraction, 'neighborhood-rings': self.neighborhood,
+                'distance-scale': self.scale}
 
 class model_parameters:
     def __repr__(self):
@@ -53,23 +113,34 @@ class model_parameters:
             "  min delay    : {4:10.0f} ms\n" \
             "  dt           : {5:10.0f} ms\n" \
             .format(self.name, self.num_cells, self.ring_size, self.duration, self.min_delay, self.dt)
+        if self.cells_per_rank:
+            s+= "  cells/rank   : {0:10d}\n".format(self.cells_per_rank)
+        if self.compartments_per_rank:
+            s+= "  comps/rank   : {0:10d}\n".format(self.compartments_per_rank)
+        if self.cpu_group_size != 1:
+            s+= "  cpu group    : {0:10d}\n".format(self.cpu_group_size)
         s+= str(self.cell)
+        s+= str(self.connectivity)
         return s
 
     def __init__(self,
                  filename, duration,
                  num_rings, num_ring_cells,
                  p_branch, num_comparts, num_rand_syns,
-                 pc):
+                 pc, cells_per_rank=0, compartments_per_rank=0, locality=None, stdp=False, complex=False):
         # First setting default values (including those provided via commandline)
         self.name         = 'default'
-        self.duration     = duration
+        self.duration     = duration if duration is not None else 200.0
         self.dt           = 0.025
         self.num_cells    = num_rings * num_ring_cells
         self.ring_size    = num_ring_cells
         self.min_delay    = 10
         self.event_weight = 0.01
-        self.cell = cell_parameters(None, p_branch, num_comparts, num_rand_syns)
+        self.cells_per_rank = 0         # weak scaling: number of cells per rank (0 for a fixed number of cells)
+        self.compartments_per_rank = 0  # weak scaling: number of compartments per rank (0 for a fixed number of cells)
+        self.cpu_group_size = 1         # number of consecutive cells kept on the same thread (with balanced thread partitioning)
+        self.cell = cell_parameters(None, p_branch, num_comparts, num_rand_syns, stdp, complex)
+        self.connectivity = connectivity_parameters(None)
 
         # Overwriting with loaded configuration
         if filename:
@@ -84,8 +155,158 @@ class model_parameters:
                 self.ring_size    = from_json(data, 'ring-size')
                 self.min_delay    = from_json(data, 'min-delay')
                 self.event_weight = from_json(data, 'event-weight')
-                self.cell         = cell_parameters(data, p_branch, num_comparts, num_rand_syns)
+                self.cell         = cell_parameters(data, p_branch, num_comparts, num_rand_syns, stdp, complex)
+                self.cells_per_rank        = data.get('cells-per-rank', 0) # optional
+                self.compartments_per_rank = data.get('compartments-per-rank', 0) # optional
+                self.connectivity          = connectivity_parameters(data.get('connectivity')) # optional
+                self.cpu_group_size        = data.get('cpu-group-size', 1) # optional
         else:
             if pc.id() == 0:
                 print(f"No configuration file has been provided - using default parameter values and such provided via commandline arguments.")
 
+        # Duration given via commandline (overwrites the configuration file, e.g., for short calibration runs)
+        if duration is not None:
+            self.duration = duration
+
+        # Connectivity mode given via commandline (overwrites the configuration file)
+        if locality is not None:
+            self.connectivity = connectivity_parameters(self.connectivity.as_dict(), *locality)
+
+        # Weak scaling: derive the number of cells from the workload per rank (the commandline arguments
+        # take precedence over the configuration file here, such that one paradigm can be used for sweeps)
+        if cells_per_rank or compartments_per_rank:
+            self.cells_per_rank = cells_per_rank
+            self.compartments_per_rank = compartments_per_rank
+        if self.cells_per_rank and self.compartments_per_rank:
+            raise ValueError("Only one of cells per rank and compartments per rank can be set.")
+        num_ranks = int(pc.nhost())
+        if self.cells_per_rank:
+            num_rings = -(-self.cells_per_rank * num_ranks // self.ring_size) # whole rings
+            self.num_cells = num_rings * self.ring_size
+        elif self.compartments_per_rank:
+            self.num_cells = morphology.cells_for_compartments(self.compartments_per_rank * num_ranks,
+                                                               self.ring_size, self.cell)
+
+    def as_dict(self):
+        """
+        Returns the parameter values as a dictionary (e.g., to identify cached data)
+        """
+        d = {'name': self.name, 'duration': self.duration, 'dt': self.dt, 'num-cells': self.num_cells,
+             'ring-size': self.ring_size, 'min-delay': self.min_delay, 'event-weight': self.event_weight}
+        if self.cells_per_rank:
+            d['cells-per-rank'] = self.cells_per_rank
+        if self.compartments_per_rank:
+            d['compartments-per-rank'] = self.compartments_per_rank
+        if self.connectivity.mode != 'uniform':
+            d['connectivity'] = self.connectivity.as_dict()
+        if self.cpu_group_size != 1:
+            d['cpu-group-size'] = self.cpu_group_size
+        d.update(self.cell.as_dict())
+        return d
+
+class exchange_parameters:
+    def __repr__(self):
+        s = "spike exchange and event queue\n" \
+            "  spike compress :  {0:8d}\n" \
+            "  gid compress   :  {1:>8s}\n" \
+            "  multisend      :  {2:8d}\n" \
+            "  queue mode     :  {3:>8s}\n" \
+            "  maxstep        :  {4:8.3f} ms\n" \
+            .format(self.spike_compress, str(self.gid_compress), self.multisend, self.queue_mode, self.maxstep)
+        return s
+
+    def __init__(self, filename, spike_compress=None, gid_compress=None, multisend=None, queue_mode=None, maxstep=None):
+        # First setting default values (NEURON's defaults)
+        self.spike_compress = 0         # number of spikes per compressed message (0: no compression)
+        self.gid_compress = False       # whether to send local indices instead of gids (requires spike compression)
+        self.multisend = 0              # spike exchange method of NEURON (0: MPI_Allgather; 1: multisend, plus further bits)
+        self.queue_mode = 'default'     # event queue (cf. 'queue_modes')
+        self.maxstep = 0                # maximum integration interval between spike exchanges in ms (0: minimum delay)
+
+        # Overwriting with loaded configuration (optional entries)
+        if filename:
+            with open(filename) as f:
+                data = json.load(f)
+                self.spike_compress = data.get('spike-compress', self.spike_compress)
+                self.gid_compress   = data.get('gid-compress', self.gid_compress)
+                self.multisend      = data.get('multisend', self.multisend)
+                self.queue_mode     = data.get('queue-mode', self.queue_mode)
+                self.maxstep        = data.get('maxstep', self.maxstep)
+
+        # Overwriting with commandline arguments (if given), such that these settings can be swept
+        for name, value in [('spike_compress', spike_compress), ('gid_compress', gid_compress),
+                            ('multisend', multisend), ('queue_mode', queue_mode), ('maxstep', maxstep)]:
+            if value is not None:
+                setattr(self, name, value)
+        if self.queue_mode not in queue_modes:
+            raise ValueError(f"Unknown queue mode '{self.queue_mode}' (use one of {', '.join(queue_modes)}).")
+
+    def as_dict(self):
+        """
+        Returns the parameter values as a dictionary (e.g., for the run record)
+        """
+        return {'spike-compress': self.spike_compress, 'gid-compress': bool(self.gid_compress),
+                'multisend': self.multisend, 'queue-mode': self.queue_mode, 'maxstep': self.maxstep}
+
+# Event queue modes, with the arguments of 'h.cvode.queue_mode()' (fixed step bin queue, self queue)
+queue_modes = {'default': (0, 0), 'binq': (1, 0), 'selfq': (0, 1), 'binq-selfq': (1, 1)}
+
+def add_arguments(parser):
+    """
+    Adds the commandline arguments of the model parameters to an argument parser
+    """
+    parser.add_argument("-num_rings", help="number of rings", type=int, default=256)
+    parser.add_argument("-num_ring_cells", help="number of cells per ring", type=int, default=4)
+    parser.add_argument("-num_rand_syns", help="number of random synapses of weight 0 per cell", type=int, default=10)
+    parser.add_argument("-p_branch", nargs=2, help="range of branching probabilities at each level",  type=float, default=[1.0, 0.5])
+    parser.add_argument("-num_comparts", nargs=2, help="range of compartments per branch (default [1,1])", type=int, default=[1, 1])
+    parser.add_argument("-params_file", help="JSON file containing parameter configuration", type=str, default="")
+    parser.add_argument("-cells_per_rank", help="weak scaling: number of cells per rank (the total number of cells, in whole rings, "
+                                               "is derived from the number of ranks; overrides the configuration file)", type=int, default=0)
+    parser.add_argument("-compartments_per_rank", help="weak scaling: number of compartments per rank (the total number of cells, in "
+                                                      "whole rings, is derived from the number of ranks; overrides the configuration file)",
+                        type=int, default=0)
+    parser.add_argument("-duration", metavar='float', help="duration of the simulation in ms (default: 200; overrides the "
+                                                           "configuration file)", type=float, default=None)
+    parser.add_argument("-stdp", action='store_true', help="enable spike-timing-dependent plasticity of all synapses "
+                                                           "(requires the mechanisms in 'mod'; also enabled by the configuration file)", default=False)
+    parser.add_argument("-complex", action='store_true', help="use cells with active dendrites (requires the mechanisms "
+                                                              "in 'mod'; also enabled by the configuration file)", default=False)
+    parser.add_argument("-connectivity", help="sources of the random connections ('uniform': all cells, 'rank': cells on the same "
+                                              "rank, 'neighborhood': cells of the neighboring rings, 'distance': distance-dependent "
+                                              "kernel over the gids; overrides the configuration file)",
+                        type=str, choices=connectivity.modes, default=None)
+    parser.add_argument("-local_fraction", help="fraction of the random connections with local sources", type=float, default=None)
+    parser.add_argument("-neighborhood_rings", help="number of rings on each side whose cells are local", type=int, default=None)
+    parser.add_argument("-distance_scale", help="mean distance in gids of the local sources", type=float, default=None)
+
+def from_arguments(args, pc):
+    """
+    Returns the model parameters from the parsed commandline arguments (cf. 'add_arguments()')
+    """
+    return model_parameters(args.params_file, args.duration, args.num_rings, args.num_ring_cells,
+                            args.p_branch, args.num_comparts, args.num_rand_syns, pc,
+                            args.cells_per_rank, args.compartments_per_rank,
+                            (args.connectivity, args.local_fraction, args.neighborhood_rings, args.distance_scale),
+                            args.stdp, args.complex)
+
+def add_exchange_arguments(parser):
+    """
+    Adds the commandline arguments of the spike exchange and event queue settings to an argument parser
+    """
+    parser.add_argument("-spike_compress", help="number of spikes per compressed spike exchange message (0: no compression)", type=int, default=None)
+    parser.add_argument("-gid_compress", action='store_const', const=True, help="exchange local indices instead of gids "
+                                                                               "(with spike compression)", default=None)
+    parser.add_argument("-multisend", help="spike exchange method of NEURON ('xchng_meth' of 'pc.spike_compress()'; "
+                                           "0: MPI_Allgather, 1: multisend)", type=int, default=None)
+    parser.add_argument("-queue_mode", help="event queue (binq: fixed step bin queue, selfq: self queue)", type=str,
+                        choices=list(queue_modes), default=None)
+    parser.add_argument("-maxstep", help="maximum integration interval between spike exchanges in ms (0: minimum delay)", type=float, default=None)
+
+def exchange_from_arguments(args):
+    """
+    Returns the spike exchange and event queue settings from the parsed commandline arguments
+    (cf. 'add_exchange_arguments()'), with the optional entries of the configuration file
+    """
+    return exchange_parameters(args.params_file, args.spike_compress, args.gid_compress, args.multisend,
+                               args.queue_mode, args.maxstep)
@@ -0,0 +1,218 @@
+"""
+Distribution of the gids across MPI ranks (independent of NEURON)
+"""
+
+import heapq
+import numpy as np
+import cache
+import morphology
+
+strategies = ('round-robin', 'balanced', 'ring')
+
+# Estimated cost of a synapse relative to a compartment
+synapse_cost = 0.1
+
+def estimate_costs(num_cells, cell_params, cache_dir=""):
+    '''
+    Estimates the computational cost of each gid from its number of
+    compartments (replaying the branching of the cells) and synapses.
+
+    Parameters
+    ----------
+    num_cells : int
+      Total number of cells in the network.
+    cell_params : parameters.cell_parameters
+      Cell parameters.
+    cache_dir : str
+      Directory to cache the costs in (no caching if empty).
+
+    Returns
+    -------
+    costs : numpy.ndarray
+      Estimated cost of each gid.
+    '''
+    if cache_dir:
+        key = cache.parameter_key(num_cells=num_cells, max_depth=cell_params.max_depth,
+                                  branch_probs=list(cell_params.branch_probs),
+                                  compartments=list(cell_params.compartments),
+                                  lengths=list(cell_params.lengths), synapses=cell_params.synapses,
+                                  synapse_cost=synapse_cost)
+        path = cache.cache_path(cache_dir, "costs", key)
+        arrays = cache.load_arrays(path, ('costs',), mmap=False)
+        if arrays is not None:
+            return arrays['costs']
+
+    _, ncomp = morphology.compartment_counts(np.arange(num_cells), cell_params)
+    costs = ncomp + synapse_cost*(cell_params.synapses + 1)
+    if cache_dir:
+        cache.save_arrays(path, costs=costs)
+    return costs
+
+class Partition:
+    """
+    Assignment of each gid to a rank.
+    """
+    def __repr__(self):
+        loads = self.loads()
+        return (f"partition '{self.strategy}': predicted load per rank "
+                f"min {loads.min():.1f}; mean {loads.mean():.1f}; max {loads.max():.1f}; "
+                f"imbalance (max/mean) {self.imbalance():.3f}")
+
+    def __init__(self, strategy, rank_of_gid, num_ranks, costs):
+        self.strategy = strategy        # name of the partitioning strategy
+        self.rank_of_gid = rank_of_gid  # rank of each gid
+        self.num_ranks = num_ranks      # number of ranks
+        self.costs = costs              # estimated cost of each gid
+
+    def gids(self, rank):
+        '''
+        Returns the (sorted) gids assigned to a rank.
+        '''
+        return np.flatnonzero(self.rank_of_gid == rank)
+
+    def loads(self):
+        '''
+        Returns the predicted load of each rank.
+        '''
+        return np.bincount(self.rank_of_gid, weights=self.costs, minlength=self.num_ranks)
+
+    def imbalance(self):
+        '''
+        Returns the predicted load imbalance, i.e., the ratio of the maximum to the mean load.
+        '''
+        loads = self.loads()
+        return loads.max() / loads.mean() if loads.mean() > 0 else 1.0
+
+def round_robin(costs, num_ranks, ring_size):
+    '''
+    Assigns gid i to rank i % num_ranks.
+    '''
+    return np.arange(len(costs)) % num_ranks
+
+def balanced(costs, num_ranks, ring_size):
+    '''
+    Assigns the gids in order of decreasing cost to the rank with the
+    currently lowest load (longest processing time first).
+    '''
+    rank_of_gid = np.empty(len(costs), dtype=np.int64)
+    heap = [(0.0, rank) for rank in range(num_ranks)]
+    for gid in np.argsort(-costs, kind='stable').tolist():
+        load, rank = heapq.heappop(heap)
+        rank_of_gid[gid] = rank
+        heapq.heappush(heap, (load + costs[gid], rank))
+    return rank_of_gid
+
+def ring(costs, num_ranks, ring_size):
+    '''
+    Assigns contiguous blocks of whole rings to the ranks, such that all
+    ring connections stay on one rank. The block boundaries are chosen to
+    balance the cumulative cost.
+    '''
+    num_cells = len(costs)
+    ring_starts = np.arange(0, num_cells, ring_size)
+    ring_costs = np.add.reduceat(costs, ring_starts) if num_cells > 0 else np.empty(0)
+    cumulative = np.cumsum(ring_costs)
+    total = cumulative[-1] if len(cumulative) > 0 else 0
+    # rank of each ring, from the cost at the ring center relative to the total cost
+    ring_rank = np.floor((cumulative - 0.5*ring_costs) / total * num_ranks).astype(np.int64) if total > 0 \
+                else np.zeros(len(ring_costs), dtype=np.int64)
+    ring_rank = np.clip(ring_rank, 0, num_ranks-1)
+    return np.repeat(ring_rank, np.diff(np.append(ring_starts, num_cells)))
+
+def partition(strategy, num_cells, ring_size, num_ranks, cell_params, cache_dir=""):
+    '''
+    Distributes the gids across the ranks.
+
+    Parameters
+    ----------
+    strategy : str
+      One of 'round-robin', 'balanced' (compartment-balanced), and 'ring' (ring-contiguous).
+    num_cells : int
+      Total number of cells in the network.
+    ring_size : int
+      Number of cells per ring.
+    num_ranks : int
+      Number of ranks.
+    cell_params : parameters.cell_parameters
+      Cell parameters (to estimate the cost of each gid).
+    cache_dir : str
+      Directory to cache the cost estimates in (no caching if empty).
+
+    Returns
+    -------
+    partition : Partition
+      The assignment of the gids to the ranks.
+    '''
+    if strategy not in strategies:
+        raise ValueError(f"Unknown partitioning strategy '{strategy}' (use one of {', '.join(strategies)}).")
+    costs = estimate_costs(num_cells, cell_params, cache_dir)
+    return partition_costs(strategy, costs, num_ranks, ring_size)
+
+def partition_costs(strategy, costs, num_ranks, ring_size):
+    '''
+    Distributes the gids across the ranks, given the estimated cost of each gid (cf. 'partition()').
+    '''
+    if strategy not in strategies:
+        raise ValueError(f"Unknown partitioning strategy '{strategy}' (use one of {', '.join(strategies)}).")
+    assign = {'round-robin': round_robin, 'balanced': balanced, 'ring': ring}[strategy]
+    return Partition(strategy, assign(costs, num_ranks, ring_size), num_ranks, costs)
+
+# Strategies to distribute the cells of a rank across its threads: NEURON's default distribution, or groups
+# of consecutive cells ('cpu-group-size') balanced by their cost
+thread_strategies = ('default', 'balanced')
+
+def thread_partition(costs, num_threads, group_size=1):
+    '''
+    Distributes the cells of a rank across its threads, in groups of consecutive cells that are assigned
+    in order of decreasing cost to the thread with the currently lowest load (cf. 'balanced()').
+
+    Parameters
+    ----------
+    costs : numpy.ndarray
+      Estimated (or measured) cost of each cell on the rank.
+    num_threads : int
+      Number of threads.
+    group_size : int
+      Number of consecutive cells that are kept on the same thread.
+
+    Returns
+    -------
+    partition : Partition
+      The assignment of the cells (by index on the rank) to the threads (which take the place of the ranks).
+    '''
+    costs = np.asarray(costs, dtype=np.float64)
+    group_size = max(int(group_size), 1)
+    group_starts = np.arange(0, len(costs), group_size)
+    group_costs = np.add.reduceat(costs, group_starts) if len(costs) > 0 else np.empty(0)
+    thread_of_group = balanced(group_costs, num_threads, group_size)
+    thread_of_cell = np.repeat(thread_of_group, np.diff(np.append(group_starts, len(costs))))
+    return Partition('balanced-threads', thread_of_cell, num_threads, costs)
+
+def fit_synapse_cost(compartments, synapses, times):
+    '''
+    Fits the cost of a synapse relative to a compartment from the compute times of threads
+    (e.g., from a short calibration run), such that time = a * compartments + b * synapses.
+
+    Parameters
+    ----------
+    compartments : numpy.ndarray
+      Number of compartments on each thread.
+    synapses : numpy.ndarray
+      Number of synapses (and their incoming connections) on each thread.
+    times : numpy.ndarray
+      Measured compute time of each thread.
+
+    Returns
+    -------
+    synapse_cost : float
+      The relative cost b/a, or None if it cannot be determined (e.g., the same ratio
+      of synapses to compartments on all threads).
+    '''
+    A = np.column_stack([np.asarray(compartments, dtype=np.float64), np.asarray(synapses, dtype=np.float64)])
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) < 2 or np.linalg.matrix_rank(A) < 2:
+        return None
+    (a, b), *_ = np.linalg.lstsq(A, times, rcond=None)
+    if a <= 0 or b < 0:
+        return None
+    return b / a
@@ -0,0 +1,46 @@
+"""
+Profiling of the phases of a run (e.g., model construction) with cProfile, with one
+profile dump per phase and rank (merge them with merge_profiles.py)
+"""
+
+import cProfile
+import os
+import re
+from contextlib import contextmanager
+
+# Name of the dump of a phase on a rank, and the pattern to recover both from it
+dump_pattern = re.compile(r"rank(\d+)\.(.+)\.prof$")
+
+def dump_file(directory, rank, phase):
+    return os.path.join(directory, f"profile.rank{rank}.{phase}.prof")
+
+class PhaseProfiler:
+    """
+    Profiles code blocks ("phases") on selected ranks; does nothing on the other ranks.
+    """
+    def __init__(self, rank, directory="", ranks=None):
+        self.rank = rank                            # rank of this process
+        self.directory = directory                  # directory of the dumps (no profiling if empty)
+        self.enabled = bool(directory) and (not ranks or rank in ranks) # whether this rank is profiled
+        self.phases = []                            # names of the profiled phases (in order)
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager to profile a code block and write the profile to its dump file
+        """
+        if not self.enabled:
+            yield
+            return
+        if name in self.phases:
+            raise ValueError(f"Profiled phase '{name}' already exists.")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(dump_file(self.directory, self.rank, name))
+            self.phases.append(name)
@@ -0,0 +1,131 @@
+"""
+Subsampled recording of membrane potentials of selected cells, with the samples flushed to a
+binary file per rank during the run (such that the memory of the recording stays bounded)
+"""
+
+import json
+import os
+import numpy as np
+
+# Selectors of the recorded cells: none, the first cell of each ring, every k-th gid, or given gids
+selectors = ('none', 'ring', 'every', 'gids')
+
+def select_gids(gids, selector, ring_size=1, every=1, selected=()):
+    '''
+    Returns the indices of the selected gids among the given ones (e.g., the gids on this rank).
+
+    Parameters
+    ----------
+    gids : sequence of int
+      Gids (on this rank).
+    selector : str
+      One of 'none', 'ring' (first cell of each ring), 'every' (gids that are multiples of 'every')
+      and 'gids' (the gids in 'selected').
+    ring_size : int
+      Number of cells per ring.
+    every : int
+      Distance of the selected gids (selector 'every').
+    selected : sequence of int
+      Selected gids (selector 'gids').
+    '''
+    gids = np.asarray(gids, dtype=np.int64)
+    if selector == 'none':
+        mask = np.zeros(len(gids), dtype=bool)
+    elif selector == 'ring':
+        mask = gids % ring_size == 0
+    elif selector == 'every':
+        mask = gids % max(every, 1) == 0
+    elif selector == 'gids':
+        mask = np.isin(gids, np.asarray(selected, dtype=np.int64))
+    else:
+        raise ValueError(f"Unknown recording selector '{selector}' (use one of {', '.join(selectors)}).")
+    return np.flatnonzero(mask)
+
+class VoltageRecorder:
+    """
+    Records the membrane potential at the given locations of the selected cells of a rank every
+    'interval' ms (by 'Vector.record' with a sampling interval, which is also supported by CoreNEURON
+    in the in-memory mode), and appends the samples to the file of the rank on each 'flush()'.
+    The file consists of blocks of float32 samples (probe-major within each block); the probes,
+    the interval and the block sizes are described in a JSON file next to it (cf. 'read_recording()').
+    """
+    def __init__(self, cells, gids, locations, interval, rank, basename="voltages", buffer_samples=0):
+        from neuron import h
+        self.interval = interval    # sampling interval in ms
+        self.probes = []            # recorded (gid, location) pairs
+        self.vectors = []           # sample buffer of each probe
+        for cell, gid in zip(cells, gids):
+            for location in locations:
+                vec = h.Vector()
+                if buffer_samples:
+                    vec.buffer_size(buffer_samples) # avoid reallocations while recording
+                vec.record(cell.location(location)._ref_v, interval)
+                self.probes.append((int(gid), location))
+                self.vectors.append(vec)
+        self.data_file = f"{basename}.rank{rank}.bin"   # samples
+        self.index_file = f"{basename}.rank{rank}.json" # description of the samples
+        self.reset()
+
+    def __len__(self):
+        return len(self.probes)
+
+    def reset(self):
+        '''
+        Clears the buffers and the files (e.g., before a further trial).
+        '''
+        for vec in self.vectors:
+            vec.resize(0)
+        self.blocks = []
+        self.samples = 0
+        if self.probes:
+            os.makedirs(os.path.dirname(self.data_file) or ".", exist_ok=True)
+            open(self.data_file, "wb").close()
+            self.write_index()
+
+    def flush(self):
+        '''
+        Appends the buffered samples to the file and clears the buffers.
+        '''
+        if not self.probes:
+            return
+        n = min(int(vec.size()) for vec in self.vectors)
+        if n == 0:
+            return
+        block = np.empty((len(self.vectors), n), dtype=np.float32)
+        for i, vec in enumerate(self.vectors):
+            block[i] = vec.as_numpy()[:n]
+            vec.remove(0, n - 1)
+        with open(self.data_file, "ab") as f:
+            block.tofile(f)
+        self.blocks.append(n)
+        self.samples += n
+        self.write_index()
+
+    def write_index(self):
+        with open(self.index_file, "w") as f:
+            json.dump({"interval": self.interval, "probes": [{"gid": gid, "location": location} for gid, location in self.probes],
+                       "blocks": self.blocks, "dtype": "float32"}, f, indent=4)
+
+def read_recording(basename, rank):
+    '''
+    Reads the recording of a rank.
+
+    Returns
+    -------
+    probes : list of dict
+      Gid and location of each probe.
+    t : numpy.ndarray
+      Sampling times in ms.
+    v : numpy.ndarray
+      Samples of the membrane potential in mV (one row per probe).
+    '''
+    with open(f"{basename}.rank{rank}.json") as f:
+        index = json.load(f)
+    num_probes = len(index["probes"])
+    data = np.fromfile(f"{basename}.rank{rank}.bin", dtype=index["dtype"])
+    blocks, pos = [], 0
+    for n in index["blocks"]:
+        blocks.append(data[pos:pos + num_probes*n].reshape(num_probes, n))
+        pos += num_probes*n
+    v = np.concatenate(blocks, axis=1) if blocks else np.empty((num_probes, 0), dtype=index["dtype"])
+    return index["probes"], np.arange(v.shape[1]) * index["interval"], v
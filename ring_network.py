@@ -2,13 +2,17 @@
 Adapted from the NSuite benchmarking framework (https://github.com/arbor-sim/nsuite.git).
 """
 
+import gc
 from neuron import h
 import cell
+import connectivity
+import morphology
+import partition as partitioning
 import numpy as np
 
 class RingNetwork(object):
 
-    def __init__(self, params, pc):
+    def __init__(self, params, pc, connectivity_cache="", morphology_cache="", partition=None, lean=False):
         
         # Parallelization parameters
         self.rank_id = int(pc.id()) # host process/rank ID
@@ -22,13 +26,32 @@ class RingNetwork(object):
         self.ring_size = params.ring_size
         self.nrand_synapses = params.cell.synapses
 
-        # Distribute the gids across ranks in a round-robin fashion
-        self.gids = range(self.rank_id, self.num_cells, self.num_ranks)
+        # Distribute the gids across ranks (in a round-robin fashion unless a partition is provided)
+        if partition is None:
+            self.gids = range(self.rank_id, self.num_cells, self.num_ranks)
+        else:
+            self.gids = partition.gids(self.rank_id).tolist()
 
-        # Generate the cells
+        # Parameters of the plasticity (global for all synapses; the postsynaptic spikes are delivered
+        # with the minimum delay, such that they do not shorten the interval of the spike exchange)
+        self.stdp = params.cell.stdp
+        if self.stdp:
+            h.tau_plus_ExpSynSTDP = params.cell.stdp_params['tau-plus']
+            h.tau_minus_ExpSynSTDP = params.cell.stdp_params['tau-minus']
+            h.a_plus_ExpSynSTDP = params.cell.stdp_params['a-plus']
+            h.a_minus_ExpSynSTDP = params.cell.stdp_params['a-minus']
+            h.wmin_ExpSynSTDP = params.cell.stdp_params['w-min']
+            h.wmax_ExpSynSTDP = params.cell.stdp_params['w-max']
+            h.post_delay_ExpSynSTDP = self.min_delay
+
+        # Compute the morphology specifications and generate the cells
+        specs, from_cache = morphology.load_morphologies(self.gids, self.cell_params, morphology_cache)
+        print(f"Morphologies on rank {pc.id()}: {len(specs.trees)} distinct trees for {len(specs)} cells "
+              f"({'loaded from cache' if from_cache else 'generated'}).")
+        cell_type = cell.complex_cell if self.cell_params.complex else cell.branchy_cell
         self.cells = []
-        for gid in self.gids:
-            c = cell.branchy_cell(gid, self.cell_params)
+        for i, gid in enumerate(self.gids):
+            c = cell_type(gid, self.cell_params, (specs.tree(i), specs.syn_section[i], specs.syn_pos[i]))
 
             self.cells.append(c)
 
@@ -56,37 +79,58 @@ class RingNetwork(object):
             print(f"Cell stats: {self.num_cells} cells; {total_seg} segments; {total_comp} compartments; {total_comp/self.num_cells} comp/cell.")
         print(f"Number of cells on rank {pc.id()}: {len(self.gids)}.")
 
-        # Generate the connections to each gid on the current rank (and, thereby, create the rings):
-        # 1. make an incoming connection from (gid-1) on the same ring
-        # 2. add random connections (from within and across rings)
-        self.connections = []
+        # Compute the connections to each gid on the current rank (and, thereby, the rings):
+        # 1. an incoming connection from (gid-1) on the same ring
+        # 2. random connections (from within and across rings)
+        table, from_cache = connectivity.load_connections(self.gids, params, connectivity_cache)
+        print(f"Connectivity on rank {pc.id()}: {len(table)} connections "
+              f"({'loaded from cache' if from_cache else 'generated'}).")
+
+        # Count the connections from other ranks (which require spike exchange)
+        if partition is None:
+            rank_of_gid = np.arange(self.num_cells) % self.num_ranks
+        else:
+            rank_of_gid = partition.rank_of_gid
+        self.num_inter_rank_connections = connectivity.inter_rank_connections(table, rank_of_gid, self.rank_id)
+        self.total_inter_rank_connections = self.num_inter_rank_connections
+        total_connections = len(table)
+        if self.num_ranks > 1:
+            from mpi4py import MPI
+            self.total_inter_rank_connections = MPI.COMM_WORLD.allreduce(self.num_inter_rank_connections, op=MPI.SUM)
+            total_connections = MPI.COMM_WORLD.allreduce(total_connections, op=MPI.SUM)
+        if self.rank_id == 0:
+            print(f"Inter-rank connections ({params.connectivity.mode} connectivity): {self.total_inter_rank_connections} "
+                  f"of {total_connections} ({100*self.total_inter_rank_connections/max(total_connections, 1):.1f}%).")
+
+        # Create the connections (in lean mode, they are kept in HOC lists, without a Python object per connection)
+        self.connections = h.List() if lean else []
         self.stims = []
         self.stim_connections = []
+        self.post_connections = h.List() if lean else []
         num_rings_created = 0
         num_syns_created = 0
+        rows = self.nrand_synapses + 1
+        sources = table.source.reshape(-1, rows)
+        delays = table.delay.reshape(-1, rows)
         for i, gid in enumerate(self.gids):
+            synapses = self.cells[i].synapses
+            src = sources[i].tolist()
+            delay = delays[i].tolist()
+
             # Attach ring connection to previous gid in local ring
-            rs = self.ring_size
-            current_ring = int(gid/rs)
-            ring_start = rs*current_ring
-            ring_end = min(ring_start+rs, self.num_cells)
-            src = gid-1
-            if gid == ring_start:
-                src = ring_end-1
-
-            con = pc.gid_connect(src, self.cells[i].synapses[0])
-            con.delay = self.min_delay
+            con = pc.gid_connect(src[0], synapses[0])
+            con.delay = delay[0]
             con.weight[0] = params.event_weight
             self.connections.append(con)
             num_syns_created += 1
 
             # Attach stimulus if cell is first in the local ring
-            if gid == ring_start:
-                #print(f"Adding ring #{current_ring}...")
+            if gid % self.ring_size == 0:
+                #print(f"Adding ring #{gid // self.ring_size}...")
                 stim = h.NetStim()
                 stim.number = 1 # one spike
                 stim.start = 0  # at t=0
-                stim_con = h.NetCon(stim, self.cells[i].synapses[0])
+                stim_con = h.NetCon(stim, synapses[0])
                 stim_con.delay = 1
                 stim_con.weight[0] = params.event_weight
                 self.stims.append(stim)
@@ -94,23 +138,70 @@ class RingNetwork(object):
                 num_rings_created += 1
                 num_syns_created += 1
 
-            # Generate dummy connections with random source and zero weights
-            src_gen = np.random.Generator(np.random.MT19937(seed=gid))
-            delay_gen = np.random.Generator(np.random.MT19937(seed=gid))
-            # Loop over all incoming synapses of this neuron, except the first one (which is the connection to the previous gid)
-            for synapse_id in range(1, self.nrand_synapses+1):
-                src = src_gen.integers(0, self.num_cells-2)
-                if src == gid:
-                    src += 1
-                delay = self.min_delay + delay_gen.uniform(0, 2*self.min_delay)
-                con = pc.gid_connect(src, self.cells[i].synapses[synapse_id])
+            # Dummy connections with random source and zero weights (all incoming synapses of this
+            # neuron, except the first one, which is the connection to the previous gid)
+            for synapse_id in range(1, rows):
+                con = pc.gid_connect(src[synapse_id], synapses[synapse_id])
                 con.weight[0] = 0
-                con.delay = delay
+                con.delay = delay[synapse_id]
                 self.connections.append(con)
                 num_syns_created += 1
-        
+
+            # With plasticity, the spikes of this cell are also delivered to all of its synapses
+            # (negative weight to flag them as postsynaptic spikes)
+            if self.stdp:
+                for synapse in synapses:
+                    con = pc.gid_connect(gid, synapse)
+                    con.weight[0] = -1
+                    con.delay = self.min_delay
+                    self.post_connections.append(con)
+
+        num_ring_starts = sum(1 for gid in self.gids if gid % self.ring_size == 0)
         print(f"Number of rings on rank {pc.id()} (created/expected): {num_rings_created}"
-              f"/{len(self.gids)/self.ring_size}.")
+              f"/{num_ring_starts}.")
         print(f"Number of synapses on rank {pc.id()} (created/expected): {num_syns_created}"
-              f"/{(self.nrand_synapses*self.num_cells + self.num_cells)/self.num_ranks + len(self.gids)/self.ring_size}.")
+              f"/{(self.nrand_synapses + 1)*len(self.gids) + num_ring_starts}"
+              f"{f' (with {len(self.post_connections)} postsynaptic connections for STDP)' if self.stdp else ''}.")
+
+    def thread_loads(self, num_threads):
+        """
+        Returns the numbers of compartments and synapses on each thread (of the current thread partition)
+        """
+        compartments = np.bincount(self.thread_partition.rank_of_gid, minlength=num_threads,
+                                   weights=[c.ncomp for c in self.cells])
+        synapses = np.bincount(self.thread_partition.rank_of_gid, minlength=num_threads,
+                               weights=[len(c.synapses) for c in self.cells])
+        return compartments, synapses
 
+    def partition_threads(self, pc, num_threads, group_size=1, synapse_cost=partitioning.synapse_cost):
+        """
+        Distributes the cells of this rank across the threads, balancing their cost (compartments and
+        synapses) in groups of consecutive cells; replaces NEURON's default distribution of the cells
+        """
+        costs = np.array([c.ncomp + synapse_cost*len(c.synapses) for c in self.cells], dtype=np.float64)
+        self.thread_partition = partitioning.thread_partition(costs, num_threads, group_size)
+        self.thread_roots = [] # the section lists have to persist as long as the partition is used
+        for thread in range(num_threads):
+            roots = h.SectionList()
+            for i in np.flatnonzero(self.thread_partition.rank_of_gid == thread).tolist():
+                roots.append(sec=self.cells[i].soma)
+            pc.partition(thread, roots)
+            self.thread_roots.append(roots)
+        return self.thread_partition
+
+    def release(self, pc):
+        """
+        Releases the model on the NEURON side (cells, connections and gids), e.g., after it has been
+        written as CoreNEURON dataset; the network cannot be simulated by NEURON anymore afterwards
+        """
+        pc.gid_clear()
+        for connections in (self.connections, self.post_connections):
+            if isinstance(connections, list):
+                connections.clear()
+            else:
+                connections.remove_all()
+        self.stim_connections = []
+        self.stims = []
+        self.thread_roots = []
+        self.cells = []
+        gc.collect()
@@ -1,5 +1,15 @@
 import os
+import argparse
+import glob
+import json
 import itertools
+import random
+import shutil
+import benchmark_results
+import benchmark_scheduler
+import compare_spikes
+import model_estimate
+import spike_output
 import pandas as pd
 import numpy as np
 
@@ -18,7 +28,17 @@ def extract_benchmark_data(input_file):
     extract_results : dict
       With the following entries:
         runtime_model_init : float
-          Runtime of model initialization
+          Runtime of model initialization (not present on dataset cache hits)
+        runtime_dataset_startup : float
+          Runtime of the startup before running a cached CoreNEURON dataset (only on dataset cache
+          hits; CoreNEURON reads the dataset during the model run)
+        runtime_coreneuron_setup : float
+          Runtime of the setup of the model in CoreNEURON as reported by CoreNEURON (part of the
+          model run; reading of the dataset, or transfer from NEURON)
+        runtime_dataset_write : float
+          Runtime of writing a CoreNEURON dataset (only on dataset cache misses)
+        dataset_cache : str
+          Whether the CoreNEURON dataset was found in the cache ('hit' or 'miss')
         runtime_model_run : float
           Runtime of model run
         runtime_total : float
@@ -43,98 +63,351 @@ def extract_benchmark_data(input_file):
           Number of compartments used
     '''
 
-    # Dictionary of variables for the implementation, with their related keyword
-    # to look for at the start of a line and the index of the column to extract
-    extract_parameters = {"runtime_model_init" : ("model-init", 0),
-                          "runtime_model_run" : ("model-run", 0),
-                          "runtime_total" : ("meter-total", 0),
-                          "memory_nrn_setup" : (" Memory (MBs) :          After nrn_setup", 2),
-                          "memory_nrn_finitialize" : ("Memory (MBs) :     After nrn_finitialize", 2),
-                          "model_size" : ("Model size", 1),
-                          "num_ranks" : ("num_mpi=", 0),
-                          "num_cells" : ("Cell stats:", 0),
-                          "num_segments" : ("Cell stats:", 2),
-                          "num_compartments" : ("Cell stats:", 4)}
-
-    # Dictionary of variables for the implementation, with their assigned results
-    extract_results = {}
+    # All keywords are searched at once (cf. 'benchmark_results.log_keywords'); variables that are
+    # not found are NaN, such that all rows of the CSV file have the same columns
+    return benchmark_results.parse_log(input_file)
 
+def extract_trial_runtimes(input_file):
+    '''
+    Extracts the runtimes of the individual trials from the log file of a
+    run with multiple trials ('-trials' option).
+
+    Parameters
+    ----------
+    input_file : str
+      Name of the log file.
+
+    Returns
+    -------
+    runtimes : list of str
+      Runtime of the model run of each trial (in order of the trials).
+    '''
+    prefix = "run-trial-"
+    runtimes = []
     with open(input_file, 'r') as file:
         for line in file:
-            # After indicator keywords, extract the rest of the line 
-            for var_name, indicator in extract_parameters.items():
-                if indicator[0] in line:
-                    # Find the end of the keyword and extract the rest of the line
-                    idx = line.find(indicator[0])
-                    extracted = line[idx+len(indicator[0]):].strip()
-                    # Assign indicated value from extracted line to corresponding variable
-                    if not np.isnan(indicator[1]):
-                        extract_results[var_name] = extracted.split()[indicator[1]].replace(",", "")
-                    else:
-                        extract_results[var_name] = extracted
-
-    return extract_results
-
-# Set environment variables (NOTE make sure that the installation directory is correct!)
-home_dir = os.path.expanduser("~")
-new_path = f"{home_dir}/nrn_installation/bin"
-current_paths = os.environ.get("PATH", "")
-if new_path not in current_paths:
-    os.environ["PATH"] = current_paths + ":" + new_path
-new_python_path = f"{home_dir}/nrn_installation/lib/python"
-current_python_paths = os.environ.get("PYTHONPATH", "")
-if new_python_path not in current_python_paths:
-    os.environ["PYTHONPATH"] = current_python_paths + ":" + new_python_path
-#print("PATH =", os.environ.get("PATH"))
-#print("PYTHONPATH =", os.environ.get("PYTHONPATH"))
-
-# Compile mod files
-os.system("rm -R -f x86_64/*")
-os.system("nrnivmodl -coreneuron")
-
-# Run different simulations in raster of thread and rank numbers
-for trial in range(10):
-  for paradigm in ["simple-n=1024-stdp=off-depth=0",
-                   "simple-n=1024-stdp=off-depth=2",
-                   "simple-n=1024-stdp=off-depth=10",
-                   "simple-n=16384-stdp=off-depth=0",
-                   "simple-n=16384-stdp=off-depth=2",
-                   "simple-n=16384-stdp=off-depth=10",
-                   "simple-n=32768-stdp=off-depth=0",
-                   "simple-n=32768-stdp=off-depth=2",
-                   "simple-n=32768-stdp=off-depth=10"]:
-      for num_threads, num_ranks, gpu in itertools.product([4, 8, 16, 32, 64],
-                                                           [4, 8, 16, 32, 64],
-                                                           [False]):
-                                                           #[False, True]): # for GPU use, make sure that CoreNEURON was built accordingly
-          # Run with specific number of MPI ranks and threads without GPU
-          if not gpu:
-            log_file = f"busyring_benchmark_output_{paradigm}_{num_threads}_{num_ranks}.log"
-            os.system(f"mpiexec -n {num_ranks} ./x86_64/special -mpi -python run_ring_network.py -coreneuron -num_threads {num_threads} -params_file '{paradigm}.json' " +
-                      f"> {log_file}")
-          # Run with specific number of MPI ranks and threads with GPU
-          else:
-            log_file = f"busyring_benchmark_output_{paradigm}_{num_threads}_{num_ranks}_gpu.log"
-            os.system(f"mpiexec -n {num_ranks} ./x86_64/special -mpi -python run_ring_network.py -coreneuron -num_threads {num_threads} -gpu -params_file '{paradigm}.json' " +
-                      f"> {log_file}")
-
-          # Scrape information from file and print some
-          extracted_results = extract_benchmark_data(log_file)
-          print(f"Paradigm: {paradigm}\n" +
-                f"  with num_threads = {num_threads}, num_ranks = {num_ranks}\n" +
-                f"Trial: {trial}\n" +
-                f"  runtime_model_init  =  {extracted_results['runtime_model_init']}\n" +
-                f"  runtime_model_run   =  {extracted_results['runtime_model_run']}\n" +
-                f"  runtime_total       =  {extracted_results['runtime_total']}\n" +
-                f"  num_cells           =  {extracted_results['num_cells']}\n" +
-                f"  num_compartments    =  {extracted_results['num_compartments']}\n")
-          #print(extracted_results)
-
-          # Store everything to CSV file
-          out_file = "busyring_benchmark_data.csv"
-          output_results = {"paradigm" : paradigm, "num_threads_set" : num_threads, "num_ranks_set" : num_ranks}
-          output_results.update(extracted_results)
-          if not os.path.exists(out_file):
-              pd.DataFrame([output_results]).to_csv(out_file, mode="w", index=False, header=True, sep="\t")
-          else:
-              pd.DataFrame([output_results]).to_csv(out_file, mode="a", index=False, header=False, sep="\t")
\ No newline at end of file
+            fields = line.split() # (followed by the statistics across ranks, cf. 'RuntimeMetering.print_summary()')
+            if len(fields) >= 2 and fields[0].startswith(prefix) and fields[0][len(prefix):].isdigit():
+                runtimes.append(fields[1])
+    return runtimes
+
+def read_run_record(record_file):
+    '''
+    Reads the runtimes from the JSON record written by 'run_ring_network.py'
+    ('-record' option), including the statistics across ranks.
+
+    Parameters
+    ----------
+    record_file : str
+      Name of the JSON record file.
+
+    Returns
+    -------
+    record_results : dict
+      Runtimes of the checkpoints (as in 'extract_benchmark_data()'), the maximum
+      and imbalance across ranks of the per-rank initialization time, the maximum per
+      rank and total across ranks of the current and peak RSS in MB, and the simulated
+      time at which a chunked run has been aborted (NaN if completed).
+    trial_results : list of dict
+      Runtime of the model run, and maximum and imbalance across ranks of the per-rank
+      run time, of each trial (in order of the trials).
+    '''
+    with open(record_file, 'r') as file:
+        record = json.load(file)
+    checkpoints = record["checkpoints"]
+    spans = record["spans"]
+    record_results = {"runtime_total" : record["total"]["runtime"],
+                      "dataset_cache" : record["info"].get("dataset-cache", np.nan)}
+    for var_name, name in [("runtime_model_init", "model-init"),
+                           ("runtime_dataset_startup", "dataset-startup"),
+                           ("runtime_dataset_write", "dataset-write"),
+                           ("runtime_model_run", "model-run")]:
+        record_results[var_name] = checkpoints[name]["runtime"] if name in checkpoints else np.nan
+    record_results["runtime_init_max"] = spans["init"]["max"] if "init" in spans else np.nan
+    record_results["runtime_init_imbalance"] = spans["init"]["imbalance"] if "init" in spans else np.nan
+    memory = record.get("memory", {})
+    for var_name, name in [("network_built", "network-built"), ("after_psolve", "after-psolve")]:
+        reduced = memory.get(name, {}).get("reduced", {})
+        record_results[f"memory_{var_name}_max"] = reduced["current"]["max"] if reduced else np.nan
+        record_results[f"memory_{var_name}_total"] = reduced["current"]["total"] if reduced else np.nan
+    peak = [sample["reduced"]["peak"] for sample in memory.values() if sample.get("reduced")]
+    record_results["memory_peak_max"] = max(r["max"] for r in peak) if peak else np.nan
+    record_results["memory_peak_total"] = max(r["total"] for r in peak) if peak else np.nan
+    record_results["aborted_at"] = record["info"].get("aborted-at", np.nan)
+    # (the checkpoints and spans of the runs are named per trial if there are multiple trials)
+    trial_names = [(f"run-trial-{i}", f"psolve-trial-{i}") for i in range(record["trials"])] \
+                  if record["trials"] > 1 else [("model-run", "psolve")]
+    trial_results = [{"runtime_model_run" : checkpoints[checkpoint]["runtime"] if checkpoint in checkpoints else np.nan,
+                      "runtime_run_max" : spans[span]["max"] if span in spans else np.nan,
+                      "runtime_run_imbalance" : spans[span]["imbalance"] if span in spans else np.nan}
+                     for checkpoint, span in trial_names]
+    return record_results, trial_results
+
+def store_results(out_file, results):
+    '''
+    Appends rows of results to the CSV file atomically (the extended table is written
+    to a temporary file that replaces the old one, such that the file is never left
+    incomplete).
+
+    Parameters
+    ----------
+    out_file : str
+      Name of the CSV file.
+    results : list of dict
+      The rows to append.
+    '''
+    new_data = pd.DataFrame(results)
+    if os.path.exists(out_file):
+        new_data = pd.concat([pd.read_csv(out_file, sep="\t"), new_data], ignore_index=True)
+    tmp_file = f"{out_file}.tmp"
+    new_data.to_csv(tmp_file, index=False, header=True, sep="\t")
+    os.replace(tmp_file, out_file)
+
+def make_jobs(config):
+    '''
+    Creates the jobs of a benchmark sweep, in randomized order.
+
+    Parameters
+    ----------
+    config : dict
+      The sweep definition (cf. 'busyring_benchmark_sweep.json').
+
+    Returns
+    -------
+    jobs : list of benchmark_scheduler.Job
+      One job per launch of each configuration.
+    '''
+    variants = dict(config.get("variants", {}))
+    # weak scaling: sweep axes of the workload per rank (the number of cells is derived from the number of ranks)
+    for axis in ("cells_per_rank", "compartments_per_rank"):
+        if config.get(axis):
+            variants[axis] = {f"{axis}={value}" : f"-{axis} {value}" for value in config[axis]}
+    variant_axes = [[(axis, label, args) for label, args in values.items()] for axis, values in variants.items()]
+    # the spike reference of each paradigm is created by the first launch of a fixed configuration: the first
+    # numbers of threads and ranks, on CPU if swept, and the default of each variant axis (the label without
+    # arguments, otherwise the first label)
+    reference_config = (config["num_threads"][0], config["num_ranks"][0], False if False in config["gpu"] else config["gpu"][0],
+                        tuple(next((label for label, args in values.items() if not args), next(iter(values)))
+                              for values in variants.values()))
+    memory_model = model_estimate.load_memory_model(config.get("memory_model", ""))
+    predicted_memory = {} # predicted memory of all ranks per model and number of ranks
+    jobs = []
+    for paradigm, num_threads, num_ranks, gpu, variant in itertools.product(config["paradigms"],
+                                                                            config["num_threads"],
+                                                                            config["num_ranks"],
+                                                                            config["gpu"],
+                                                                            itertools.product(*variant_axes)):
+        variant_labels = "".join(f"_{label}" for _, label, _ in variant)
+        variant_args = "".join(f" {args}" for _, _, args in variant if args)
+        name = f"{paradigm}_{num_threads}_{num_ranks}{'_gpu' if gpu else ''}{variant_labels}"
+        # jobs that may share a dataset of the cache are never run concurrently (the dataset key does not
+        # depend on the GPU flag and on most variants, e.g., of the spike exchange)
+        uses_dataset_cache = config['dataset_cache'] and not config['chunk']
+        group = f"{paradigm}_{num_threads}_{num_ranks}" if uses_dataset_cache else name
+        memory_mb = 0
+        if config.get("available_memory_mb"):
+            model_args = f"-params_file '{paradigm}.json'{variant_args}"
+            if (model_args, num_ranks) not in predicted_memory:
+                _, predicted_memory[model_args, num_ranks] = model_estimate.predicted_memory_mb(model_args, num_ranks, memory_model)
+            memory_mb = predicted_memory[model_args, num_ranks]
+        for launch in range(config["num_trials"] // config["trials_per_launch"]):
+            log_file = f"busyring_benchmark_output_{name}_{launch}.log"
+            record_file = log_file.replace(".log", ".json")
+            spike_dir = log_file.replace(".log", "_spikes")
+            # chunked runs (with telemetry and early abort) are transferred in memory, without the dataset cache
+            command = (f"{config['mpiexec']} -n {num_ranks} {config['mpiexec_args']} ./x86_64/special -mpi -python run_ring_network.py " +
+                       f"-coreneuron -num_threads {num_threads} {'-gpu ' if gpu else ''}-params_file '{paradigm}.json' " +
+                       f"-trials {config['trials_per_launch']} -record '{record_file}'" +
+                       (f" -dataset_cache '{config['dataset_cache']}'" if uses_dataset_cache else "") +
+                       (f" -chunk {config['chunk']} -min_throughput {config['min_throughput']} "
+                        f"-telemetry '{log_file.replace('.log', '.telemetry.jsonl')}'" if config['chunk'] else "") +
+                       (f" -spike_dir '{spike_dir}'" if config['spike_reference'] else "") +
+                       variant_args)
+            job_config = {"paradigm" : paradigm, "num_threads_set" : num_threads, "num_ranks_set" : num_ranks,
+                          "gpu" : gpu, "launch" : launch, "trials_per_launch" : config["trials_per_launch"],
+                          "record_file" : record_file}
+            if config['spike_reference']:
+                job_config["spike_dir"] = spike_dir
+                if launch == 0 and (num_threads, num_ranks, gpu, tuple(label for _, label, _ in variant)) == reference_config:
+                    job_config["create_reference"] = True
+            job_config.update({axis : label for axis, label, _ in variant})
+            jobs.append(benchmark_scheduler.Job(f"{name}_{launch}", command, log_file,
+                                                num_threads*num_ranks, group, job_config, memory_mb))
+    # randomize the order to avoid systematic drift (e.g., of the node state) across the configurations
+    random.Random(config["seed"]).shuffle(jobs)
+    return jobs
+
+def check_spikes(spike_dir, reference, tolerance=0.025, max_mismatches=0, params_file="", create=False):
+    '''
+    Compares the spikes of a run with the reference spikes of its paradigm (cf. 'compare_spikes.py');
+    if there is no reference yet and 'create' is set, the spikes of the run become the reference.
+
+    Parameters
+    ----------
+    spike_dir : str
+      Directory with the spike files of the run.
+    reference : str
+      Reference spike file ('.npy').
+    tolerance : float
+      Maximum time difference of matching spikes in ms.
+    max_mismatches : int
+      Number of missing plus extra spikes that is still accepted.
+    params_file : str
+      Paradigm of the run (for the ring size and the number of cells).
+    create : bool
+      Whether the run may create the reference (only the run of the reference configuration).
+
+    Returns
+    -------
+    mismatches : int
+      Number of missing plus extra spikes (0 if the spikes have become the reference).
+    '''
+    files = [path for pattern in ("spikes.rank*.npy", "spikes.rank*.bin", "spikes*.dat", "out.dat")
+             for path in sorted(glob.glob(os.path.join(spike_dir, pattern)))]
+    if not files:
+        raise ValueError(f"no spike files in '{spike_dir}'")
+    blocks = compare_spikes.sorted_blocks(files)
+    if not os.path.exists(reference):
+        if not create:
+            raise ValueError(f"no reference spikes '{reference}' (the run of the reference configuration has failed)")
+        # written to a temporary file that replaces the reference, such that an interrupted write leaves no reference
+        os.makedirs(os.path.dirname(reference) or ".", exist_ok=True)
+        tmp_file = f"{reference}.tmp"
+        out = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=spike_output.spike_dtype,
+                                        shape=(sum(len(block) for block in blocks),))
+        pos = 0
+        for chunk in spike_output.merge_blocks(blocks):
+            out[pos:pos+len(chunk)] = chunk
+            pos += len(chunk)
+        out.flush()
+        del out
+        os.replace(tmp_file, reference)
+        print(f"Stored the spikes of '{spike_dir}' as reference '{reference}'.")
+        return 0
+    num_cells, ring_size = 0, 4
+    if params_file:
+        with open(params_file) as f:
+            data = json.load(f)
+        num_cells, ring_size = data["num-cells"], data["ring-size"]
+    result = compare_spikes.compare(compare_spikes.sorted_blocks([reference]), blocks, tolerance, num_cells, ring_size)
+    compare_spikes.print_result(result)
+    mismatches = result["missing"] + result["extra"]
+    if mismatches > max_mismatches:
+        raise ValueError(f"spikes differ from the reference '{reference}' ({result['missing']} missing, "
+                         f"{result['extra']} extra)")
+    return mismatches
+
+def collect_results(job, out_file, db_file="", spike_check=None):
+    '''
+    Extracts the results of a finished job, prints some information and stores them
+    (in the CSV file and, if given, in the results database, cf. 'benchmark_results.py').
+    If a spike check is given (reference file pattern, tolerance and maximum number of
+    mismatches, cf. 'check_spikes()'), runs whose spikes differ from the reference of
+    their paradigm are rejected (an exception is raised and nothing is stored).
+    '''
+    config = job.config
+    if spike_check is not None and "spike_dir" in config:
+        reference, tolerance, max_mismatches = spike_check
+        mismatches = check_spikes(config["spike_dir"], reference.format(paradigm=config["paradigm"]), tolerance,
+                                  max_mismatches, f"{config['paradigm']}.json", config.get("create_reference", False))
+        shutil.rmtree(config["spike_dir"], ignore_errors=True)
+
+    # Scrape information from file (with the runtimes of the single trials if there are multiple per launch);
+    # the runtimes are taken from the run record if it has been written
+    record_file = config["record_file"]
+    extracted_results = extract_benchmark_data(job.log_file)
+    trial_results = [{"runtime_model_run" : runtime} for runtime in extract_trial_runtimes(job.log_file)] \
+                    if config["trials_per_launch"] > 1 else [{"runtime_model_run" : extracted_results['runtime_model_run']}]
+    if os.path.exists(record_file):
+        record_results, trial_results = read_run_record(record_file)
+        extracted_results.update(record_results)
+
+    rows = []
+    for trial_in_launch, trial_result in enumerate(trial_results):
+        extracted_results.update(trial_result)
+
+        # Print some information
+        print(f"Paradigm: {config['paradigm']}\n" +
+              f"  with num_threads = {config['num_threads_set']}, num_ranks = {config['num_ranks_set']}\n" +
+              f"Launch: {config['launch']}, trial in launch: {trial_in_launch}\n" +
+              f"  dataset_cache       =  {extracted_results['dataset_cache']}\n" +
+              f"  runtime_model_init  =  {extracted_results['runtime_model_init']}\n" +
+              f"  runtime_dataset_startup = {extracted_results['runtime_dataset_startup']}\n" +
+              f"  runtime_coreneuron_setup = {extracted_results['runtime_coreneuron_setup']}\n" +
+              f"  runtime_model_run   =  {extracted_results['runtime_model_run']}\n" +
+              f"  runtime_total       =  {extracted_results['runtime_total']}\n" +
+              f"  num_cells           =  {extracted_results['num_cells']}\n" +
+              f"  num_compartments    =  {extracted_results['num_compartments']}\n")
+
+        output_results = {"job_id" : job.job_id, "trial_in_launch" : trial_in_launch}
+        output_results.update({key : value for key, value in config.items() if key not in ("record_file", "spike_dir", "create_reference")})
+        output_results.update(extracted_results)
+        if spike_check is not None and "spike_dir" in config:
+            output_results["spike_mismatches"] = mismatches
+        rows.append(output_results)
+
+    # Store everything to CSV file and database
+    store_results(out_file, rows)
+    if db_file:
+        benchmark_results.store_runs(db_file, rows)
+
+if __name__ == "__main__":
+    # Parse commandline arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config", help="JSON file defining the benchmark sweep", type=str, default="busyring_benchmark_sweep.json")
+    parser.add_argument("-restart", action='store_true', help="start the sweep from scratch (ignoring the state of previous runs)", default=False)
+    parser.add_argument("-retry_failed", action='store_true', help="rerun jobs that have failed in previous runs", default=False)
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+    config.setdefault("trials_per_launch", 1)
+    config.setdefault("dataset_cache", "")
+    config.setdefault("mpiexec", "mpiexec")
+    config.setdefault("mpiexec_args", "")
+    config.setdefault("available_cores", None)
+    config.setdefault("timeout", None)
+    config.setdefault("seed", 0)
+    config.setdefault("recompile", False)
+    config.setdefault("db_file", "")
+    config.setdefault("available_memory_mb", None)
+    config.setdefault("chunk", 0)
+    config.setdefault("min_throughput", 0)
+    config.setdefault("spike_reference", "")
+    config.setdefault("spike_tolerance", 0.025)
+    config.setdefault("max_spike_mismatches", 0)
+
+    # Set environment variables (NOTE make sure that the installation directory is correct!)
+    home_dir = os.path.expanduser("~")
+    new_path = f"{home_dir}/nrn_installation/bin"
+    current_paths = os.environ.get("PATH", "")
+    if new_path not in current_paths:
+        os.environ["PATH"] = current_paths + ":" + new_path
+    new_python_path = f"{home_dir}/nrn_installation/lib/python"
+    current_python_paths = os.environ.get("PYTHONPATH", "")
+    if new_python_path not in current_python_paths:
+        os.environ["PYTHONPATH"] = current_python_paths + ":" + new_python_path
+    #print("PATH =", os.environ.get("PATH"))
+    #print("PYTHONPATH =", os.environ.get("PYTHONPATH"))
+
+    # Compile mod files, including the plastic synapses of the STDP paradigms (only if not done before,
+    # unless recompilation is requested)
+    if config["recompile"] or not os.path.exists("x86_64/special"):
+        os.system("rm -R -f x86_64/*")
+        os.system("nrnivmodl -coreneuron mod")
+
+    # Run the sweep (resuming from the state of previous runs)
+    if args.restart and os.path.exists(config["state_file"]):
+        os.remove(config["state_file"])
+    scheduler = benchmark_scheduler.Scheduler(config["state_file"],
+                                              config["available_cores"] or os.cpu_count(),
+                                              config["timeout"],
+                                              retry_failed=args.retry_failed,
+                                              available_memory_mb=config["available_memory_mb"])
+    spike_check = (config["spike_reference"], config["spike_tolerance"], config["max_spike_mismatches"]) \
+                  if config["spike_reference"] else None
+    jobs = make_jobs(config)
+    if spike_check is not None:
+        # the runs of the reference configuration first, such that the spike references exist for all other runs
+        scheduler.run([job for job in jobs if job.config.get("create_reference")],
+                      lambda job: collect_results(job, config["out_file"], config["db_file"], spike_check))
+    scheduler.run(jobs, lambda job: collect_results(job, config["out_file"], config["db_file"], spike_check))
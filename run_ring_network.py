@@ -3,64 +3,224 @@ Script to run busyring example
 """
 
 import argparse
+import math
+import os
+import shutil
+import tempfile
 import numpy as np
 import neuron
 from neuron import h
 import parameters
+import spike_output
+import dataset_cache
+import partition
+import recording
+import metering
 from metering import RuntimeMetering
+from profiling import PhaseProfiler
 from ring_network import RingNetwork
+from telemetry import ChunkedRun
 
 # Parse commandline arguments
 parser = argparse.ArgumentParser()
 # Model and simulation parameters
-parser.add_argument("-num_rings", help="number of rings", type=int, default=256)
-parser.add_argument("-num_ring_cells", help="number of cells per ring", type=int, default=4)
-parser.add_argument("-num_rand_syns", help="number of random synapses of weight 0 per cell", type=int, default=10)
-parser.add_argument("-p_branch", nargs=2, help="range of branching probabilities at each level",  type=float, default=[1.0, 0.5])
-parser.add_argument("-num_comparts", nargs=2, help="range of compartments per branch (default [1,1])", type=int, default=[1, 1])
-parser.add_argument("-params_file", help="JSON file containing parameter configuration", type=str, default="")
-parser.add_argument("-duration", metavar='float', help="duration of the simulation in ms", type=float, default=200.0)
+parameters.add_arguments(parser)
+parameters.add_exchange_arguments(parser)
 parser.add_argument("-num_threads", help="number of threads to use", type=int, default=1)
+parser.add_argument("-trials", help="number of simulation runs of the network (which is only built once)", type=int, default=1)
+parser.add_argument("-partition", help="strategy to distribute the gids across ranks", type=str,
+                    choices=partition.strategies, default="round-robin")
+parser.add_argument("-thread_partition", help="strategy to distribute the cells of each rank across its threads ('default': by NEURON, "
+                                              "'balanced': groups of 'cpu-group-size' cells balanced by their cost)",
+                    type=str, choices=partition.thread_strategies, default="default")
+parser.add_argument("-thread_calibration", help="duration in ms of a calibration run that measures the compute time per thread "
+                                                "to refine the cost of the cells (with balanced thread partitioning; 0: no calibration)",
+                    type=float, default=0)
+parser.add_argument("-chunk", help="simulate in chunks of this many ms (a multiple of the minimum delay), with progress telemetry "
+                                    "after each chunk (0: one run over the whole duration)", type=float, default=0)
+parser.add_argument("-telemetry", help="JSON-lines file to stream the telemetry of the chunks to (throughput, spike counts, "
+                                        "chunk time per rank)", type=str, default="")
+parser.add_argument("-min_throughput", help="abort the run if the throughput of a chunk (after the first) falls below this many "
+                                             "simulated ms per wall-clock second (0: no abort)", type=float, default=0)
+parser.add_argument("-profile", help="directory to write a cProfile dump of each phase (partition, build-network, stdinit, "
+                                      "dataset-write, psolve, etc.) per rank to (no profiling if empty; merge with merge_profiles.py)",
+                    type=str, default="")
+parser.add_argument("-profile_ranks", nargs='+', help="ranks to profile (default: all)", type=int, default=None)
+parser.add_argument("-voltage_selector", help="cells whose membrane potential is recorded ('ring': first cell of each ring, "
+                                               "'every': every k-th gid, 'gids': the given gids)", type=str,
+                    choices=recording.selectors, default="none")
+parser.add_argument("-voltage_every", help="distance of the recorded gids (selector 'every')", type=int, default=100)
+parser.add_argument("-voltage_gids", nargs='+', help="recorded gids (selector 'gids')", type=int, default=[])
+parser.add_argument("-voltage_locations", nargs='+', help="recorded locations of each cell", type=str,
+                    choices=['soma', 'dend'], default=['soma'])
+parser.add_argument("-voltage_interval", help="sampling interval of the membrane potential in ms", type=float, default=1.0)
+parser.add_argument("-voltage_flush", help="interval in ms (a multiple of the minimum delay) at which the recorded samples are "
+                                           "flushed to file with NEURON, such that the memory of the recording stays bounded (0: after "
+                                           "the run; with CoreNEURON, the samples are flushed after the run, or after each chunk with "
+                                           "'-chunk', as each run transfers the model to CoreNEURON and back)", type=float, default=100.0)
+parser.add_argument("-voltage_output", help="path and base name of the files of the recorded membrane potentials (one binary "
+                                            "file and its description per rank)", type=str, default="voltages")
+parser.add_argument("-record", help="JSON file to write the record of the run (parameters and metering results) to", type=str, default="")
+parser.add_argument("-spike_output", help="format of the spike output ('npy'/'raw': binary file per rank, 'mpiio': one binary "
+                                         "file for all ranks, 'text': text file per rank; merge with merge_spikes.py)",
+                    type=str, choices=spike_output.formats, default="npy")
+parser.add_argument("-spike_dir", help="directory to write the spike files to (also CoreNEURON's 'out.dat' in dataset mode)",
+                    type=str, default=".")
+parser.add_argument("-morphology_cache", help="directory to cache the morphology specifications in (no caching if empty)", type=str, default="")
+parser.add_argument("-connectivity_cache", help="directory to cache the connectivity tables in (no caching if empty)", type=str, default="")
 # CoreNEURON parameters (cf. https://github.com/neuronsimulator/ringtest/blob/master/ringtest.py)
 parser.add_argument("-coreneuron", action='store_true', help="use CoreNEURON", default=False)
 parser.add_argument("-file_mode", action='store_true', help="run CoreNEURON with file mode (instead of in-memory transfer)", default=False)
 parser.add_argument("-gpu", action='store_true', help="run CoreNEURON on GPU", default=False)
+parser.add_argument("-dataset_cache", help="directory to cache CoreNEURON datasets in, to skip the model construction in later runs "
+                                          "of the same configuration (no caching if empty)", type=str, default="")
+parser.add_argument("-lean_memory", action='store_true', help="write the model as CoreNEURON dataset (to the dataset cache or a temporary "
+                                                              "directory), release it on the NEURON side and run CoreNEURON from the dataset, "
+                                                              "to save the memory of the NEURON model during the run", default=False)
 parser.add_argument('-permutation', help="run CoreNEURON with permutation for cell topology", type=int, default=0)
 args, _ = parser.parse_known_args()
 
 # Initialize runtime metering
 runtime_meter = RuntimeMetering()
+runtime_meter.sample_memory("start")
 
 # Set up parallelization
 pc = h.ParallelContext() # create context
 pc.nthread(args.num_threads) # set number of threads
-#pc.set_maxstep(100*loaded_params.dt) # maximum timestep in ms (not used because CoreNEURON can only use fixed timestep methods)
+
+# Profiling of the phases (on the selected ranks)
+profiler = PhaseProfiler(int(pc.id()), args.profile, args.profile_ranks)
 
 # Load parameters (commandline arguments and default values will be used unless a configuration file is provided)
-loaded_params = parameters.model_parameters(args.params_file, args.duration, args.num_rings, args.num_ring_cells,
-                                            args.p_branch, args.num_comparts, args.num_rand_syns, pc)
+loaded_params = parameters.from_arguments(args, pc)
+exchange_params = parameters.exchange_from_arguments(args) # (commandline arguments take precedence here)
 
 # Output of key parameters
 if pc.id() == 0:
     print(f"Using NEURON version {neuron.__version__}\n"
           f"Configuration" + (f" (loaded from {args.params_file}):\n" if args.params_file else ":\n") +
-            f"  Total number of cells: {loaded_params.num_cells}\n"
+            f"  Total number of cells: {loaded_params.num_cells}\n" +
+            (f"  Weak scaling with {loaded_params.cells_per_rank} cells per rank\n" if loaded_params.cells_per_rank else "") +
+            (f"  Weak scaling with {loaded_params.compartments_per_rank} compartments per rank\n"
+             if loaded_params.compartments_per_rank else "") +
             f"  Cells per ring: {loaded_params.ring_size}\n"
             f"  Branching probabilities: {loaded_params.cell.branch_probs}\n"
             f"  Compartments per cell:  {loaded_params.cell.compartments}\n"
-            f"  Random synapses per cell: {loaded_params.cell.synapses}")
+            f"  Random synapses per cell: {loaded_params.cell.synapses}\n"
+            f"  Spike exchange: compress {exchange_params.spike_compress}, gid compress {exchange_params.gid_compress}, "
+            f"multisend {exchange_params.multisend}, queue mode {exchange_params.queue_mode}, maxstep {exchange_params.maxstep}")
+
+# Look up the CoreNEURON dataset of this configuration (if a dataset cache is used)
+dataset_path = ""
+dataset_hit = False
+if args.dataset_cache:
+    if not args.coreneuron:
+        raise ValueError("The dataset cache requires CoreNEURON (use '-coreneuron').")
+    dataset_path = dataset_cache.dataset_path(args.dataset_cache, loaded_params, int(pc.nhost()),
+                                              args.num_threads, args.partition, args.thread_partition,
+                                              args.thread_calibration)
+    # (decided on rank 0, such that all ranks either load the dataset or build the model)
+    dataset_hit = pc.py_broadcast(dataset_cache.is_complete(dataset_path) if pc.id() == 0 else None, 0)
+    runtime_meter.set_info("dataset-cache", "hit" if dataset_hit else "miss")
+    if pc.id() == 0:
+        print(f"Dataset cache {'hit' if dataset_hit else 'miss'}: {dataset_path}")
+
+# In lean-memory mode, the model is run from a dataset, which is temporary unless a dataset cache is used
+if args.lean_memory:
+    if not args.coreneuron:
+        raise ValueError("The lean-memory mode requires CoreNEURON (use '-coreneuron').")
+    if not dataset_path:
+        dataset_path = pc.py_broadcast(tempfile.mkdtemp(prefix="busyring-dataset-", dir=".") if pc.id() == 0 else None, 0)
 
-# Create network of rings of cells and set spike recorder
-ring_network = RingNetwork(loaded_params, pc)
+# Spike recorder (and output directory)
+if pc.id() == 0:
+    os.makedirs(args.spike_dir, exist_ok=True)
 spike_times = h.Vector()
 spike_gids = h.Vector()
-pc.spike_record(-1, spike_times, spike_gids)
 
-# Settings for numerical integration
-h.load_file('stdgui.hoc') # needed for cvode settings
-h.dt = loaded_params.dt # fixed timestep in ms
-h.cvode.cache_efficient(1) # CoreNEURON requires this setting of data representation
-h.stdinit()
+# Build the network (the spans meter the time of each rank before it waits at the next barrier)
+with runtime_meter.span("init"):
+    if not dataset_hit:
+        # Distribute the gids across ranks
+        with runtime_meter.span("partition"), profiler.phase("partition"):
+            gid_partition = partition.partition(args.partition, loaded_params.num_cells, loaded_params.ring_size,
+                                                int(pc.nhost()), loaded_params.cell, args.morphology_cache)
+        if pc.id() == 0:
+            print(f"Using {gid_partition}")
+
+        # Create network of rings of cells and set spike recorder
+        with runtime_meter.span("build-network"), profiler.phase("build-network"):
+            ring_network = RingNetwork(loaded_params, pc, args.connectivity_cache, args.morphology_cache, gid_partition,
+                                       args.lean_memory)
+            pc.spike_record(-1, spike_times, spike_gids)
+        runtime_meter.sample_memory("network-built")
+        runtime_meter.set_info("inter-rank-connections", ring_network.total_inter_rank_connections)
+
+        # Spike exchange and event queue settings (applied by NEURON when the model is transferred to
+        # CoreNEURON in memory; passed as arguments when CoreNEURON runs from a dataset)
+        if exchange_params.spike_compress or exchange_params.multisend:
+            pc.spike_compress(exchange_params.spike_compress, bool(exchange_params.gid_compress), exchange_params.multisend)
+        h.cvode.queue_mode(*parameters.queue_modes[exchange_params.queue_mode])
+        if exchange_params.maxstep:
+            runtime_meter.set_info("min-delay", pc.set_maxstep(exchange_params.maxstep)) # returns the global minimum delay
+
+    # Settings for numerical integration
+    h.load_file('stdgui.hoc') # needed for cvode settings
+    h.dt = loaded_params.dt # fixed timestep in ms
+    h.cvode.cache_efficient(1) # CoreNEURON requires this setting of data representation
+    if not dataset_hit and args.thread_partition == "balanced":
+        # Distribute the cells across the threads by their estimated cost; with calibration, the cost of the
+        # synapses relative to the compartments is then fitted to the compute times of the threads in a short
+        # run (from all ranks), and the cells are distributed again
+        with runtime_meter.span("thread-partition"), profiler.phase("thread-partition"):
+            thread_partition = ring_network.partition_threads(pc, args.num_threads, loaded_params.cpu_group_size)
+            if args.thread_calibration > 0:
+                h.stdinit()
+                pc.thread_ctime() # reset the compute times of the threads
+                pc.psolve(args.thread_calibration)
+                compartments, synapses = ring_network.thread_loads(args.num_threads)
+                times = [pc.thread_ctime(i) for i in range(args.num_threads)]
+                if int(pc.nhost()) > 1:
+                    from mpi4py import MPI
+                    compartments, synapses, times = (np.concatenate(MPI.COMM_WORLD.allgather(np.asarray(values)))
+                                                     for values in (compartments, synapses, times))
+                synapse_cost = partition.fit_synapse_cost(compartments, synapses, times)
+                if synapse_cost is not None:
+                    thread_partition = ring_network.partition_threads(pc, args.num_threads, loaded_params.cpu_group_size,
+                                                                      synapse_cost)
+                    runtime_meter.set_info("synapse-cost", synapse_cost)
+                spike_times.resize(0) # (the initial state of the network is restored by 'h.stdinit()' below)
+                spike_gids.resize(0)
+        runtime_meter.set_info("thread-imbalance-predicted", thread_partition.imbalance())
+        if pc.id() == 0:
+            print(f"Using balanced thread partition (cpu group size {loaded_params.cpu_group_size}): predicted load per thread "
+                  f"on rank 0 min {thread_partition.loads().min():.1f}; max {thread_partition.loads().max():.1f}; "
+                  f"imbalance (max/mean) {thread_partition.imbalance():.3f}")
+    # Recording of the membrane potential of the selected cells (the samples are flushed to file after each
+    # chunk in chunked runs, at a fixed interval with NEURON, and after the run otherwise)
+    recorder = None
+    flush_interval = 0
+    if args.voltage_selector != "none":
+        if dataset_path or (args.coreneuron and args.file_mode):
+            raise ValueError("The recording of membrane potentials requires the in-memory transfer to CoreNEURON "
+                             "(not '-dataset_cache', '-lean_memory' or '-file_mode').")
+        if not args.chunk and not args.coreneuron and args.voltage_flush:
+            flush_steps = args.voltage_flush / loaded_params.min_delay
+            if args.voltage_flush < 0 or not math.isclose(flush_steps, round(flush_steps)):
+                raise ValueError(f"The flush interval ({args.voltage_flush} ms) has to be a multiple of the minimum "
+                                 f"delay ({loaded_params.min_delay} ms).")
+            flush_interval = args.voltage_flush
+        selected = recording.select_gids(ring_network.gids, args.voltage_selector, loaded_params.ring_size,
+                                         args.voltage_every, args.voltage_gids)
+        recorder = recording.VoltageRecorder([ring_network.cells[i] for i in selected.tolist()],
+                                             [ring_network.gids[i] for i in selected.tolist()],
+                                             args.voltage_locations, args.voltage_interval, int(pc.id()), args.voltage_output,
+                                             int((args.chunk or flush_interval or loaded_params.duration) / args.voltage_interval) + 2)
+        runtime_meter.set_info("voltage-probes", len(recorder))
+    if not dataset_hit:
+        with runtime_meter.span("stdinit"), profiler.phase("stdinit"):
+            h.stdinit()
+        runtime_meter.sample_memory("after-stdinit")
 
 # CoreNEURON settings
 if args.coreneuron:
@@ -73,25 +233,134 @@ if args.coreneuron:
     else:
         coreneuron.cell_permute = 2 # see https://github.com/neuronsimulator/ringtest/blob/master/ringtest.py
 pc.barrier()
-runtime_meter.add_checkpoint("model-init")
+if dataset_hit:
+    runtime_meter.add_checkpoint("dataset-startup") # (CoreNEURON reads the dataset as part of the run)
+else:
+    runtime_meter.add_checkpoint("model-init")
 
-# Run the simulation
-pc.psolve(loaded_params.duration)
-pc.barrier()
-runtime_meter.add_checkpoint("model-run")
+# Store the model as CoreNEURON dataset
+if dataset_path and not dataset_hit:
+    with profiler.phase("dataset-write"):
+        dataset_cache.write_dataset(pc, dataset_path, {"parameters": loaded_params.as_dict(),
+                                                       "num_ranks": int(pc.nhost()),
+                                                       "num_threads": args.num_threads,
+                                                       "partition": args.partition,
+                                                       "thread_partition": args.thread_partition,
+                                                       "thread_calibration": args.thread_calibration,
+                                                       "cpu_group_size": loaded_params.cpu_group_size})
+    runtime_meter.add_checkpoint("dataset-write")
+
+    # Release the NEURON model, which is not needed anymore to run from the dataset
+    if args.lean_memory:
+        runtime_meter.sample_memory("before-release")
+        with runtime_meter.span("release"), profiler.phase("release"):
+            ring_network.release(pc)
+            del ring_network
+            metering.trim_memory()
+        runtime_meter.sample_memory("after-release")
+        reclaimed = runtime_meter.memory_samples["before-release"]["current"] - runtime_meter.memory_samples["after-release"]["current"]
+        runtime_meter.set_info("memory-reclaimed-mb", reclaimed)
+        if pc.id() == 0:
+            print(f"Released the NEURON model: {reclaimed:.1f} MB reclaimed on rank 0")
+        pc.barrier()
+        runtime_meter.add_checkpoint("release")
 
-# Write the spike data to file
-spike_data = np.column_stack([np.array(spike_times), np.array(spike_gids)])
-sorted_indices = np.lexsort((spike_data[:, 1], spike_data[:, 0]))
-sorted_spike_data = spike_data[sorted_indices]
-np.savetxt('spikes.dat', 
-           sorted_spike_data,
-           fmt="%.3f %d") # integer formatting for neuron number
+# Chunked runs (not from a dataset, which CoreNEURON runs in one go)
+chunked_run = None
+if args.chunk:
+    if dataset_path:
+        raise ValueError("Chunked runs are not supported with a CoreNEURON dataset ('-dataset_cache', '-lean_memory').")
+    chunked_run = ChunkedRun(pc, args.chunk, loaded_params.min_delay, args.telemetry, args.min_throughput)
 
-# Print runtime summary and exit the NEURON environment
+# Run the simulation (from the dataset if a dataset cache is used, CoreNEURON then writes the spikes to 'out.dat');
+# with multiple trials, the network is reset and re-initialized before each further run
+for trial in range(args.trials):
+    if trial > 0:
+        spike_times.resize(0)
+        spike_gids.resize(0)
+        if not dataset_path:
+            if recorder is not None:
+                recorder.reset() # (the recording of the last trial is kept)
+            # (the INITIAL blocks restore the stimuli, which keep their parameters, and the plastic state of the
+            # synapses, i.e., the scaling factors of ExpSynSTDP)
+            h.stdinit()
+        pc.barrier()
+        runtime_meter.add_checkpoint(f"reset-trial-{trial}")
+    # (the transfer of the model to CoreNEURON is part of the first run)
+    run_name = "psolve" if args.trials == 1 else f"psolve-trial-{trial}"
+    with runtime_meter.span(run_name), profiler.phase(run_name):
+        if dataset_path:
+            dataset_cache.run_dataset(pc, dataset_path, loaded_params.duration, coreneuron.cell_permute, coreneuron.gpu,
+                                      args.spike_dir, exchange_params)
+        else:
+            step_time, wait_time, send_time = pc.step_time(), pc.wait_time(), pc.send_time()
+            pc.thread_ctime() # reset the compute times of the threads
+            if chunked_run is not None:
+                chunked_run.run(loaded_params.duration, spike_times, trial, recorder.flush if recorder is not None else None)
+            elif flush_interval:
+                # in steps of the flush interval, such that the buffers of the recording stay bounded (NEURON only, as
+                # each run with CoreNEURON would transfer the model again)
+                while h.t < loaded_params.duration - 1e-9:
+                    pc.psolve(min(h.t + flush_interval, loaded_params.duration))
+                    recorder.flush()
+            else:
+                pc.psolve(loaded_params.duration)
+            if recorder is not None:
+                recorder.flush()
+            if not args.coreneuron:
+                # compute time of each thread (to assess the thread partition; NEURON only, as CoreNEURON's
+                # threads are not covered by 'pc.thread_ctime()')
+                runtime_meter.add_thread_times(run_name, [pc.thread_ctime(i) for i in range(args.num_threads)])
+                # breakdown as metered by NEURON: integration, waiting for spike exchange, and sending of spikes
+                runtime_meter.add_span("step", pc.step_time() - step_time)
+                runtime_meter.add_span("wait", pc.wait_time() - wait_time)
+                runtime_meter.add_span("send", pc.send_time() - send_time)
+    runtime_meter.sample_memory("after-psolve" if args.trials == 1 else f"after-psolve-trial-{trial}")
+    pc.barrier()
+    runtime_meter.add_checkpoint("model-run" if args.trials == 1 else f"run-trial-{trial}")
+    if chunked_run is not None and chunked_run.aborted_at is not None:
+        # throughput below the threshold: skip the remaining trials (the same decision on all ranks)
+        runtime_meter.set_info("aborted-at", chunked_run.aborted_at)
+        runtime_meter.set_info("aborted-trial", trial)
+        break
+if chunked_run is not None:
+    chunked_run.close()
+
+# Write the spike data (of the last trial) to file (not in dataset mode, where CoreNEURON writes the spikes)
+if not dataset_path:
+    spike_output.write_spikes(spike_times, spike_gids, pc, args.spike_output, os.path.join(args.spike_dir, "spikes"))
+
+# Print runtime summary (with statistics across ranks), write the run record and exit the NEURON environment
+runtime_meter.reduce(pc)
 if pc.id() == 0:
     print("------------------\n"
           "Metering summary:\n"
           "------------------")
     runtime_meter.print_summary()
+    if args.trials > 1:
+        runtime_meter.print_statistics("run-trial-")
+    if args.record:
+        runtime_meter.write_record(args.record,
+                                   parameters=loaded_params.as_dict(),
+                                   params_file=args.params_file,
+                                   neuron_version=neuron.__version__,
+                                   num_ranks=int(pc.nhost()),
+                                   num_threads=args.num_threads,
+                                   trials=args.trials,
+                                   coreneuron=args.coreneuron,
+                                   file_mode=args.file_mode,
+                                   gpu=args.gpu,
+                                   permutation=args.permutation,
+                                   partition=args.partition,
+                                   thread_partition=args.thread_partition,
+                                   lean_memory=args.lean_memory,
+                                   chunk=args.chunk,
+                                   min_throughput=args.min_throughput,
+                                   exchange=exchange_params.as_dict())
+
+# Remove the temporary dataset of the lean-memory mode
+if args.lean_memory and not args.dataset_cache:
+    pc.barrier()
+    if pc.id() == 0:
+        shutil.rmtree(dataset_path, ignore_errors=True)
 h.quit()
@@ -0,0 +1,292 @@
+"""
+Scaling analysis of the busyring benchmark results (speedup, parallel efficiency, serial
+fractions, best split of ranks and threads), written as self-contained Markdown or HTML report
+"""
+
+import argparse
+import base64
+import html
+import io
+import json
+import numpy as np
+import benchmark_results
+
+# Phases to analyze, with the metric (column of the results database) of each
+phases = [("init", "runtime_model_init"), ("run", "runtime_model_run")]
+
+def load_scaling_data(db_file, metric):
+    '''
+    Loads the statistics of a metric per configuration from the results database (without
+    aborted runs, cf. 'benchmark_results.aggregate()').
+
+    Returns
+    -------
+    groups : dict
+      Maps (paradigm, gpu, variant) to a list of the statistics of the configurations
+      (with entries 'num_ranks', 'num_threads', 'cores', 'n', 'median', 'q25', 'q75', ...),
+      sorted by cores, ranks and threads.
+    '''
+    groups = {}
+    for entry in benchmark_results.aggregate(db_file, metric):
+        if entry["n"] == 0 or entry["num_ranks"] is None or entry["num_threads"] is None:
+            continue
+        entry["cores"] = entry["num_ranks"] * entry["num_threads"]
+        groups.setdefault((entry["paradigm"], entry["gpu"], entry["variant"]), []).append(entry)
+    for entries in groups.values():
+        entries.sort(key=lambda e: (e["cores"], e["num_ranks"], e["num_threads"]))
+    return groups
+
+def add_speedup(entries, weak=False):
+    '''
+    Adds the speedup and the parallel efficiency of each configuration relative to the
+    smallest configuration (fastest one if several use the smallest number of cores).
+    With weak scaling (workload per rank), the efficiency is the ratio of the runtimes
+    and the speedup is the scaled speedup.
+
+    Returns
+    -------
+    reference : dict
+      The reference configuration.
+    '''
+    min_cores = entries[0]["cores"]
+    reference = min((e for e in entries if e["cores"] == min_cores), key=lambda e: e["median"])
+    for e in entries:
+        if weak:
+            e["efficiency"] = reference["median"] / e["median"]
+            e["speedup"] = e["efficiency"] * e["cores"] / reference["cores"]
+        else:
+            e["speedup"] = reference["median"] / e["median"]
+            e["efficiency"] = e["speedup"] * reference["cores"] / e["cores"]
+    return reference
+
+def is_weak_scaling(variant):
+    '''
+    Returns whether a variant (JSON of the variant labels) defines the workload per rank.
+    '''
+    labels = json.loads(variant or "{}")
+    return "cells_per_rank" in labels or "compartments_per_rank" in labels
+
+def fit_amdahl(cores, times):
+    '''
+    Fits Amdahl's law 'T(p) = T_1 * (s + (1 - s) / p)' to runtimes by least squares.
+
+    Returns
+    -------
+    serial_fraction : float
+      Estimated serial fraction s (clipped to [0, 1]; NaN if there are less than two core counts).
+    t1 : float
+      Estimated runtime on one core.
+    '''
+    cores = np.asarray(cores, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if len(np.unique(cores)) < 2:
+        return np.nan, np.nan
+    (serial, parallel), *_ = np.linalg.lstsq(np.column_stack([np.ones_like(cores), 1 / cores]), times, rcond=None)
+    t1 = serial + parallel
+    return float(np.clip(serial / t1, 0, 1)) if t1 > 0 else np.nan, float(t1)
+
+def fit_gustafson(relative_cores, speedups):
+    '''
+    Fits Gustafson's law 'S(p) = p - s * (p - 1)' to speedups (relative to the reference
+    configuration) by least squares.
+
+    Returns
+    -------
+    serial_fraction : float
+      Estimated serial fraction s (clipped to [0, 1]; NaN if there is no larger configuration).
+    '''
+    p = np.asarray(relative_cores, dtype=np.float64)
+    s = np.asarray(speedups, dtype=np.float64)
+    denominator = np.sum((p - 1)**2)
+    if denominator == 0:
+        return np.nan
+    return float(np.clip(-np.sum((s - p) * (p - 1)) / denominator, 0, 1))
+
+def best_splits(entries, budgets):
+    '''
+    Returns the fastest configuration (split of ranks and threads) within each core budget.
+
+    Returns
+    -------
+    best : list of (int, dict)
+      The budgets with the fastest configuration that uses at most as many cores.
+    '''
+    best = []
+    for budget in budgets:
+        fitting = [e for e in entries if e["cores"] <= budget]
+        if fitting:
+            best.append((budget, min(fitting, key=lambda e: e["median"])))
+    return best
+
+def plot_scaling(entries, title):
+    '''
+    Plots the runtimes and parallel efficiencies over the number of cores (one line per
+    number of threads), and returns the figure as base64-encoded PNG (None if matplotlib
+    is not available).
+    '''
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return None
+    fig, (ax_time, ax_eff) = plt.subplots(1, 2, figsize=(10, 4))
+    for num_threads in sorted({e["num_threads"] for e in entries}):
+        line = [e for e in entries if e["num_threads"] == num_threads]
+        cores = [e["cores"] for e in line]
+        ax_time.errorbar(cores, [e["median"] for e in line],
+                         yerr=[[e["median"] - e["q25"] for e in line], [e["q75"] - e["median"] for e in line]],
+                         marker="o", capsize=3, label=f"{num_threads} threads")
+        ax_eff.plot(cores, [e["efficiency"] for e in line], marker="o", label=f"{num_threads} threads")
+    for ax in (ax_time, ax_eff):
+        ax.set_xscale("log", base=2)
+        ax.set_xlabel("cores (ranks x threads)")
+        ax.grid(True, alpha=0.3)
+    ax_time.set_yscale("log")
+    ax_time.set_ylabel("runtime (s), median and IQR")
+    ax_eff.set_ylabel("parallel efficiency")
+    ax_eff.legend(fontsize="small")
+    fig.suptitle(title)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100)
+    plt.close(fig)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+class Report:
+    """
+    Report of headings, paragraphs, tables and figures, rendered as Markdown or HTML.
+    """
+    def __init__(self, title):
+        self.title = title  # title of the report
+        self.blocks = []    # list of (kind, content)
+
+    def heading(self, text, level=2):
+        self.blocks.append(("heading", (level, text)))
+
+    def paragraph(self, text):
+        self.blocks.append(("paragraph", text))
+
+    def table(self, header, rows):
+        self.blocks.append(("table", (header, [[fmt(value) for value in row] for row in rows])))
+
+    def figure(self, png, caption):
+        if png is not None:
+            self.blocks.append(("figure", (png, caption)))
+
+    def markdown(self):
+        lines = [f"# {self.title}", ""]
+        for kind, content in self.blocks:
+            if kind == "heading":
+                lines += [f"{'#' * content[0]} {content[1]}", ""]
+            elif kind == "paragraph":
+                lines += [content, ""]
+            elif kind == "table":
+                header, rows = content
+                lines += ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+                lines += ["| " + " | ".join(row) + " |" for row in rows] + [""]
+            elif kind == "figure":
+                lines += [f"![{content[1]}](data:image/png;base64,{content[0]})", ""]
+        return "\n".join(lines)
+
+    def html(self):
+        parts = [f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(self.title)}</title>",
+                 "<style>body{font-family:sans-serif;max-width:1100px;margin:auto}"
+                 "table{border-collapse:collapse;margin-bottom:1em}td,th{border:1px solid #ccc;padding:2px 8px;text-align:right}"
+                 "img{max-width:100%}</style></head><body>",
+                 f"<h1>{html.escape(self.title)}</h1>"]
+        for kind, content in self.blocks:
+            if kind == "heading":
+                parts.append(f"<h{content[0]}>{html.escape(content[1])}</h{content[0]}>")
+            elif kind == "paragraph":
+                parts.append(f"<p>{html.escape(content)}</p>")
+            elif kind == "table":
+                header, rows = content
+                parts.append("<table><tr>" + "".join(f"<th>{html.escape(h)}</th>" for h in header) + "</tr>")
+                parts += ["<tr>" + "".join(f"<td>{html.escape(v)}</td>" for v in row) + "</tr>" for row in rows]
+                parts.append("</table>")
+            elif kind == "figure":
+                parts.append(f"<figure><img src=\"data:image/png;base64,{content[0]}\" alt=\"{html.escape(content[1])}\">"
+                             f"<figcaption>{html.escape(content[1])}</figcaption></figure>")
+        parts.append("</body></html>")
+        return "\n".join(parts)
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.html() if filename.endswith((".html", ".htm")) else self.markdown())
+
+def fmt(value):
+    if isinstance(value, (float, np.floating)):
+        return "n/a" if np.isnan(value) else f"{value:.4g}"
+    return str(value)
+
+def group_title(paradigm, gpu, variant):
+    labels = [paradigm] + (["GPU"] if gpu else []) + [f"{k}={v}" for k, v in json.loads(variant or "{}").items()]
+    return ", ".join(labels)
+
+def scaling_report(db_file, title="Busyring scaling report", budgets=None, plots=True):
+    '''
+    Creates the scaling report of all paradigms (and variants) in the results database.
+
+    Parameters
+    ----------
+    db_file : str
+      Name of the results database (cf. 'benchmark_results.py').
+    title : str
+      Title of the report.
+    budgets : list of int
+      Core budgets to find the best split of ranks and threads for (all core counts
+      of the sweep if None).
+    plots : bool
+      Whether to include plots (requires matplotlib).
+
+    Returns
+    -------
+    report : Report
+      The report.
+    '''
+    report = Report(title)
+    report.paragraph(f"Results from '{db_file}'. Speedup and parallel efficiency are relative to the smallest "
+                     f"configuration; serial fractions are least-squares fits of Amdahl's law (to the runtimes) "
+                     f"and Gustafson's law (to the speedups). With weak scaling (workload per rank), the efficiency is the "
+                     f"ratio of the runtimes and the speedup is the scaled speedup. Runtimes are medians over the trials.")
+    data = {phase : load_scaling_data(db_file, metric) for phase, metric in phases}
+    for key in sorted(set().union(*data.values()), key=lambda k: tuple(str(v) for v in k)):
+        report.heading(group_title(*key))
+        for phase, metric in phases:
+            entries = data[phase].get(key)
+            if not entries:
+                continue
+            weak = is_weak_scaling(key[2])
+            reference = add_speedup(entries, weak)
+            # Amdahl's law only applies to a fixed problem size
+            serial_amdahl, t1 = fit_amdahl([e["cores"] for e in entries], [e["median"] for e in entries]) \
+                                if not weak else (np.nan, np.nan)
+            serial_gustafson = fit_gustafson([e["cores"] / reference["cores"] for e in entries],
+                                             [e["speedup"] for e in entries])
+            report.heading(f"Phase '{phase}' ({metric}){', weak scaling' if weak else ''}", 3)
+            report.paragraph(f"Reference: {reference['num_ranks']} ranks x {reference['num_threads']} threads "
+                             f"({fmt(reference['median'])} s). Serial fraction: {fmt(serial_amdahl)} (Amdahl, "
+                             f"estimated single-core runtime {fmt(t1)} s), {fmt(serial_gustafson)} (Gustafson).")
+            report.table(["ranks", "threads", "cores", "trials", "median (s)", "IQR (s)", "95% CI (s)", "speedup", "efficiency"],
+                         [[e["num_ranks"], e["num_threads"], e["cores"], e["n"], e["median"],
+                           f"{fmt(e['q25'])} - {fmt(e['q75'])}", f"{fmt(e['ci_low'])} - {fmt(e['ci_high'])}",
+                           e["speedup"], e["efficiency"]] for e in entries])
+            report.table(["core budget", "best ranks", "best threads", "median (s)", "efficiency"],
+                         [[budget, e["num_ranks"], e["num_threads"], e["median"], e["efficiency"]]
+                          for budget, e in best_splits(entries, budgets or sorted({e["cores"] for e in entries}))])
+            if plots:
+                report.figure(plot_scaling(entries, f"{group_title(*key)}: {phase}"),
+                              f"Runtime and parallel efficiency of phase '{phase}'")
+    return report
+
+if __name__ == "__main__":
+    # Parse commandline arguments
+    parser = argparse.ArgumentParser(description="Scaling report of the busyring benchmark results")
+    parser.add_argument("-db", help="SQLite database file (cf. 'benchmark_results.py')", type=str, default="busyring_benchmark_results.db")
+    parser.add_argument("-output", help="report file ('.md' for Markdown, '.html' for HTML)", type=str, default="busyring_scaling_report.html")
+    parser.add_argument("-budgets", help="core budgets to find the best split of ranks and threads for", type=int, nargs="*", default=None)
+    parser.add_argument("-no_plots", action='store_true', help="do not include plots", default=False)
+    args = parser.parse_args()
+    scaling_report(args.db, budgets=args.budgets, plots=not args.no_plots).write(args.output)
+    print(f"Wrote the scaling report to '{args.output}'.")
@@ -0,0 +1,160 @@
+"""
+Output of the recorded spikes, and readers for the different spike file formats
+"""
+
+import os
+import numpy as np
+
+# Layout of one spike in the binary formats (packed, 12 bytes per spike)
+spike_dtype = np.dtype([('t', '<f8'), ('gid', '<i4')])
+
+formats = ('npy', 'raw', 'mpiio', 'text', 'none')
+
+def sort_spikes(times, gids):
+    '''
+    Returns the spikes as array of 'spike_dtype', sorted by time and gid.
+    '''
+    spikes = np.empty(len(times), dtype=spike_dtype)
+    spikes['t'] = times
+    spikes['gid'] = gids
+    return spikes[np.lexsort((spikes['gid'], spikes['t']))]
+
+def rank_file(basename, rank, suffix):
+    return f"{basename}.rank{rank}{suffix}"
+
+def write_spikes(times, gids, pc, fmt='npy', basename='spikes'):
+    '''
+    Writes the spikes recorded on this rank (has to be called on all ranks).
+
+    Parameters
+    ----------
+    times : sequence of float
+      Spike times in ms.
+    gids : sequence of int
+      Gids of the spiking cells.
+    pc : h.ParallelContext
+      The parallel context.
+    fmt : str
+      Output format:
+        'npy'   - one '.npy' file per rank (memory-mappable);
+        'raw'   - one raw binary file per rank, with packed float64 time and int32 gid per spike;
+        'mpiio' - one raw binary file for all ranks, written collectively via MPI-IO (the spike
+                  counts per rank are written to an additional '.index' file);
+        'text'  - one text file per rank (or 'spikes.dat' if there is only one rank);
+        'none'  - no output.
+    basename : str
+      Path and base name of the output file(s).
+
+    Returns
+    -------
+    paths : list of str
+      The written files (on this rank).
+    '''
+    if fmt not in formats:
+        raise ValueError(f"Unknown spike output format '{fmt}' (use one of {', '.join(formats)}).")
+    rank = int(pc.id())
+    num_ranks = int(pc.nhost())
+    spikes = sort_spikes(np.array(times), np.array(gids))
+
+    if fmt == 'npy':
+        path = rank_file(basename, rank, ".npy")
+        np.save(path, spikes)
+    elif fmt == 'raw':
+        path = rank_file(basename, rank, ".bin")
+        spikes.tofile(path)
+    elif fmt == 'mpiio':
+        path = f"{basename}.bin"
+        write_spikes_mpiio(spikes, path)
+    elif fmt == 'text':
+        path = f"{basename}.dat" if num_ranks == 1 else rank_file(basename, rank, ".dat")
+        np.savetxt(path, np.column_stack([spikes['t'], spikes['gid']]),
+                   fmt="%.3f %d") # integer formatting for neuron number
+    else:
+        return []
+    return [path]
+
+def write_spikes_mpiio(spikes, path):
+    '''
+    Writes the (sorted) spikes of all ranks collectively into one file, as
+    consecutive blocks in order of the ranks. Rank 0 writes the number of
+    spikes of each rank to the file 'path.index'.
+    '''
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    counts = comm.allgather(len(spikes))
+    offset = sum(counts[:comm.Get_rank()]) * spike_dtype.itemsize
+    f = MPI.File.Open(comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    f.Set_size(0)
+    f.Write_at_all(offset, np.ascontiguousarray(spikes).view(np.uint8))
+    f.Close()
+    if comm.Get_rank() == 0:
+        np.savetxt(f"{path}.index", np.array(counts, dtype=np.int64), fmt="%d")
+
+def read_spikes(path, mmap=True):
+    '''
+    Reads a spike file (format determined by the suffix: '.npy', '.bin' for raw
+    binary files, text otherwise, e.g., 'spikes.dat' or CoreNEURON's 'out.dat').
+
+    Returns
+    -------
+    spikes : numpy.ndarray
+      Array of 'spike_dtype' (memory-mapped for the binary formats if 'mmap' is set).
+    '''
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode='r' if mmap else None)
+    elif path.endswith(".bin"):
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=spike_dtype)
+        return np.memmap(path, dtype=spike_dtype, mode='r') if mmap else np.fromfile(path, dtype=spike_dtype)
+    data = np.loadtxt(path, ndmin=2)
+    spikes = np.empty(len(data), dtype=spike_dtype)
+    if len(data) > 0:
+        spikes['t'] = data[:, 0]
+        spikes['gid'] = data[:, 1]
+    return spikes
+
+def spike_blocks(path, mmap=True):
+    '''
+    Returns the sorted blocks of spikes in a file: one block for per-rank files,
+    the blocks of all ranks for files written via MPI-IO (with '.index' file).
+    '''
+    spikes = read_spikes(path, mmap)
+    if os.path.isfile(f"{path}.index"):
+        counts = np.loadtxt(f"{path}.index", dtype=np.int64, ndmin=1)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        return [spikes[bounds[i]:bounds[i+1]] for i in range(len(counts))]
+    return [spikes]
+
+def merge_blocks(blocks, chunk_size=1048576):
+    '''
+    Merges sorted blocks of spikes in a streaming fashion (k-way merge), such
+    that at most 'chunk_size' spikes per block are held in memory at once.
+
+    Parameters
+    ----------
+    blocks : list of numpy.ndarray
+      Arrays of 'spike_dtype', each sorted by time and gid (may be memory-mapped).
+    chunk_size : int
+      Number of spikes per block to process at once.
+
+    Yields
+    ------
+    spikes : numpy.ndarray
+      Consecutive chunks of the globally sorted spikes.
+    '''
+    positions = [0] * len(blocks)
+    while True:
+        active = [i for i in range(len(blocks)) if positions[i] < len(blocks[i])]
+        if not active:
+            return
+        ends = {i: min(positions[i] + chunk_size, len(blocks[i])) for i in active}
+        # all spikes up to the smallest last spike of the current windows can be emitted
+        bound_t, bound_gid = min((blocks[i]['t'][ends[i]-1], blocks[i]['gid'][ends[i]-1]) for i in active)
+        parts = []
+        for i in active:
+            window = blocks[i][positions[i]:ends[i]]
+            n = np.count_nonzero((window['t'] < bound_t) | ((window['t'] == bound_t) & (window['gid'] <= bound_gid)))
+            parts.append(np.asarray(window[:n]))
+            positions[i] += n
+        merged = np.concatenate(parts)
+        yield merged[np.lexsort((merged['gid'], merged['t']))]
@@ -0,0 +1,91 @@
+"""
+Chunked simulation runs with telemetry of the progress (throughput, spike counts and
+chunk times per rank), streamed to a JSON-lines file
+"""
+
+import json
+import math
+import time
+
+class ChunkedRun:
+    """
+    Advances the simulation in chunks of a multiple of the minimum delay, with one line of
+    telemetry per chunk, and aborts the run if the throughput falls below a threshold.
+    """
+    def __init__(self, pc, chunk, min_delay, filename="", min_throughput=0):
+        if chunk <= 0 or not math.isclose(chunk / min_delay, round(chunk / min_delay)):
+            raise ValueError(f"The chunk length ({chunk} ms) has to be a positive multiple of the minimum delay ({min_delay} ms).")
+        self.pc = pc
+        self.chunk = chunk                      # simulated time per chunk in ms
+        self.min_throughput = min_throughput    # minimum throughput in simulated ms per wall second (0: no abort)
+        self.aborted_at = None                  # simulated time at which the last run has been aborted (None if completed)
+        self.file = open(filename, "w") if filename and pc.id() == 0 else None
+
+    def run(self, tstop, spike_times, trial=0, on_chunk=None):
+        '''
+        Runs the simulation until 'tstop' (has to be called on all ranks after initialization).
+        The throughput threshold is applied from the second chunk on, such that the warm-up
+        does not cause an abort. The decision to abort is based on the slowest rank and is
+        therefore the same on all ranks.
+
+        Parameters
+        ----------
+        tstop : float
+          End of the simulation in ms.
+        spike_times : h.Vector
+          Spike times recorded on this rank (to count the spikes).
+        trial : int
+          Number of the trial (for the telemetry).
+        on_chunk : callable
+          Called after each chunk (e.g., to flush recordings).
+
+        Returns
+        -------
+        completed : bool
+          Whether the run has reached 'tstop' (False if it has been aborted).
+        '''
+        from neuron import h
+        self.aborted_at = None
+        run_start = time.perf_counter()
+        chunk_index = 0
+        while h.t < tstop - 1e-9:
+            t_before = h.t
+            chunk_start = time.perf_counter()
+            self.pc.psolve(min(h.t + self.chunk, tstop))
+            chunk_time = time.perf_counter() - chunk_start
+            advanced = h.t - t_before # (shorter than a chunk at the end of the run)
+            if on_chunk is not None:
+                on_chunk()
+
+            # chunk time of each rank and total number of spikes so far
+            rank_times = self.pc.py_allgather(chunk_time)
+            num_spikes = sum(self.pc.py_allgather(int(spike_times.size())))
+            elapsed = time.perf_counter() - run_start
+            throughput = advanced / max(rank_times) if max(rank_times) > 0 else float("inf")
+            entry = {"trial": trial, "chunk": chunk_index, "t": h.t, "wall": elapsed,
+                     "chunk_time_max": max(rank_times), "throughput": throughput,
+                     "mean_throughput": h.t / elapsed if elapsed > 0 else float("inf"),
+                     "spikes": num_spikes, "rank_times": rank_times}
+            if self.file is not None:
+                self.file.write(json.dumps(entry) + "\n")
+                self.file.flush()
+            if self.pc.id() == 0:
+                print(f"Chunk {chunk_index} (trial {trial}): t = {h.t:.1f} ms; {throughput:.3f} ms/s "
+                      f"(chunk time max {max(rank_times):.3f} s); {num_spikes} spikes")
+
+            if self.min_throughput and chunk_index > 0 and throughput < self.min_throughput:
+                self.aborted_at = h.t
+                if self.pc.id() == 0:
+                    print(f"Run aborted at t = {h.t:.1f} ms: throughput {throughput:.3f} ms/s "
+                          f"below threshold {self.min_throughput} ms/s")
+                return False
+            chunk_index += 1
+        return True
+
+    def close(self):
+        '''
+        Closes the telemetry file.
+        '''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
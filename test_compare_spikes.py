@@ -0,0 +1,52 @@
+"""
+Tests of the matching of spike rasters
+"""
+
+import numpy as np
+import compare_spikes
+import spike_output
+
+def reference_match(ref, cand, tolerance):
+    '''
+    Matches the spikes by brute force: the nearest candidate spike of the same gid within the
+    tolerance, and of several reference spikes with the same match, the closest (the first on ties).
+    '''
+    best = np.full(len(ref), -1, dtype=np.int64)
+    best_dist = np.full(len(ref), np.inf)
+    for i, spike in enumerate(ref):
+        same_gid = np.flatnonzero(cand['gid'] == spike['gid'])
+        if len(same_gid) == 0:
+            continue
+        dist = np.abs(cand['t'][same_gid] - spike['t'])
+        j = np.argmin(dist)
+        if dist[j] <= tolerance:
+            best[i], best_dist[i] = same_gid[j], dist[j]
+    ref_match = np.full(len(ref), -1, dtype=np.int64)
+    for j in set(best[best >= 0].tolist()):
+        competing = np.flatnonzero(best == j)
+        ref_match[competing[np.argmin(best_dist[competing])]] = j
+    return ref_match
+
+def spikes(t, gid):
+    s = np.empty(len(t), dtype=spike_output.spike_dtype)
+    s['t'], s['gid'] = t, gid
+    return s
+
+def test_match_spikes():
+    rng = np.random.default_rng(2)
+    tolerance = 0.025
+    for _ in range(20):
+        ref = spikes(rng.uniform(0, 100, size=200), rng.integers(0, 10, size=200))
+        # shifted copies (some beyond the tolerance), with spikes dropped and added
+        keep = rng.uniform(size=len(ref)) < 0.9
+        cand = spikes(ref['t'][keep] + rng.uniform(-2*tolerance, 2*tolerance, size=keep.sum()), ref['gid'][keep])
+        cand = np.concatenate([cand, spikes(rng.uniform(0, 100, size=20), rng.integers(0, 10, size=20))])
+        cand = cand[rng.permutation(len(cand))]
+        assert np.array_equal(compare_spikes.match_spikes(ref, cand, tolerance), reference_match(ref, cand, tolerance))
+
+def test_match_spikes_one_to_one():
+    ref = spikes([10.0, 10.02, 20.0], [1, 1, 2])
+    cand = spikes([10.015, 20.0], [1, 3])
+    # both reference spikes of gid 1 are within the tolerance, the closer one wins; gid 2 has no candidate
+    assert compare_spikes.match_spikes(ref, cand, 0.025).tolist() == [-1, 0, -1]
+    assert compare_spikes.match_spikes(ref, cand[:0], 0.025).tolist() == [-1, -1, -1]
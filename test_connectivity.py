@@ -0,0 +1,39 @@
+"""
+Tests of the connectivity tables against the connections drawn one synapse at a time
+"""
+
+import numpy as np
+import connectivity
+
+def reference_connections(gid, num_cells, ring_size, num_synapses, min_delay):
+    '''
+    Returns the sources and delays of the connections of one gid as drawn by the original
+    implementation (ring connection first, then one draw per random synapse).
+    '''
+    ring_start = ring_size * (gid // ring_size)
+    ring_end = min(ring_start + ring_size, num_cells)
+    sources = [ring_end - 1 if gid == ring_start else gid - 1]
+    delays = [min_delay]
+    src_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    delay_gen = np.random.Generator(np.random.MT19937(seed=gid))
+    for _ in range(num_synapses):
+        src = src_gen.integers(0, num_cells - 2)
+        if src == gid:
+            src += 1
+        sources.append(src)
+        delays.append(min_delay + delay_gen.uniform(0, 2*min_delay))
+    return sources, delays
+
+def test_generate_connections():
+    # (the last ring is incomplete)
+    num_cells, ring_size, num_synapses, min_delay = 103, 4, 10, 5.0
+    gids = np.arange(1, num_cells, 3)
+    table = connectivity.generate_connections(gids, num_cells, ring_size, num_synapses, min_delay)
+    assert len(table) == len(gids) * (num_synapses + 1)
+    for i, gid in enumerate(gids.tolist()):
+        rows = slice(i * (num_synapses + 1), (i + 1) * (num_synapses + 1))
+        sources, delays = reference_connections(gid, num_cells, ring_size, num_synapses, min_delay)
+        assert np.all(table.target[rows] == gid)
+        assert np.array_equal(table.synapse[rows], np.arange(num_synapses + 1))
+        assert np.array_equal(table.source[rows], sources)
+        assert np.array_equal(table.delay[rows], delays)
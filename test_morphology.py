@@ -0,0 +1,36 @@
+"""
+Tests of the morphology specifications that are computed for many gids at once
+"""
+
+import numpy as np
+import morphology
+import parameters
+
+def cell_params(depth=10, branch_probs=(1.0, 0.5), compartments=(2, 1)):
+    params = parameters.cell_parameters(None, list(branch_probs), list(compartments), 10)
+    params.max_depth = depth
+    return params
+
+def test_branching_counts():
+    for params in (cell_params(), cell_params(depth=4, branch_probs=(0.8, 0.2)), cell_params(depth=0)):
+        gids = np.arange(300)
+        counts = morphology.branching_counts(gids, params, chunk_size=128)
+        for gid in gids.tolist():
+            tree = morphology.branching_tree(gid, params)
+            expected = np.bincount(tree.level, minlength=params.max_depth + 1)
+            assert np.array_equal(counts[gid], expected)
+
+def test_compartment_counts():
+    params = cell_params()
+    nsec, ncomp = morphology.compartment_counts(range(100), params)
+    for gid in range(100):
+        tree = morphology.branching_tree(gid, params)
+        assert nsec[gid] == tree.nsec and ncomp[gid] == tree.ncomp
+
+def test_compartment_counts_cache(tmp_path):
+    params = cell_params()
+    expected = morphology.compartment_counts(range(50), params)
+    stored = morphology.compartment_counts(range(50), params, str(tmp_path))
+    loaded = morphology.compartment_counts(range(50), params, str(tmp_path))
+    for counts in (stored, loaded):
+        assert all(np.array_equal(a, b) for a, b in zip(counts, expected))
@@ -0,0 +1,30 @@
+"""
+Tests of the vectorized replay of numpy's seeding and MT19937 streams
+"""
+
+import numpy as np
+import mt19937
+
+# small, consecutive and large gids (up to the largest seed)
+gids = list(range(64)) + [1000, 12345, 2**16 + 1, 2**31 - 1, 2**31, 2**32 - 1]
+
+def test_seed_keys():
+    keys = mt19937.seed_keys(gids)
+    for gid, key in zip(gids, keys):
+        assert np.array_equal(key, np.random.MT19937(seed=gid).state["state"]["key"])
+
+def test_uniform():
+    # more draws than one generation of the state, such that the twist is covered
+    count = 1500
+    doubles = mt19937.RandomStreams(gids).uniform(count)
+    for gid, row in zip(gids, doubles):
+        expected = np.random.Generator(np.random.MT19937(seed=gid)).uniform(0, 1, size=count)
+        assert np.array_equal(row[:count], expected)
+
+def test_uniform_incremental():
+    streams = mt19937.RandomStreams(gids[:8])
+    first = streams.uniform(10)[:, :10].copy()
+    more = streams.uniform(700)
+    assert np.array_equal(more[:, :10], first)
+    for gid, row in zip(gids[:8], more):
+        assert np.array_equal(row[:700], np.random.Generator(np.random.MT19937(seed=gid)).random(700))
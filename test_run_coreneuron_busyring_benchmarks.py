@@ -0,0 +1,39 @@
+"""
+Tests of the parsing of the log files of run_ring_network.py by the benchmark driver
+"""
+
+import contextlib
+from metering import RuntimeMetering
+from run_coreneuron_busyring_benchmarks import extract_benchmark_data, extract_trial_runtimes
+
+def write_summary(path, trials):
+    '''
+    Writes the metering summary of a run with the given number of trials to a log file (with the
+    statistics across ranks as after 'RuntimeMetering.reduce()') and returns the metering.
+    '''
+    meter = RuntimeMetering()
+    meter.add_checkpoint("model-init")
+    for trial in range(trials):
+        meter.add_checkpoint(f"run-trial-{trial}")
+    meter.set_info("dataset-cache", "miss")
+    for name, time in list(meter.metering_checkpoints.items()) + [(meter.name_total, meter.total())]:
+        meter.reduced_checkpoints[name] = {"min": time, "mean": time, "max": time, "imbalance": 1.0}
+    with open(path, "w") as f, contextlib.redirect_stdout(f):
+        meter.print_summary()
+        meter.print_statistics("run-trial-")
+    return meter
+
+def test_extract_trial_runtimes(tmp_path):
+    log_file = tmp_path / "run.log"
+    meter = write_summary(log_file, 3)
+    runtimes = extract_trial_runtimes(log_file)
+    assert [float(runtime) for runtime in runtimes] == [meter.metering_checkpoints[f"run-trial-{trial}"]
+                                                        for trial in range(3)]
+
+def test_extract_benchmark_data(tmp_path):
+    log_file = tmp_path / "run.log"
+    meter = write_summary(log_file, 2)
+    results = extract_benchmark_data(log_file)
+    assert float(results["runtime_model_init"]) == meter.metering_checkpoints["model-init"]
+    assert float(results["runtime_total"]) == meter.total()
+    assert results["dataset_cache"] == "miss"
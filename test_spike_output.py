@@ -0,0 +1,26 @@
+"""
+Tests of the streaming merge of sorted spike blocks
+"""
+
+import numpy as np
+import spike_output
+
+def random_block(rng, size, num_gids=20):
+    spikes = np.empty(size, dtype=spike_output.spike_dtype)
+    spikes['t'] = np.round(rng.uniform(0, 50, size=size), 1) # (coarse times, such that there are ties)
+    spikes['gid'] = rng.integers(0, num_gids, size=size)
+    return spikes[np.lexsort((spikes['gid'], spikes['t']))]
+
+def test_merge_blocks():
+    rng = np.random.default_rng(1)
+    blocks = [random_block(rng, size) for size in (0, 1, 17, 100, 333)]
+    expected = np.concatenate(blocks)
+    expected = expected[np.lexsort((expected['gid'], expected['t']))]
+    for chunk_size in (1, 7, 64, 1000):
+        chunks = list(spike_output.merge_blocks(blocks, chunk_size))
+        assert all(len(chunk) > 0 for chunk in chunks)
+        assert np.array_equal(np.concatenate(chunks), expected)
+
+def test_merge_no_blocks():
+    assert list(spike_output.merge_blocks([])) == []
+    assert list(spike_output.merge_blocks([np.empty(0, dtype=spike_output.spike_dtype)])) == []